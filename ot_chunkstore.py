@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Generated with the assistance of Claude (Anthropic).
+# Model: Claude (Anthropic), version not recorded        Date: 2026-10-18
+# Reviewed, tested, and validated by the Gan Lab (Anaphase); the authors take
+# full responsibility for the correctness of this code.
+# Lab: https://github.com/anaphaze | https://www.anaphase.org
+# -----------------------------------------------------------------------------
+# ot_chunkstore.py -- chunked, compressed, multiscale volumes for sparse remapped models
+#
+# Dependencies: numpy, mrcfile (works with python 2.7 and 3)
+# Created 20261018 (agent)
+#
+# A volume is stored as a directory in the zarr v2 layout, so zarr, napari, neuroglancer
+# (through a file server) and other OME-Zarr viewers can open it directly:
+#   remap.zarr/.zgroup, .zattrs     multiscale metadata, voxel size, header statistics
+#   remap.zarr/0/.zarray, 0.0.0 ... full resolution, one zlib-compressed file per chunk
+#   remap.zarr/1/ ...               2x downsampled (mean of 2x2x2 voxels), and so on
+# Chunks that are all zero are not stored. Written chunks are kept in a memory cache;
+# when one leaves the cache, it is compressed to disk and its downsampled copy is
+# written into the next level, so the pyramid is built while the volume is filled.
+#
+# Used by ot_remap_v2.py (--format zarr). From the shell, converts a store to MRC:
+#   ot_chunkstore.py remap.zarr remap.mrc        (full resolution)
+#   ot_chunkstore.py remap.zarr remap_bin4.mrc 2 (level 2 = binned by 4)
+
+from __future__ import print_function
+import os, sys, json, zlib, collections
+import numpy
+
+
+class ChunkArray(object):
+	"""
+	One level of a ChunkStore: a (z, y, x) array that reads and writes like a numpy
+	array (slices or integers per axis; steps are not supported).
+	"""
+	def __init__(self, path, shape, chunk, dtype, cache_bytes, parent=None):
+		self.path = path
+		self.shape = tuple(int(n) for n in shape)
+		self.chunk = int(chunk)
+		self.dtype = numpy.dtype(dtype)
+		self.size = self.shape[0]*self.shape[1]*self.shape[2]
+		self.ndim = 3
+		self.cache_bytes = cache_bytes
+		self.cache = collections.OrderedDict()
+		self.nbytes = 0
+		self.parent = parent
+		self.next_level = None
+		self.chunks_written = 0
+		self.bytes_written = 0
+
+	def create(self):
+		if not os.path.isdir(self.path):
+			os.makedirs(self.path)
+		meta = {"zarr_format": 2, "shape": list(self.shape), "chunks": [self.chunk]*3, "dtype": self.dtype.str,
+			"compressor": {"id": "zlib", "level": 1}, "fill_value": 0, "order": "C", "filters": None,
+			"dimension_separator": "."}
+		with open(os.path.join(self.path, ".zarray"), "w") as f:
+			json.dump(meta, f, indent=1)
+
+	def _file(self, key):
+		return os.path.join(self.path, "%d.%d.%d" % key)
+
+	def _load(self, key):
+		# Chunk array from the cache, the disk, or zeros
+		if key in self.cache:
+			entry = self.cache.pop(key)
+			self.cache[key] = entry
+			return entry
+		try:
+			with open(self._file(key), "rb") as f:
+				arr = numpy.frombuffer(zlib.decompress(f.read()), dtype=self.dtype).reshape((self.chunk,)*3).copy()
+		except (IOError, OSError):
+			arr = numpy.zeros((self.chunk,)*3, dtype=self.dtype)
+		entry = [arr, False]
+		self.cache[key] = entry
+		self.nbytes += arr.nbytes
+		while self.nbytes > self.cache_bytes and len(self.cache) > 1:
+			old_key = next(iter(self.cache))
+			self._evict(old_key)
+		return entry
+
+	def _evict(self, key):
+		arr, dirty = self.cache.pop(key)
+		self.nbytes -= arr.nbytes
+		if dirty:
+			self._store(key, arr)
+
+	def _store(self, key, arr):
+		# Compress a changed chunk to disk (or delete it if it is now empty), then
+		# pass its downsampled copy on to the next level
+		if arr.any():
+			data = zlib.compress(arr.tobytes(), 1)
+			tmp = self._file(key) + ".tmp"
+			with open(tmp, "wb") as f:
+				f.write(data)
+			os.rename(tmp, self._file(key))
+			self.chunks_written += 1
+			self.bytes_written += len(data)
+		elif os.path.exists(self._file(key)):
+			os.remove(self._file(key))
+		if self.next_level is not None:
+			half = self.chunk//2
+			small = arr.astype("float64").reshape(half, 2, half, 2, half, 2).mean(axis=(1, 3, 5))
+			start = [k*half for k in key]
+			stop = [min(start[i] + half, self.next_level.shape[i]) for i in range(3)]
+			if all(stop[i] > start[i] for i in range(3)):
+				self.next_level[start[0]:stop[0], start[1]:stop[1], start[2]:stop[2]] = \
+					small[:stop[0]-start[0], :stop[1]-start[1], :stop[2]-start[2]]
+
+	def _bounds(self, key):
+		# key -> list of (start, stop) per axis
+		if not isinstance(key, tuple):
+			key = (key,)
+		key = key + (slice(None),)*(3 - len(key))
+		bounds = []
+		squeeze = []
+		for axis, k in enumerate(key):
+			n = self.shape[axis]
+			if isinstance(k, slice):
+				start, stop, step = k.indices(n)
+				if step != 1:
+					raise IndexError("ChunkArray does not support steps")
+				bounds.append((start, max(start, stop)))
+			else:
+				k = int(k)
+				if k < 0:
+					k += n
+				if not 0 <= k < n:
+					raise IndexError("index %s out of range for axis %s of size %s" % (k, axis, n))
+				bounds.append((k, k + 1))
+				squeeze.append(axis)
+		return bounds, tuple(squeeze)
+
+	def _chunks(self, bounds):
+		# (chunk key, slices in the chunk, slices in the request) for every chunk a request touches
+		c = self.chunk
+		ranges = [range(lo//c, (hi - 1)//c + 1) if hi > lo else range(0) for lo, hi in bounds]
+		for kz in ranges[0]:
+			for ky in ranges[1]:
+				for kx in ranges[2]:
+					key = (kz, ky, kx)
+					inner = []
+					outer = []
+					for axis, k in enumerate(key):
+						lo = max(bounds[axis][0], k*c)
+						hi = min(bounds[axis][1], (k + 1)*c)
+						inner.append(slice(lo - k*c, hi - k*c))
+						outer.append(slice(lo - bounds[axis][0], hi - bounds[axis][0]))
+					yield key, tuple(inner), tuple(outer)
+
+	def __getitem__(self, key):
+		bounds, squeeze = self._bounds(key)
+		out = numpy.zeros([hi - lo for lo, hi in bounds], dtype=self.dtype)
+		for chunk_key, inner, outer in self._chunks(bounds):
+			if chunk_key in self.cache or os.path.exists(self._file(chunk_key)):
+				out[outer] = self._load(chunk_key)[0][inner]
+		return out.squeeze(axis=squeeze) if squeeze else out
+
+	def __setitem__(self, key, value):
+		bounds, squeeze = self._bounds(key)
+		value = numpy.asarray(value, dtype=self.dtype)
+		value = numpy.broadcast_to(value.reshape([hi - lo if i not in squeeze else 1 for i, (lo, hi) in enumerate(bounds)])
+			if value.ndim else value, [hi - lo for lo, hi in bounds])
+		for chunk_key, inner, outer in self._chunks(bounds):
+			entry = self._load(chunk_key)
+			entry[0][inner] = value[outer]
+			entry[1] = True
+
+	def flush(self):
+		# Write every changed chunk, keeping the cache
+		for key, entry in self.cache.items():
+			if entry[1]:
+				self._store(key, entry[0])
+				entry[1] = False
+
+
+class ChunkStore(object):
+	"""
+	A multiscale chunked volume (see the top of this file). data is the full
+	resolution ChunkArray; levels holds all of them, each half the size of the last.
+	attrs are saved in .zattrs by close().
+	"""
+	def __init__(self, path, levels, attrs):
+		self.path = path
+		self.levels = levels
+		self.data = levels[0]
+		self.attrs = attrs
+
+	@classmethod
+	def create(cls, path, shape, dtype="float32", chunk=64, nlevels=None, cache_mb=256.0):
+		"""
+		New store for a (z, y, x) volume. chunk must be even; by default levels are
+		added until the coarsest one fits in a single chunk.
+		"""
+		if os.path.exists(path):
+			raise ValueError("%s already exists" % path)
+		if chunk % 2:
+			raise ValueError("chunk size must be even")
+		levels = []
+		shape = tuple(int(n) for n in shape)
+		while True:
+			level = ChunkArray(os.path.join(path, str(len(levels))), shape, chunk, dtype, int(cache_mb*1048576))
+			level.create()
+			if levels:
+				levels[-1].next_level = level
+			levels.append(level)
+			if (nlevels is not None and len(levels) >= nlevels) or (nlevels is None and max(shape) <= chunk):
+				break
+			shape = tuple((n + 1)//2 for n in shape)
+		with open(os.path.join(path, ".zgroup"), "w") as f:
+			json.dump({"zarr_format": 2}, f)
+		store = cls(path, levels, {})
+		store.write_attrs()
+		return store
+
+	@classmethod
+	def open(cls, path, cache_mb=256.0):
+		with open(os.path.join(path, ".zattrs")) as f:
+			attrs = json.load(f)
+		levels = []
+		for dataset in attrs["multiscales"][0]["datasets"]:
+			with open(os.path.join(path, dataset["path"], ".zarray")) as f:
+				meta = json.load(f)
+			level = ChunkArray(os.path.join(path, dataset["path"]), meta["shape"], meta["chunks"][0], meta["dtype"], int(cache_mb*1048576))
+			if levels:
+				levels[-1].next_level = level
+			levels.append(level)
+		return cls(path, levels, attrs.get("ot_remap", {}))
+
+	def write_attrs(self):
+		voxel = float(self.attrs.get("voxel_size", 1.0))
+		datasets = [{"path": str(i), "coordinateTransformations": [{"type": "scale", "scale": [voxel*2**i]*3}]}
+			for i in range(len(self.levels))]
+		meta = {"multiscales": [{"version": "0.4", "name": os.path.basename(self.path.rstrip("/")),
+			"axes": [{"name": name, "type": "space"} for name in "zyx"], "datasets": datasets,
+			"type": "mean"}], "ot_remap": self.attrs}
+		with open(os.path.join(self.path, ".zattrs"), "w") as f:
+			# numpy scalars and arrays (e.g. a start position) are saved as plain numbers
+			json.dump(meta, f, indent=1, default=lambda v: v.tolist())
+
+	def flush(self):
+		# Level by level, as flushing a level updates the next one
+		for level in self.levels:
+			level.flush()
+		self.write_attrs()
+
+	def close(self):
+		self.flush()
+		for level in self.levels:
+			level.cache.clear()
+			level.nbytes = 0
+
+	def report(self):
+		data = self.data
+		stored = sum(level.bytes_written for level in self.levels)
+		print("%s: %s chunks of %s^3 written at full resolution, %.1f MB compressed in %s levels (dense: %.1f MB)"
+			% (self.path, data.chunks_written, data.chunk, stored/1048576.0, len(self.levels), data.size*data.dtype.itemsize/1048576.0))
+
+
+def to_mrc(path, mrc_file, level=0):
+	"""
+	Write one level of a ChunkStore to an MRC file, a chunk-thick slab at a time.
+	"""
+	import mrcfile
+	store = ChunkStore.open(path)
+	data = store.levels[level]
+	mode = {"float32": 2, "uint16": 6, "int16": 1}[data.dtype.name]
+	with mrcfile.new_mmap(mrc_file, shape=data.shape, mrc_mode=mode) as mrc:
+		for z in range(0, data.shape[0], data.chunk):
+			mrc.data[z:z+data.chunk] = data[z:z+data.chunk]
+		voxel = store.attrs.get("voxel_size")
+		if voxel:
+			mrc.voxel_size = voxel*2**level
+			start = store.attrs.get("start")
+			if start and level == 0:
+				mrc.header.nxstart, mrc.header.nystart, mrc.header.nzstart = start
+				mrc.header.origin.x, mrc.header.origin.y, mrc.header.origin.z = [-v*voxel for v in start]
+		if level == 0 and "dmin" in store.attrs:
+			mrc.header.dmin, mrc.header.dmax = store.attrs["dmin"], store.attrs["dmax"]
+			mrc.header.dmean, mrc.header.rms = store.attrs["dmean"], store.attrs["rms"]
+		else:
+			mrc.update_header_stats()
+
+
+if __name__ == "__main__":
+	#---------- BEGIN User inputs ------------------------------
+	try:
+		store_path = sys.argv[1]
+		mrc_file = sys.argv[2]
+	except IndexError:
+		print("================================================================")
+		print("Usage:>>   ot_chunkstore.py [Store] [Output] [Level]")
+		print("Example:   ot_chunkstore.py remap_001.zarr remap_001.mrc")
+		print("----------------------------------------------------------------")
+		print("Store:     Chunked volume written by ot_remap_v2.py --format zarr")
+		print("Output:    Name of the .mrc file to write")
+		print("Level:     (optional) 0 = full resolution (default), 1 = binned by 2, ...")
+		print("----------------------------------------------------------------")
+		sys.exit()
+	level = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+	#----------- END User inputs -------------------------------
+	to_mrc(store_path, mrc_file, level)
+	print("Wrote %s" % mrc_file)
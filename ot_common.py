@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Generated with the assistance of Claude (Anthropic).
+# Model: Claude (Anthropic), version not recorded        Date: 2026-10-18
+# Reviewed, tested, and validated by the Gan Lab (Anaphase); the authors take
+# full responsibility for the correctness of this code.
+# Lab: https://github.com/anaphaze | https://www.anaphase.org
+# -----------------------------------------------------------------------------
+# ot_common.py -- option parsing, MRC data maps and worker pools shared by the ot_ scripts
+#
+# Dependencies: numpy, mrcfile (for data_memmap only) (works with python 2.7 and 3)
+# Created 20261018 (agent)
+#
+# Worker processes find what they share (file names, arrays, settings) in a module
+# level dict of the script, e.g. _query_job in ot_nnd.py, which the script fills in
+# before it starts the pool. Forked workers inherit the dict as it is; workers that
+# are spawned instead (the default on macOS and Windows, and with forkserver) start
+# from a fresh import, so worker_pool() hands them a copy through the pool's
+# initializer.
+#
+# Example:
+#   import ot_common
+#   args, opts = ot_common.parse_options(sys.argv[1:], {"--jobs": 1, "--verbose": False})
+#   pool = ot_common.worker_pool(opts["--jobs"], __name__, "_query_job")
+
+from __future__ import print_function
+import sys, multiprocessing
+import numpy
+
+
+def parse_options(argv, defaults):
+	"""
+	Pull "--name value" options (or a bare "--name" for on/off flags) out of argv.
+	The type of each value is taken from its default in the defaults dict.
+	Returns the remaining positional arguments and a dict of option values.
+	"""
+	opts = dict(defaults)
+	args = []
+	i = 0
+	while i < len(argv):
+		name = argv[i]
+		if name not in defaults:
+			args.append(name)
+			i += 1
+			continue
+		if isinstance(defaults[name], bool):
+			opts[name] = True
+			i += 1
+			continue
+		try:
+			opts[name] = type(defaults[name])(argv[i+1])
+		except (IndexError, ValueError):
+			print("Option %s needs a %s value.. exiting" % (name, type(defaults[name]).__name__))
+			sys.exit()
+		i += 2
+	return args, opts
+
+def data_memmap(mrc_file):
+	"""
+	Writable numpy memmap of the data block of an existing MRC file. The header is
+	left alone, so several processes can write disjoint parts of the data at once.
+	"""
+	import mrcfile
+	with mrcfile.open(mrc_file, mode='r', header_only=True) as mrc:
+		header = mrc.header
+		offset = header.nbytes + header.nsymbt.item()
+		dtype = mrcfile.utils.data_dtype_from_header(header)
+		shape = mrcfile.utils.data_shape_from_header(header)
+	return numpy.memmap(mrc_file, dtype=dtype, mode="r+", offset=offset, shape=shape)
+
+def start_method():
+	# How the pool's workers are started: "fork", "spawn" or "forkserver" (python 2 always forks)
+	if hasattr(multiprocessing, "get_start_method"):
+		return multiprocessing.get_start_method()
+	return "fork"
+
+def load_job(module, name, job):
+	# Pool initializer: fill in the dict name of module in a spawned worker
+	shared = getattr(sys.modules[module], name)
+	shared.clear()
+	shared.update(job)
+
+def worker_pool(jobs, module, name):
+	"""
+	multiprocessing.Pool of jobs workers that share the dict name of module (e.g.
+	__name__, "_query_job"), as it is now. Forked workers inherit it, which also
+	keeps memory maps and large arrays from being copied; otherwise each worker
+	gets a pickled copy through the pool's initializer.
+	"""
+	if start_method() == "fork":
+		return multiprocessing.Pool(jobs)
+	# A spawned worker imports a script as __mp_main__ and lists it as __main__ too, so
+	# module names the same dict in the workers as here
+	return multiprocessing.Pool(jobs, initializer=load_job, initargs=(module, name, dict(getattr(sys.modules[module], name))))
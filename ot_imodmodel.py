@@ -0,0 +1,136 @@
+# -----------------------------------------------------------------------------
+# Generated with the assistance of Claude (Anthropic).
+# Model: Claude (Anthropic), version not recorded        Date: 2026-10-18
+# Reviewed, tested, and validated by the Gan Lab (Anaphase); the authors take
+# full responsibility for the correctness of this code.
+# Lab: https://github.com/anaphaze | https://www.anaphase.org
+# -----------------------------------------------------------------------------
+# ot_imodmodel.py -- read and write IMOD binary models (.mod) without model2point/point2model
+#
+# Dependencies: numpy (works with python 2.7 and 3)
+# Created 20261018 (agent)
+#
+# Follows the model file format in IMOD's binspec.html: big-endian, a 240-byte
+# header ("IMODV1.2" and the model data), then one chunk per object ("OBJT"), its
+# contours ("CONT") and meshes ("MESH"), other chunks that carry their own size
+# (views, clipping planes, point sizes, ...), and "IEOF". Reading keeps the model
+# header, the objects and their contours, as (N, 3) float arrays of x, y, z in
+# model (image pixel) coordinates, i.e. what "model2point -float" prints. Meshes
+# and the other chunks are skipped.
+#
+# Example:
+#   import ot_imodmodel
+#   xyz = ot_imodmodel.read_points("tm_hits.mod")        # all points, (N, 3)
+#   ot_imodmodel.write_points("random.mod", xyz, sphere=6)  # like point2model -scat -sphere 6
+
+from __future__ import print_function
+import struct
+import numpy
+
+_MODEL = struct.Struct(">128s4iI4i3f3f3i2ifii3f")      # 232 bytes after "IMODV1.2"
+_OBJECT = struct.Struct(">64s16IiIii3fi8B2i")          # 176 bytes
+_CONTOUR = struct.Struct(">iIii")
+_MESH = struct.Struct(">iiIhh")
+
+# Object flags (imodel.h)
+OBJ_OFF = 1 << 1
+OBJ_OPEN = 1 << 3
+OBJ_SCATTERED = 1 << 9
+
+
+def _text(raw):
+	return raw.split(b"\0", 1)[0].decode("latin-1")
+
+def read_model(filename):
+	"""
+	Read an IMOD model. Returns a dict with the model's name, size (xmax, ymax,
+	zmax), pixel_size, units, scale and flags, and objects: a list of dicts with
+	name, flags, color (r, g, b from 0 to 1), sphere (point radius, pdrawsize) and
+	contours, a list of (N, 3) float32 arrays of x, y, z.
+	"""
+	with open(filename, "rb") as f:
+		data = f.read()
+	if data[:4] != b"IMOD":
+		raise ValueError("%s is not an IMOD model" % filename)
+	fields = _MODEL.unpack_from(data, 8)
+	model = {"name": _text(fields[0]), "size": fields[1:4], "flags": fields[5],
+		"scale": fields[13:16], "pixel_size": fields[21], "units": fields[22], "objects": []}
+	pos = 8 + _MODEL.size
+	obj = None
+	while pos + 4 <= len(data):
+		tag = data[pos:pos+4]
+		pos += 4
+		if tag == b"OBJT":
+			fields = _OBJECT.unpack_from(data, pos)
+			pos += _OBJECT.size
+			obj = {"name": _text(fields[0]), "flags": fields[18], "color": fields[21:24],
+				"sphere": fields[24], "contours": []}
+			model["objects"].append(obj)
+		elif tag == b"CONT":
+			npoint = _CONTOUR.unpack_from(data, pos)[0]
+			pos += _CONTOUR.size
+			points = numpy.frombuffer(data, dtype=">f4", count=3*npoint, offset=pos).reshape(npoint, 3)
+			pos += 12*npoint
+			if obj is None:
+				raise ValueError("%s has a contour before its first object" % filename)
+			obj["contours"].append(points.astype("float32"))
+		elif tag == b"MESH":
+			nvert, nlist = _MESH.unpack_from(data, pos)[:2]
+			pos += _MESH.size + 12*nvert + 4*nlist
+		elif tag == b"IEOF":
+			break
+		else:
+			# Every other chunk (IMAT, SIZE, VIEW, CLIP, MINX, ...) starts with its size in bytes
+			pos += 4 + struct.unpack_from(">i", data, pos)[0]
+	return model
+
+def model_points(model, objects=None):
+	"""
+	All points of a model read by read_model() (or of the listed objects, numbered
+	from 1), as an (N, 3) float array, with the object and contour number of each
+	point (from 1, as in "model2point -object -contour").
+	"""
+	points, object_ids, contour_ids = [numpy.zeros((0, 3))], [], []
+	for i, obj in enumerate(model["objects"]):
+		if objects is not None and i + 1 not in objects:
+			continue
+		for j, contour in enumerate(obj["contours"]):
+			points.append(contour)
+			object_ids += [i + 1]*len(contour)
+			contour_ids += [j + 1]*len(contour)
+	return numpy.vstack(points).astype(float), numpy.array(object_ids, dtype=int), numpy.array(contour_ids, dtype=int)
+
+def read_points(filename, objects=None):
+	# (N, 3) x, y, z of every point of a model file (or of the listed objects, from 1)
+	return model_points(read_model(filename), objects)[0]
+
+def write_model(filename, objects, size=None, name="", pixel_size=1.0, units=0):
+	"""
+	Write an IMOD model. objects is a list of dicts as returned by read_model():
+	contours (list of (N, 3) arrays) is needed; name, flags (default 0, closed
+	contours), color (default green), sphere (default 0) are optional. size is the
+	model's xmax, ymax, zmax (default: just large enough for the points).
+	"""
+	points = [numpy.asarray(c, dtype=float).reshape(-1, 3) for obj in objects for c in obj["contours"]]
+	if size is None:
+		top = numpy.vstack(points + [numpy.zeros((1, 3))]).max(axis=0)
+		size = [int(numpy.ceil(v)) + 1 for v in top]
+	chunks = [b"IMODV1.2", _MODEL.pack(name.encode("latin-1")[:127], int(size[0]), int(size[1]), int(size[2]),
+		len(objects), 0, 1, 1, 0, 255, 0.0, 0.0, 0.0, 1.0, 1.0, 1.0, 0, 0, 0, 3, 128, float(pixel_size), int(units),
+		0, 0.0, 0.0, 0.0)]
+	for obj in objects:
+		color = obj.get("color", (0.0, 1.0, 0.0))
+		chunks.append(b"OBJT" + _OBJECT.pack(*([obj.get("name", "").encode("latin-1")[:63]] + [0]*16
+			+ [len(obj["contours"]), int(obj.get("flags", 0)), 0, 1] + [float(c) for c in color]
+			+ [int(obj.get("sphere", 0)), 1, 3, 1, 1, 0, 0, 0, 0, 0, 0])))
+		for contour in obj["contours"]:
+			contour = numpy.asarray(contour, dtype=">f4").reshape(-1, 3)
+			chunks.append(b"CONT" + _CONTOUR.pack(len(contour), 0, 0, 0) + contour.tobytes())
+	chunks.append(b"IEOF")
+	with open(filename, "wb") as f:
+		f.write(b"".join(chunks))
+
+def write_points(filename, points, size=None, sphere=6, color=(0.0, 1.0, 0.0), name=""):
+	# One object of scattered points, shown as spheres of radius sphere (point2model -scat -sphere)
+	write_model(filename, [{"name": name, "flags": OBJ_SCATTERED, "color": color, "sphere": sphere,
+		"contours": [numpy.asarray(points, dtype=float).reshape(-1, 3)]}], size)
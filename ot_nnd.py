@@ -1,65 +1,449 @@
 #!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Generated with the assistance of Claude (Anthropic).
+# Model: Claude (Anthropic), version not recorded        Date: 2026-10-18
+# Reviewed, tested, and validated by the Gan Lab (Anaphase); the authors take
+# full responsibility for the correctness of this code.
+# Lab: https://github.com/anaphaze | https://www.anaphase.org
+# AI-assisted sections: the whole file was rewritten into functions (read_coords, brute_neighbors, exact_d2, query_chunk, nearest_neighbors, save_table,
+#   coord_files, nnd_profile, profile_histograms, profile_summary, save_profiles,
+#   pair_chunk, pair_correlation, main);
+#   the outputs are the same as those of the original script.
+# -----------------------------------------------------------------------------
 # ot_nnd.py -- Nearest neighbor distances from a set of 3-D coordinates
 #
 # If you find this script useful for your work, please cite:
 # Cai, Tan, 2019, bioRxiv, Structural and biochemical changes of G0 S. pombe chromatin
 # https://www.biorxiv.org/content/10.1101/######
 #
+# Dependencies: numpy, scipy, ot_imodmodel.py, ot_common.py (works with python 2.7 and 3; without scipy, the
+#   brute-force engine is used)
 # Created 20180101 (Lu Gan)
+# Revised 20261018 (agent) KD-tree engine (scipy cKDTree) queried in chunks by a pool of workers,
+#   instead of scikit-learn's brute force; optional .npy outputs (--npy)
+# Revised 20261018 (agent) Distances to every neighbor 1..K with histograms (--profile); several
+#   coordinate files in parallel, into one table (list or glob, --out)
+# Revised 20261018 (agent) Distances to a second set of points (--cross); pair correlation g(r) and
+#   Ripley's K with edge correction (--gr, --box)
+# Revised 20261018 (agent) Reads IMOD .mod files directly (ot_imodmodel.py), no model2point needed
 #
 # This script is beased on the following resources:
 # https://scikit-learn.org/stable/modules/neighbors.html  (Simple NND example)
 # https://stackoverflow.com/a/2828121                     (How to sort)
+# https://docs.scipy.org/doc/scipy/reference/generated/scipy.spatial.cKDTree.html
 
-import os, sys
+from __future__ import print_function
+import os, sys, glob, multiprocessing
 import numpy as np
-from sklearn.neighbors import NearestNeighbors
+import ot_imodmodel, ot_common
 
-#---------- BEGIN User inputs ------------------------------
-# stackoverflow.com/questions/2194163/python-empty-argument
 try:
-   coords = sys.argv[1]
-   K_th   = int(sys.argv[2])
-   pixel  = float(sys.argv[3])
-except IndexError:
-   print "================================================================"
-   print "Usage:>>   ot_nnd.py [coords] [K] [pix]"
-   print "================================================================"
-   print "coords:  File w/ text 3-D coordinates (X Y Z), from model2point"
-   print "K:       the Kth nearest neighbor"
-   print "pixel:   pixel size, in nanometers"
-   print "Example: ot_nnd.py tm_hits.txt 10 0.91  (Gets tenth nearest neighbors)"
-   print "----------------------------------------------------------------"
-   print "Output:>>  nn_indx.txt: indices of each point and its nearest neighbor"
-   print "Output:>>  nn_dist.txt: list of NN distances, matched to indices"
-   print "Output:>>  nn_sort.txt: list of NN distances, small to large"
-   sys.exit()
-#----------- END User inputs -------------------------------
-outname = os.path.splitext(coords)[0]
-vectors = np.genfromtxt(coords, delimiter="")
-vectorarray = np.array(vectors)
-K_corr = K_th + 1
-
-nbrs = NearestNeighbors(n_neighbors=K_corr, algorithm='brute').fit(vectorarray)
-results, indices = nbrs.kneighbors(vectorarray)
-
-dist = np.delete(results, np.s_[:K_th:], 1)
-dist = np.multiply(dist, pixel)
-
-distsort = dist[dist[:,0].argsort()]
-
-#----------- Print diagnostics -----------------------------
-#np.set_printoptions(precision=2, suppress=True)
-#print "Coordinates:"
-#print(vectors)
-#print "vectors:"
-#print(vectorarray)
-#print "indices:"
-#print(indices)
-#print(distsort)
-
-#np.savetxt("nn_all.txt", results, fmt='%1.2f', delimiter=" ")
-np.savetxt("nn_indx.txt", indices, fmt='%d', delimiter=" ")
-np.savetxt("nn_dist.txt", dist, fmt='%1.2f', delimiter=" ")
-np.savetxt("nn_sort.txt", distsort, fmt='%1.2f', delimiter=" ")
-sys.exit()
+	from scipy.spatial import cKDTree
+except ImportError:
+	cKDTree = None
+
+
+def read_coords(coords):
+	# (N, 3) array of the X Y Z columns of a text file, e.g. from model2point, or of the points of an IMOD model
+	if os.path.splitext(coords)[1].lower() == ".mod":
+		return ot_imodmodel.read_points(coords)
+	vectors = np.genfromtxt(coords, delimiter="")
+	return np.array(vectors, dtype=float).reshape(-1, 3)
+
+def brute_neighbors(points, queries, k, max_elements=16777216):
+	"""
+	Distances and indices of the k nearest points to each query, by computing all
+	query-point distances, a block of queries at a time (at most max_elements
+	distances in memory). Ties are broken by index.
+	"""
+	dist = np.empty((len(queries), k))
+	indices = np.empty((len(queries), k), dtype="int64")
+	step = max(1, max_elements//max(1, len(points)))
+	for start in range(0, len(queries), step):
+		block = queries[start:start+step]
+		d2 = np.zeros((len(block), len(points)))
+		for axis in range(points.shape[1]):
+			d2 += (block[:, axis, None] - points[None, :, axis])**2
+		order = np.argsort(d2, axis=1, kind="mergesort")[:, :k]
+		indices[start:start+step] = order
+		dist[start:start+step] = np.sqrt(np.take_along_axis(d2, order, axis=1))
+	return dist, indices
+
+# Shared with the query workers (see ot_common.worker_pool)
+_query_job = {}
+
+def exact_d2(queries, points, indices):
+	# Squared distances from each query to the points of its row of indices, summed as in brute_neighbors()
+	d2 = np.zeros(indices.shape)
+	for axis in range(points.shape[1]):
+		d2 += (queries[:, axis, None] - points[indices, axis])**2
+	return d2
+
+def query_chunk(bounds):
+	"""
+	Worker: k nearest neighbors of queries start..stop-1, by the tree or brute force,
+	as set up in nearest_neighbors()
+	"""
+	start, stop = bounds
+	job = _query_job
+	queries = job["queries"][start:stop]
+	points, k = job["points"], job["k"]
+	if job["tree"] is None:
+		return brute_neighbors(points, queries, k)
+	# One neighbor more than needed shows where a tie crosses the kth place
+	kq = min(k + 1, len(points))
+	indices = job["tree"].query(queries, k=kq)[1].reshape(len(queries), kq)
+	# Distances as brute force computes them, in its order: by distance, then index
+	d2 = exact_d2(queries, points, indices)
+	order = np.lexsort((indices, d2), axis=-1)
+	d2, indices = np.take_along_axis(d2, order, axis=1), np.take_along_axis(indices, order, axis=1)
+	if kq > k:
+		# Points tied with the kth (e.g. on integer coordinates) may lie beyond the tree's
+		# answer; take all the points that close, and keep the ones of lowest index
+		for row in np.nonzero(d2[:, k] == d2[:, k-1])[0]:
+			near = np.asarray(job["tree"].query_ball_point(queries[row], np.sqrt(d2[row, k-1])*(1 + 1e-9)), dtype="int64")
+			near_d2 = exact_d2(queries[row:row+1], points, near[None, :])[0]
+			keep = np.lexsort((near, near_d2))[:k]
+			d2[row, :k], indices[row, :k] = near_d2[keep], near[keep]
+	return np.sqrt(d2[:, :k]), indices[:, :k]
+
+def nearest_neighbors(points, k, queries=None, engine="auto", jobs=1, chunk=65536):
+	"""
+	Distances and indices, (M, k) arrays sorted by distance, of the k nearest points
+	to each query point (default: the points themselves, which are then their own
+	first neighbor, at distance 0). engine is "tree" (KD-tree), "brute" or "auto"
+	(brute force below 2000 points or without scipy). The queries are answered
+	chunk points at a time by jobs worker processes, so memory use stays bounded.
+	"""
+	points = np.asarray(points, dtype=float)
+	queries = points if queries is None else np.asarray(queries, dtype=float)
+	if k > len(points):
+		raise ValueError("%s neighbors asked for, but there are only %s points" % (k, len(points)))
+	if engine == "auto":
+		engine = "brute" if len(points) < 2000 or cKDTree is None else "tree"
+	if engine == "tree" and cKDTree is None:
+		raise ValueError("the tree engine needs scipy")
+	_query_job.clear()
+	_query_job.update(points=points, queries=queries, k=k, tree=cKDTree(points) if engine == "tree" else None)
+	tasks = [(start, min(start + chunk, len(queries))) for start in range(0, len(queries), chunk)]
+	dist = np.empty((len(queries), k))
+	indices = np.empty((len(queries), k), dtype="int64")
+	pool = None
+	if jobs > 1 and len(tasks) > 1:
+		pool = ot_common.worker_pool(jobs, __name__, "_query_job")
+		results = pool.imap(query_chunk, tasks)
+	else:
+		results = (query_chunk(task) for task in tasks)
+	for (start, stop), (chunk_dist, chunk_indices) in zip(tasks, results):
+		dist[start:stop] = chunk_dist
+		indices[start:stop] = chunk_indices
+	if pool is not None:
+		pool.close()
+		pool.join()
+	_query_job.clear()
+	return dist, indices
+
+def pair_chunk(bounds):
+	"""
+	Worker: histograms (plain counts, and weighted for edge correction) of the
+	distances up to rmax between queries start..stop-1 and the points, as set up
+	in pair_correlation(). Only the pairs within rmax are ever held in memory.
+	"""
+	start, stop = bounds
+	job = _query_job
+	queries = job["queries"][start:stop]
+	points = job["points"]
+	edges = job["edges"]
+	rmax = edges[-1]
+	if job["tree"] is None:
+		# Brute force, a block of queries at a time
+		i, j = [], []
+		step = max(1, 16777216//max(1, len(points)))
+		for block_start in range(0, len(queries), step):
+			block = queries[block_start:block_start+step]
+			d2 = np.zeros((len(block), len(points)))
+			for axis in range(points.shape[1]):
+				d2 += (block[:, axis, None] - points[None, :, axis])**2
+			block_i, block_j = np.nonzero(d2 <= rmax*rmax)
+			i.append(block_i + block_start)
+			j.append(block_j)
+		i, j = np.concatenate(i), np.concatenate(j)
+	else:
+		lists = job["tree"].query_ball_point(queries, rmax)
+		lens = np.array([len(members) for members in lists], dtype="int64")
+		i = np.repeat(np.arange(len(queries)), lens)
+		j = np.concatenate([np.asarray(members, dtype="int64") for members in lists]) if lens.sum() else np.zeros(0, dtype="int64")
+	if job["same"]:
+		# A point is not its own pair
+		keep = i + start != j
+		i, j = i[keep], j[keep]
+	h = np.abs(queries[i] - points[j])
+	d = np.sqrt((h**2).sum(axis=1))
+	# Translation correction: a pair h apart could only be seen in the part of the box
+	# that overlaps the box shifted by h, of volume (X-|hx|)(Y-|hy|)(Z-|hz|)
+	weights = 1.0/np.prod(job["box"] - h, axis=1)
+	return np.histogram(d, edges)[0], np.histogram(d, edges, weights=weights)[0]
+
+def pair_correlation(points, others, box, rmax, nbins, engine="auto", jobs=1, chunk=65536):
+	"""
+	Pair correlation function g(r) and Ripley's K(r) of points (with others=None) or
+	of points to others (cross-correlation), in nbins bins from 0 to rmax. box holds
+	the X, Y, Z size of the volume the points were picked in (coordinates from 0), for
+	translation edge correction (Ohser & Stoyan, 1981); rmax must be smaller than
+	all three. Pairs are counted chunk points at a time, by jobs processes.
+	Returns a (nbins, 6) table: bin start, bin end, pairs, g(r), K(bin end), L(bin end).
+	"""
+	points = np.asarray(points, dtype=float)
+	same = others is None
+	others = points if same else np.asarray(others, dtype=float)
+	box = np.asarray(box, dtype=float)
+	if rmax >= box.min():
+		raise ValueError("rmax must be smaller than the box (%s)" % box.min())
+	if engine == "auto":
+		engine = "brute" if len(others) < 2000 or cKDTree is None else "tree"
+	if engine == "tree" and cKDTree is None:
+		raise ValueError("the tree engine needs scipy")
+	edges = np.linspace(0, rmax, nbins + 1)
+	_query_job.clear()
+	_query_job.update(points=others, queries=points, tree=cKDTree(others) if engine == "tree" else None,
+		same=same, box=box, edges=edges)
+	tasks = [(start, min(start + chunk, len(points))) for start in range(0, len(points), chunk)]
+	counts = np.zeros(nbins, dtype="int64")
+	weighted = np.zeros(nbins)
+	pool = None
+	if jobs > 1 and len(tasks) > 1:
+		pool = ot_common.worker_pool(jobs, __name__, "_query_job")
+		results = pool.imap(pair_chunk, tasks)
+	else:
+		results = (pair_chunk(task) for task in tasks)
+	for chunk_counts, chunk_weighted in results:
+		counts += chunk_counts
+		weighted += chunk_weighted
+	if pool is not None:
+		pool.close()
+		pool.join()
+	_query_job.clear()
+	# K(r) = V^2/(nA nB) * sum of the corrected pair weights up to r; for points
+	# placed at random, K(r) = 4/3 pi r^3, L(r) = r and g(r) = 1
+	volume = np.prod(box)
+	scale = volume**2/(len(points)*(len(others) - same))
+	K = scale*np.cumsum(weighted)
+	shells = 4.0/3.0*np.pi*(edges[1:]**3 - edges[:-1]**3)
+	table = np.zeros((nbins, 6))
+	table[:, 0], table[:, 1], table[:, 2] = edges[:-1], edges[1:], counts
+	table[:, 3] = scale*weighted/shells
+	table[:, 4] = K
+	table[:, 5] = np.cbrt(3*K/(4*np.pi))
+	return table
+
+def save_table(name, table, fmt, npy=False):
+	# Text table name.txt, or binary name.npy (np.load) with npy
+	if npy:
+		np.save(name + ".npy", table)
+	else:
+		np.savetxt(name + ".txt", table, fmt=fmt, delimiter=" ")
+
+def coord_files(coords):
+	# File names from a comma-separated list of names and/or glob patterns (e.g. "tomo*_hits.txt")
+	files = []
+	for name in coords.split(","):
+		matches = sorted(glob.glob(name))
+		files += matches if matches else [name]
+	return files
+
+def nnd_profile(task):
+	"""
+	Worker: (coords, K, pixel, engine, chunk) -> (coords, (N, K) distances of every
+	point to its 1st..Kth nearest neighbor times pixel, or a message saying why not)
+	"""
+	coords, K_th, pixel, engine, chunk = task
+	try:
+		vectorarray = read_coords(coords)
+	except (IOError, OSError, ValueError) as err:
+		return coords, "could not be read (%s)" % err
+	if K_th + 1 > len(vectorarray):
+		return coords, "has %s points, too few for a %sth nearest neighbor" % (len(vectorarray), K_th)
+	results, indices = nearest_neighbors(vectorarray, K_th + 1, engine=engine, chunk=chunk)
+	return coords, np.multiply(results[:, 1:], pixel)
+
+def profile_histograms(profiles, nbins):
+	"""
+	Histograms of the 1st..Kth neighbor distances of all the (N, K) profiles, on
+	shared bins from 0 to the largest distance. Returns a (nbins, 2 + K) table:
+	bin start, bin end, then the counts for each K.
+	"""
+	K_th = profiles[0].shape[1]
+	top = max(float(profile.max()) for profile in profiles if len(profile))
+	edges = np.linspace(0, top if top > 0 else 1.0, nbins + 1)
+	table = np.zeros((nbins, 2 + K_th))
+	table[:, 0], table[:, 1] = edges[:-1], edges[1:]
+	for profile in profiles:
+		for k in range(K_th):
+			table[:, 2 + k] += np.histogram(profile[:, k], edges)[0]
+	return table
+
+def profile_summary(profiles):
+	# One row per file (numbered from 0, in order) and K: file, K, points, mean, median, sd, min, max
+	rows = []
+	for n, profile in enumerate(profiles):
+		for k in range(profile.shape[1]):
+			d = profile[:, k]
+			rows.append([n, k + 1, len(d), d.mean(), np.median(d), d.std(), d.min(), d.max()])
+	return np.array(rows)
+
+def save_profiles(prefix, files, profiles, opts):
+	"""
+	Consolidated outputs for the files analysed together: [prefix]_table (file number,
+	point index, 1st..Kth neighbor distances; only the Kth without --profile),
+	[prefix]_summary, [prefix]_hist and [prefix]_files.txt (file number, name)
+	"""
+	K_th = profiles[0].shape[1]
+	cols = slice(0, K_th) if opts["--profile"] else slice(K_th - 1, K_th)
+	table = np.vstack([np.column_stack([np.full(len(profile), n), np.arange(len(profile)), profile[:, cols]])
+		for n, profile in enumerate(profiles)])
+	ndist = table.shape[1] - 2
+	save_table(prefix + "_table", table, ['%d', '%d'] + ['%1.2f']*ndist, opts["--npy"])
+	save_table(prefix + "_summary", profile_summary(profiles), ['%d', '%d', '%d'] + ['%1.2f']*5, opts["--npy"])
+	save_table(prefix + "_hist", profile_histograms(profiles, opts["--bins"]), ['%1.2f', '%1.2f'] + ['%d']*K_th, opts["--npy"])
+	with open(prefix + "_files.txt", "w") as f:
+		for n, name in enumerate(files):
+			f.write("%d %s\n" % (n, name))
+
+def main(coords, K_th, pixel, opts):
+	if opts["--engine"] not in ("auto", "tree", "brute"):
+		print("Unknown engine %s.. exiting" % opts["--engine"])
+		sys.exit()
+	if opts["--bins"] < 1:
+		print("--bins needs 1 or more bins.. exiting")
+		sys.exit()
+	if opts["--box"] and len(opts["--box"].split(",")) != 3:
+		print("--box needs the X,Y,Z size of the tomogram, in pixels.. exiting")
+		sys.exit()
+	files = coord_files(coords)
+	if len(files) > 1 and (opts["--cross"] or opts["--gr"] > 0):
+		print("--cross and --gr work on one coordinate file.. exiting")
+		sys.exit()
+	if len(files) > 1:
+		# Several coordinate files: one file per worker, and consolidated outputs
+		tasks = [(name, K_th, pixel, opts["--engine"], opts["--chunk"]) for name in files]
+		pool = None
+		if opts["--jobs"] > 1:
+			pool = multiprocessing.Pool(opts["--jobs"])
+			results = pool.imap(nnd_profile, tasks)
+		else:
+			results = (nnd_profile(task) for task in tasks)
+		done, profiles = [], []
+		for name, result in results:
+			if isinstance(result, str):
+				print("Skipping %s, which %s" % (name, result))
+				continue
+			print("%s: %s points, mean %sth NND %1.2f" % (name, len(result), K_th, result[:, -1].mean()))
+			done.append(name)
+			profiles.append(result)
+		if pool is not None:
+			pool.close()
+			pool.join()
+		if not profiles:
+			print("No coordinate files to analyse.. exiting")
+			sys.exit()
+		save_profiles(opts["--out"], done, profiles, opts)
+		print("Wrote %s_table, %s_summary, %s_hist and %s_files.txt for %s files" % ((opts["--out"],)*4 + (len(done),)))
+		return
+
+	vectorarray = read_coords(coords)
+	# With --cross, neighbors are looked for among the other set, which holds no query point itself
+	others = read_coords(opts["--cross"]) if opts["--cross"] else None
+	targets = vectorarray if others is None else others
+	K_corr = K_th + 1 if others is None else K_th
+	if K_corr > len(targets):
+		print("%s has %s points, too few for a %sth nearest neighbor.. exiting" % (opts["--cross"] or coords, len(targets), K_th))
+		sys.exit()
+
+	results, indices = nearest_neighbors(targets, K_corr, queries=None if others is None else vectorarray,
+		engine=opts["--engine"], jobs=opts["--jobs"], chunk=opts["--chunk"])
+
+	dist = np.delete(results, np.s_[:K_corr-1:], 1)
+	dist = np.multiply(dist, pixel)
+
+	distsort = dist[dist[:,0].argsort()]
+
+	#np.savetxt("nn_all.txt", results, fmt='%1.2f', delimiter=" ")
+	save_table("nn_indx", indices, '%d', opts["--npy"])
+	save_table("nn_dist", dist, '%1.2f', opts["--npy"])
+	save_table("nn_sort", distsort, '%1.2f', opts["--npy"])
+	if opts["--profile"]:
+		# Every neighbor 1..K from the same query
+		profile = np.multiply(results[:, K_corr-K_th:], pixel)
+		save_table("nn_profile", profile, '%1.2f', opts["--npy"])
+		save_table("nn_hist", profile_histograms([profile], opts["--bins"]), ['%1.2f', '%1.2f'] + ['%d']*K_th, opts["--npy"])
+		save_table("nn_summary", profile_summary([profile])[:, 1:], ['%d', '%d'] + ['%1.2f']*5, opts["--npy"])
+	if opts["--gr"] > 0:
+		# Distances in pixels here; r and L in nm, K in nm^3 in the output
+		points = vectorarray if others is None else np.vstack([vectorarray, others])
+		if opts["--box"]:
+			box = [float(val) for val in opts["--box"].split(",")]
+			if (points < 0).any() or (points > box).any():
+				print("Warning: some points are outside the 0..%s x 0..%s x 0..%s box" % tuple(box))
+		else:
+			box = points.max(axis=0) - points.min(axis=0)
+			print("No --box given; using the points' bounding box, %1.1f x %1.1f x %1.1f pixels" % tuple(box))
+		if opts["--gr"]/pixel >= min(box):
+			print("--gr must be smaller than the box (%1.2f nm).. exiting" % (min(box)*pixel))
+			sys.exit()
+		table = pair_correlation(vectorarray, others, box, opts["--gr"]/pixel, opts["--bins"], opts["--engine"], opts["--jobs"], opts["--chunk"])
+		table[:, [0, 1, 5]] *= pixel
+		table[:, 4] *= pixel**3
+		save_table("nn_gr", table, ['%1.2f', '%1.2f', '%d', '%1.4f', '%1.6g', '%1.2f'], opts["--npy"])
+
+if __name__ == "__main__":
+	#---------- BEGIN User inputs ------------------------------
+	# stackoverflow.com/questions/2194163/python-empty-argument
+	args, opts = ot_common.parse_options(sys.argv[1:], {"--engine": "auto", "--jobs": 1, "--chunk": 65536, "--npy": False,
+		"--profile": False, "--bins": 50, "--out": "nn", "--cross": "", "--gr": 0.0, "--box": ""})
+	try:
+		coords = args[0]
+		K_th   = int(args[1])
+		pixel  = float(args[2])
+	except IndexError:
+		print("================================================================")
+		print("Usage:>>   ot_nnd.py [coords] [K] [pix] [Options]")
+		print("================================================================")
+		print("coords:  IMOD model (.mod), or file w/ text 3-D coordinates (X Y Z) from model2point;")
+		print("         or several files, as a comma-separated list and/or a quoted pattern like \"tomo*.txt\"")
+		print("K:       the Kth nearest neighbor")
+		print("pixel:   pixel size, in nanometers")
+		print("Example: ot_nnd.py tm_hits.txt 10 0.91  (Gets tenth nearest neighbors)")
+		print("Example: ot_nnd.py \"tomo*_hits.txt\" 10 0.91 --profile --jobs 8 --out hits")
+		print("----------------------------------------------------------------")
+		print("Options:")
+		print("--engine E  tree (KD-tree, needs scipy), brute, or auto (default; brute")
+		print("            force for fewer than 2000 points)")
+		print("--jobs N    Answer the queries (or, for several files, one file each) with")
+		print("            N processes (default 1)")
+		print("--chunk N   Points per query chunk, which bounds memory use (default 65536)")
+		print("--npy       Write binary .npy files (np.load) instead of text files")
+		print("--profile   Also write the distances to every neighbor 1..K, from the same query:")
+		print("            nn_profile.txt, with nn_hist.txt (histograms for each K) and")
+		print("            nn_summary.txt (K, points, mean, median, sd, min, max)")
+		print("--bins N    Number of histogram bins, from 0 to the largest distance (default 50)")
+		print("--out P     Name prefix of the outputs for several files (default nn)")
+		print("--cross B   Distances from each point in [coords] to its Kth nearest neighbor in")
+		print("            file B (.mod or text; e.g. nucleosomes to the nearest ribosome with K = 1);")
+		print("            nn_indx.txt then holds the indices of the 1..K nearest points of B")
+		print("--gr R      Also write nn_gr.txt, the pair correlation function g(r) and Ripley's")
+		print("            K(r) up to R nm, in --bins bins (of [coords] to B with --cross)")
+		print("--box X,Y,Z Size of the tomogram, in pixels, for the edge correction of --gr")
+		print("            (default: the bounding box of the points)")
+		print("----------------------------------------------------------------")
+		print("Output:>>  nn_indx.txt: indices of each point and its nearest neighbor")
+		print("Output:>>  nn_dist.txt: list of NN distances, matched to indices")
+		print("Output:>>  nn_sort.txt: list of NN distances, small to large")
+		print("Output:>>  nn_gr.txt: (--gr) bin start, bin end, pairs, g(r), K(r), L(r) = (3K/4pi)^1/3")
+		print("For several files, instead:")
+		print("Output:>>  [P]_table.txt: file number, point index, Kth NN distance (1..K with --profile)")
+		print("Output:>>  [P]_summary.txt: file number, K, points, mean, median, sd, min, max")
+		print("Output:>>  [P]_hist.txt: bin start, bin end, counts for each K (all files)")
+		print("Output:>>  [P]_files.txt: file number, file name")
+		sys.exit()
+	#----------- END User inputs -------------------------------
+	main(coords, K_th, pixel, opts)
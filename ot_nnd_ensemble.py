@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Generated with the assistance of Claude (Anthropic).
+# Model: Claude (Anthropic), version not recorded        Date: 2026-10-18
+# Reviewed, tested, and validated by the Gan Lab (Anaphase); the authors take
+# full responsibility for the correctness of this code.
+# Lab: https://github.com/anaphaze | https://www.anaphase.org
+# -----------------------------------------------------------------------------
+# ot_nnd_ensemble.py -- Is an observed nearest-neighbor distance (NND) distribution random?
+#   Compares it with the NNDs of R random point sets (Monte Carlo null model)
+#
+# Dependencies: numpy 1.17+, scipy (optional, as for ot_nnd.py), ot_nnd.py,
+#   ot_rand3Dcoord_rect.py, ot_imodmodel.py, ot_common.py, mrcfile (for --mask only)
+# Created 20261018 (agent)
+#
+# Each replicate places as many points as were observed (or --npart) at random, more
+# than rad pixels apart, in the dimX x dimY x dimZ box or in the nonzero voxels of a
+# mask (the sampler of ot_rand3Dcoord_rect.py), and gets their Kth NNDs (or, with --gr,
+# their pair correlation function) in memory, as ot_nnd.py would. Replicates run in a
+# pool of --jobs processes. Replicate i draws from the ith child of the master seed
+# (numpy SeedSequence), so a seed gives the same ensemble for any number of jobs.
+#
+# The NND distribution is compared as its cumulative distribution G(r), the fraction of
+# points whose Kth NND is r or less, on a grid of --bins steps: the observed G(r) with
+# the mean and the --quantiles envelope of the replicates. An observed curve outside the
+# envelope is evidence against random placement (Diggle, 2003, Statistical Analysis of
+# Spatial Point Patterns). With --mask, g(r) and K(r) keep the box's edge correction,
+# which is biased for the mask, but in the same way for the data and the replicates.
+
+from __future__ import print_function
+import sys, time
+import numpy as np
+import ot_nnd, ot_rand3Dcoord_rect, ot_common
+
+
+def kth_distances(points, K_th, pixel, engine="auto"):
+	# Kth NND of every point, times pixel (the point itself is its own first neighbor)
+	dist = ot_nnd.nearest_neighbors(points, K_th + 1, engine=engine)[0]
+	return dist[:, K_th]*pixel
+
+def cumulative(dist, grid):
+	# G(r) on the grid: fraction of the distances that are r or less
+	return np.searchsorted(np.sort(dist), grid, side="right")/float(max(1, len(dist)))
+
+# Shared with the replicate workers (see ot_common.worker_pool)
+_ensemble_job = {}
+
+def replicate(task):
+	"""
+	Worker: (replicate number, SeedSequence) -> (number, points placed, mean and median
+	Kth NND, G(r) on the grid, g(r) and L(r) columns or None), as set up in main()
+	"""
+	i, seed = task
+	job = _ensemble_job
+	rng = np.random.default_rng(seed)
+	points = ot_rand3Dcoord_rect.poisson_disk(None, job["npart"], job["radius"], rng, job["integer"], region=job["region"])
+	if len(points) < job["K"] + 1:
+		return i, len(points), np.nan, np.nan, np.full(len(job["grid"]), np.nan), None
+	dist = kth_distances(points, job["K"], job["pixel"], job["engine"])
+	gr = None
+	if job["rmax"] > 0:
+		gr = ot_nnd.pair_correlation(points, None, job["box"], job["rmax"], job["bins"], job["engine"])[:, [3, 5]]
+	return i, len(points), dist.mean(), np.median(dist), cumulative(dist, job["grid"]), gr
+
+def envelope(observed, replicates, quantiles):
+	# Columns: observed, mean of the replicates, and their quantiles (NaN rows of failed replicates left out)
+	replicates = replicates[~np.isnan(replicates).any(axis=1)]
+	return np.column_stack([observed, replicates.mean(axis=0)] + [np.quantile(replicates, q, axis=0) for q in quantiles])
+
+def main(coords, K_th, pixel, size, radius, nrep, opts):
+	try:
+		quantiles = [float(q) for q in opts["--quantiles"].split(",")]
+	except ValueError:
+		quantiles = []
+	if len(quantiles) != 2 or not 0 <= quantiles[0] < quantiles[1] <= 1:
+		print("--quantiles needs lo,hi between 0 and 1, e.g. 0.025,0.975.. exiting")
+		sys.exit()
+	if opts["--engine"] not in ("auto", "tree", "brute"):
+		print("Unknown engine %s.. exiting" % opts["--engine"])
+		sys.exit()
+	if nrep < 1 or opts["--bins"] < 1:
+		print("Needs 1 or more replicates and bins.. exiting")
+		sys.exit()
+	observed = ot_nnd.read_coords(coords)
+	npart = opts["--npart"] if opts["--npart"] > 0 else len(observed)
+	if K_th + 1 > min(len(observed), npart):
+		print("%s points are too few for a %sth nearest neighbor.. exiting" % (min(len(observed), npart), K_th))
+		sys.exit()
+
+	if opts["--mask"]:
+		mask = ot_rand3Dcoord_rect.read_mask(opts["--mask"])
+		if tuple(size) != (0, 0, 0) and tuple(size) != mask.shape[::-1]:
+			print("The mask is %s x %s x %s, but the box is %s x %s x %s (use 0 0 0 for the mask's size).. exiting"
+				% (tuple(mask.shape[::-1]) + tuple(size)))
+			sys.exit()
+		size = mask.shape[::-1]
+		region = ot_rand3Dcoord_rect.MaskRegion(mask)
+	else:
+		region = ot_rand3Dcoord_rect.BoxRegion(size)
+	fraction = ot_rand3Dcoord_rect.packing_fraction(npart, radius, region.volume)
+	if fraction >= ot_rand3Dcoord_rect.MAX_PACKING:
+		print("%s points more than %s pixels apart cannot be placed at random (packing fraction %.3f).. exiting" % (npart, radius, fraction))
+		sys.exit()
+	if radius <= 0 and not opts["--float"] and npart > region.volume:
+		print("%s points cannot go in distinct voxels of %d voxels.. exiting" % (npart, region.volume))
+		sys.exit()
+	if (observed < 0).any() or (observed > np.array(size, dtype=float)).any():
+		print("Warning: some observed points are outside the 0..%s x 0..%s x 0..%s box" % tuple(size))
+
+	# Shared grid for G(r), up to twice the largest observed Kth NND (or --rmax nm)
+	obs_dist = kth_distances(observed, K_th, pixel, opts["--engine"])
+	top = opts["--rmax"] if opts["--rmax"] > 0 else 2*obs_dist.max()
+	grid = np.linspace(0, top if top > 0 else 1.0, opts["--bins"] + 1)[1:]
+	box = np.array(size, dtype=float)
+	rmax = opts["--gr"]/pixel
+	if rmax >= box.min():
+		print("--gr must be smaller than the box (%1.2f nm).. exiting" % (box.min()*pixel))
+		sys.exit()
+
+	seed = np.random.SeedSequence(opts["--seed"] if opts["--seed"] >= 0 else None)
+	print("Master seed: %s (--seed %s repeats this ensemble)" % (seed.entropy, seed.entropy))
+	_ensemble_job.clear()
+	_ensemble_job.update(npart=npart, radius=radius, integer=not opts["--float"], region=region, K=K_th,
+		pixel=pixel, engine=opts["--engine"], grid=grid, rmax=rmax, box=box, bins=opts["--bins"])
+	tasks = list(enumerate(seed.spawn(nrep)))
+	start = time.time()
+	pool = None
+	if opts["--jobs"] > 1:
+		pool = ot_common.worker_pool(opts["--jobs"], __name__, "_ensemble_job")
+		results = pool.imap(replicate, tasks)
+	else:
+		results = (replicate(task) for task in tasks)
+	summary = np.zeros((nrep, 4))
+	curves = np.zeros((nrep, len(grid)))
+	grs = np.full((nrep, opts["--bins"], 2), np.nan)
+	for i, placed, mean, median, G, gr in results:
+		summary[i] = i, placed, mean, median
+		curves[i] = G
+		if gr is not None:
+			grs[i] = gr
+		if placed < npart:
+			print("Warning: replicate %s placed only %s of %s points" % (i, placed, npart))
+		if opts["--verbose"]:
+			print("Replicate %s: mean %sth NND %1.2f" % (i, K_th, mean))
+	if pool is not None:
+		pool.close()
+		pool.join()
+	_ensemble_job.clear()
+	elapsed = time.time() - start
+	print("%s replicates of %s points in %1.1f s (%1.2f replicates/s)" % (nrep, npart, elapsed, nrep/max(elapsed, 1e-9)))
+	if np.isnan(summary[:, 2]).all():
+		# Nothing to summarise (e.g. a mask too small for the points at this distance)
+		print("No replicate placed the %s points a %sth nearest neighbor needs.. exiting" % (K_th + 1, K_th))
+		sys.exit()
+
+	prefix = opts["--out"]
+	fmt = ['%1.2f'] + ['%1.4f']*(2 + len(quantiles))
+	np.savetxt(prefix + "_envelope.txt", np.column_stack([grid, envelope(cumulative(obs_dist, grid), curves, quantiles)]), fmt=fmt, delimiter=" ")
+	np.savetxt(prefix + "_replicates.txt", summary, fmt=['%d', '%d', '%1.2f', '%1.2f'], delimiter=" ")
+	if rmax > 0:
+		table = ot_nnd.pair_correlation(observed, None, box, rmax, opts["--bins"], opts["--engine"])
+		g = envelope(table[:, 3], grs[:, :, 0], quantiles)
+		L = envelope(table[:, 5], grs[:, :, 1], quantiles)*pixel
+		np.savetxt(prefix + "_gr.txt", np.column_stack([table[:, :2]*pixel, g, L]),
+			fmt=['%1.2f']*2 + ['%1.4f']*len(g[0]) + ['%1.2f']*len(L[0]), delimiter=" ")
+
+	# Rank of the observed mean Kth NND among the replicates
+	means = summary[~np.isnan(summary[:, 2]), 2]
+	lo, hi = np.quantile(means, quantiles)
+	print("Observed mean %sth NND: %1.2f nm; random: %1.2f nm (%s-%s quantiles %1.2f to %1.2f)"
+		% (K_th, obs_dist.mean(), means.mean(), quantiles[0], quantiles[1], lo, hi))
+	print("Fraction of replicates with a mean as small: %1.4f, as large: %1.4f"
+		% ((np.sum(means <= obs_dist.mean()) + 1.0)/(len(means) + 1), (np.sum(means >= obs_dist.mean()) + 1.0)/(len(means) + 1)))
+	print("Wrote %s_envelope.txt and %s_replicates.txt%s" % (prefix, prefix, " and %s_gr.txt" % prefix if rmax > 0 else ""))
+
+if __name__ == "__main__":
+	#---------- BEGIN User inputs ------------------------------
+	# stackoverflow.com/questions/2194163/python-empty-argument
+	args, opts = ot_common.parse_options(sys.argv[1:], {"--seed": -1, "--jobs": 1, "--engine": "auto", "--mask": "",
+		"--float": False, "--npart": 0, "--bins": 50, "--rmax": 0.0, "--quantiles": "0.025,0.975",
+		"--gr": 0.0, "--out": "ens", "--verbose": False})
+	try:
+		coords = args[0]
+		K_th   = int(args[1])
+		pixel  = float(args[2])
+		size   = [int(args[3]), int(args[4]), int(args[5])]
+		radius = float(args[6])
+		nrep   = int(args[7])
+	except IndexError:
+		print("================================================================")
+		print("Usage:>>   ot_nnd_ensemble.py [coords] [K] [pix] [dimX] [dimY] [dimZ] [rad] [R] [Options]")
+		print("================================================================")
+		print("coords:    IMOD model (.mod), or file w/ text 3-D coordinates (X Y Z), in pixels")
+		print("K:         the Kth nearest neighbor")
+		print("pixel:     pixel size, in nanometers")
+		print("dimX/Y/Z:  size of the box the points were picked in, in pixels")
+		print("rad:       minimum distance between random points, in pixels (0: none)")
+		print("R:         number of random replicates")
+		print("Example: ot_nnd_ensemble.py tm_hits.txt 1 0.91 928 928 300 10 1000 --jobs 8 --seed 1")
+		print("----------------------------------------------------------------")
+		print("Options:")
+		print("--seed N       Master seed; the same seed gives the same replicates (default:")
+		print("               a new one, which is printed)")
+		print("--jobs N       Run the replicates in N processes (default 1)")
+		print("--mask M       MRC mask: random points only in its nonzero voxels (dimX/Y/Z")
+		print("               0 0 0 or the mask's size)")
+		print("--float        Sub-voxel random coordinates instead of whole voxels")
+		print("--npart N      Points per replicate (default: as many as observed)")
+		print("--bins N       Steps of G(r), or bins of g(r) (default 50)")
+		print("--rmax R       G(r) up to R nm (default: twice the largest observed NND)")
+		print("--quantiles Q  Envelope quantiles lo,hi (default 0.025,0.975)")
+		print("--gr R         Also compare the pair correlation g(r) and L(r) up to R nm")
+		print("--engine E     tree, brute or auto, as for ot_nnd.py")
+		print("--out P        Name prefix of the outputs (default ens)")
+		print("--verbose      Report each replicate")
+		print("----------------------------------------------------------------")
+		print("Output:>>  [P]_envelope.txt: r, observed G(r), mean G(r), lo and hi quantiles")
+		print("Output:>>  [P]_replicates.txt: replicate, points, mean and median Kth NND")
+		print("Output:>>  [P]_gr.txt: (--gr) bin start, bin end, g(r) observed, mean, lo, hi,")
+		print("           then L(r) observed, mean, lo, hi")
+		sys.exit()
+	#----------- END User inputs -------------------------------
+	main(coords, K_th, pixel, size, radius, nrep, opts)
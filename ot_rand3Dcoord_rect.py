@@ -1,74 +1,365 @@
 #!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Generated with the assistance of Claude (Anthropic).
+# Model: Claude (Anthropic), version not recorded        Date: 2026-10-18
+# Reviewed, tested, and validated by the Gan Lab (Anaphase); the authors take
+# full responsibility for the correctness of this code.
+# Lab: https://github.com/anaphaze | https://www.anaphase.org
+# AI-assisted sections: packing_fraction, CellGrid, BoxRegion,
+#   MaskRegion, read_mask, poisson_disk and main (the sampler replaces the set of
+#   excluded voxels), writing out.mod (ot_imodmodel.py) and the print() calls; the
+#   usage text predates this header.
+# -----------------------------------------------------------------------------
 # ot_rand3Dcoord_rect.py -- Create random distribution of points with a minimum inter-particle distance within a rectangular box
 #
 # If you find this script useful for your work, please cite:
 # Cai, 2018, MBoC, Natural chromatin is heterogeneous and self-associates in vitro
 # https://www.ncbi.nlm.nih.gov/pubmed/29742050
 #
+# Dependencies: numpy 1.17+, ot_imodmodel.py, ot_common.py, mrcfile (for --mask only)
 # Created: 20171214 (Lu Gan)
+# Revised: 20261018 (agent) Writes out.mod directly (ot_imodmodel.py), instead of running point2model
+# Revised: 20261018 (agent) Batched sampler on a grid of cells instead of a set of excluded voxels:
+#   memory grows with npart only, impossible packings are caught up front, sub-voxel
+#   coordinates (--float) and reproducible runs (--seed)
+# Revised: 20261018 (agent) Points confined to the nonzero voxels of an MRC mask (--mask)
 #
-import random, os, sys
-import numpy as np
+# Points are proposed in batches, uniformly in the box, and each is rejected if an
+# accepted point is within rad (as before, every point ends up more than rad from
+# all others). Accepted points are kept in a grid of cells of size rad/sqrt(3), which
+# holds at most one point per cell, so a proposal only has to be compared with the
+# points of the 5 x 5 x 5 cells around its own, less the corners (Bridson, 2007,
+# "Fast Poisson disk sampling in arbitrary dimensions", SIGGRAPH sketches). The
+# proposals of a batch are settled in the order they were drawn, each one against the
+# accepted points and the earlier proposals kept, so the result is that of adding them
+# one at a time (random sequential addition). With --mask, proposals are drawn only
+# in the blocks of 16^3 voxels that hold some of the mask, and dropped unless their
+# own voxel is in the mask.
 #
 # Code adapted from this SO thread:
 # https://stackoverflow.com/a/19668720
 # https://stackoverflow.com/questions/8466014/how-to-convert-a-python-set-to-a-numpy-array
-#---------- BEGIN User inputs ------------------------------
-# stackoverflow.com/questions/2194163/python-empty-argument
-try:
-   sizeX  = int(sys.argv[1])
-   sizeY  = int(sys.argv[2])
-   sizeZ  = int(sys.argv[3])
-   npart  = int(sys.argv[4])
-   radius = int(sys.argv[5])
-   cenX   = int(sys.argv[6])
-except IndexError:
-   print "================================================================"
-   print "Usage:>>   ot_rand3Dcoord_rect.py [dimX] [dimY] [dimZ] [npart] [rad] [cenX]"
-   print "================================================================"
-   print "dimX/Y/Z : box's X/Y/Z axes lengths, in pixels"
-   print "npart:     number of particles"
-   print "rad:       size of particles, for overlap exclusion"
-   print "cenX:      move center of mass along X axes this much"
-   print "----------------------------------------------------------------"
-   print "Creates a random array of points within a rectangular box"
-   print "Note that some combos might never converge:"
-   print "Box too big, radius too big, too many points"
-   print "----------------------------------------------------------------"
-   print "Output:>> out.txt & out.mod"
-   sys.exit()
-#----------- END User inputs -------------------------------
-rangeX = (0, sizeX)
-rangeY = (0, sizeY)
-rangeZ = (0, sizeZ)
-
-# Generate a set of all points within radius of the origin, to be used as offsets later
-deltas = set()
-for x in range(-radius, radius+1):
-   for y in range(-radius, radius+1):
-       for z in range(-radius, radius+1):
-          if x*x + y*y + z*z <= radius*radius:
-             deltas.add((x,y,z))
-
-randPoints = []
-excluded = set()
-i = 0
-
-while i<npart:
-   x = random.randrange(*rangeX)
-   y = random.randrange(*rangeY)
-   z = random.randrange(*rangeZ)
-   if (x,y,z) in excluded: continue
-   randPoints.append((x,y,z))
-   i += 1
-   excluded.update((x+dx, y+dy, z+dz) for (dx,dy,dz) in deltas)
-results = np.array(list(randPoints))
-offX = np.array([cenX,0,0])
-results += offX
-
-print(results)
-#print(deltas)
-np.savetxt("out.txt", results, fmt='%d', delimiter=" ")
-os.system('point2model -scat -sphere 6 out.txt out.mod')
-#os.system('point2model -scat -sphere %s out.txt out.mod' % (radius))
-sys.exit()
+
+from __future__ import print_function
+import os, sys, math
+import numpy as np
+import ot_imodmodel, ot_common
+
+# Random sequential addition of spheres jams at a packing fraction of about 0.38
+# (Torquato, Uche & Stillinger, 2006, Phys Rev E 74: 061308)
+MAX_PACKING = 0.38
+
+
+def packing_fraction(npart, radius, volume):
+	# Fraction of the volume taken by npart spheres of diameter radius (points more than radius apart)
+	return npart*4.0/3.0*math.pi*(radius/2.0)**3/volume
+
+class CellGrid(object):
+	"""
+	Points in a box of size (x, y, z), hashed into cells of radius/sqrt(3), of which
+	each holds at most one point when the points are more than radius apart. The
+	cell table is a dense array when it is small enough (up to 64 cells per point),
+	and otherwise a sorted array of the occupied cells, so memory stays O(npart).
+	The table has a margin of 2 empty cells on every side, so the cells around a
+	point can be looked up without checking the edges of the box.
+	"""
+	def __init__(self, size, radius, npart, dense=None):
+		self.radius = float(radius)
+		self.cell = max(self.radius/math.sqrt(3), 1e-6)
+		self.inside = np.maximum(np.ceil(np.asarray(size, dtype=float)/self.cell), 1).astype("int64")
+		self.shape = self.inside + 4
+		ncells = int(np.prod(self.shape))
+		self.dense = ncells <= max(64*npart, 1 << 24) if dense is None else dense
+		if self.dense:
+			self.table = np.full(ncells, -1, dtype="int64" if npart >= 2**31 else "int32")
+		else:
+			self.keys = np.zeros(0, dtype="int64")
+			self.ids = np.zeros(0, dtype="int64")
+		self.points = np.zeros((npart, 3))
+		self.n = 0
+		# Cells that can hold a point within radius of some point of the centre cell,
+		# nearest first: up to 2 cells away, less the 8 corners, which are radius away
+		steps = range(-2, 3)
+		near = [(dx, dy, dz) for dx in steps for dy in steps for dz in steps
+			if sum(max(abs(d) - 1, 0)**2 for d in (dx, dy, dz)) < 3]
+		near.sort(key=lambda d: d[0]**2 + d[1]**2 + d[2]**2)
+		self.steps = [int((dx*self.shape[1] + dy)*self.shape[2] + dz) for dx, dy, dz in near]
+
+	def key(self, points):
+		# Table index of the cell of each point
+		cells = np.minimum(np.floor(points/self.cell).astype("int64"), self.inside - 1) + 2
+		return (cells[:, 0]*self.shape[1] + cells[:, 1])*self.shape[2] + cells[:, 2]
+
+	def lookup(self, keys):
+		# Index of the point in each cell, or -1
+		if self.dense:
+			return self.table[keys]
+		if len(self.keys) == 0:
+			return np.full(len(keys), -1, dtype="int64")
+		pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+		return np.where(self.keys[pos] == keys, self.ids[pos], -1)
+
+	def conflicts(self, points):
+		# True for each point with a grid point within radius
+		found = np.zeros(len(points), dtype=bool)
+		if self.n == 0 or len(points) == 0:
+			return found
+		# Visit the points in cell order, so the table lookups are (nearly) sequential,
+		# and stop looking for a point as soon as one conflict is found
+		keys = self.key(points)
+		rows = np.argsort(keys, kind="stable")
+		keys, xyz = keys[rows], points[rows]
+		r2 = self.radius**2
+		done = np.zeros(len(rows), dtype=bool)
+		for step in self.steps:
+			ids = self.lookup(keys + step)
+			hit = (ids >= 0) & ~done
+			sub = np.nonzero(hit)[0]
+			sub = sub[((xyz[sub] - self.points[ids[sub]])**2).sum(axis=1) <= r2]
+			done[sub] = True
+			found[rows[sub]] = True
+			# Leave out the points already found once they are a quarter of the rest
+			if 4*done.sum() >= len(done):
+				left = ~done
+				rows, keys, xyz, done = rows[left], keys[left], xyz[left], done[left]
+				if len(rows) == 0:
+					break
+		return found
+
+	def add(self, points):
+		# Points must be more than radius from each other and from the grid points
+		ids = np.arange(self.n, self.n + len(points))
+		if self.n + len(points) > len(self.points):
+			self.points = np.concatenate([self.points, np.zeros((self.n + len(points) - len(self.points), 3))])
+		self.points[self.n:self.n+len(points)] = points
+		self.n += len(points)
+		keys = self.key(points)
+		if self.dense:
+			self.table[keys] = ids
+		else:
+			keys = np.concatenate([self.keys, keys])
+			order = np.argsort(keys, kind="mergesort")
+			self.keys = keys[order]
+			self.ids = np.concatenate([self.ids, ids])[order]
+
+	def close_pairs(self, points):
+		"""
+		Pairs (i, j), i < j, of the points (which need not be in the grid, and may
+		share cells) within radius of each other, found cell by cell.
+		"""
+		keys = self.key(points)
+		order = np.argsort(keys, kind="stable")
+		cells, start, count = np.unique(keys[order], return_index=True, return_counts=True)
+		r2 = self.radius**2
+		first, second = [np.zeros(0, dtype="int64")], [np.zeros(0, dtype="int64")]
+		# The steps come in opposite pairs, so half of them meet every pair of cells once
+		for step in self.steps:
+			if step < 0:
+				continue
+			pos = np.minimum(np.searchsorted(cells, cells + step), len(cells) - 1)
+			u = np.nonzero(cells[pos] == cells + step)[0]
+			v = pos[u]
+			# Every point of cell u with every point of cell v
+			n = count[u]*count[v]
+			k = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+			a = order[np.repeat(start[u], n) + k//np.repeat(count[v], n)]
+			b = order[np.repeat(start[v], n) + k%np.repeat(count[v], n)]
+			if step > 0:
+				a, b = np.minimum(a, b), np.maximum(a, b)
+			# In the same cell (step 0) each pair comes both ways round
+			near = (a < b) & (((points[a] - points[b])**2).sum(axis=1) <= r2)
+			first.append(a[near])
+			second.append(b[near])
+		return np.concatenate(first), np.concatenate(second)
+
+	def add_batch(self, points, limit):
+		"""
+		Add up to limit of points, none of which is within radius of a grid point.
+		They are settled in order, as if added one at a time: each is kept unless it
+		is within radius of an earlier point of the batch that was kept. Returns the
+		points added.
+		"""
+		first, second = self.close_pairs(points)
+		# 1 kept, -1 dropped, 0 not yet known; a point is known once all the earlier
+		# points near it are, so the first unknown point is settled in every round
+		state = np.zeros(len(points), dtype="int8")
+		while True:
+			state[second[(state[first] == 1) & (state[second] == 0)]] = -1
+			blocked = np.zeros(len(points), dtype=bool)
+			blocked[second[state[first] >= 0]] = True
+			state[(state == 0) & ~blocked] = 1
+			left = state[second] == 0
+			first, second = first[left], second[left]
+			if not (state == 0).any():
+				break
+		points = points[state == 1][:limit]
+		self.add(points)
+		return points
+
+class BoxRegion(object):
+	# Proposals uniform in the box 0 <= x < size[0] (y, z alike)
+	def __init__(self, size):
+		self.size = [float(v) for v in size]
+		self.volume = float(np.prod(self.size))
+
+	def propose(self, rng, n, integer=True):
+		if integer:
+			return rng.integers(0, [int(v) for v in self.size], size=(n, 3)).astype(float)
+		return rng.random((n, 3))*self.size
+
+class MaskRegion(object):
+	"""
+	Proposals uniform over the nonzero voxels of a (z, y, x) mask, which may be a
+	memory map. The mask is scanned once, a few slices at a time, for the blocks of
+	block^3 voxels that hold any of it; proposals are drawn in those blocks only and
+	then rejected by the voxel they fall in, so a mask that fills a few percent of a
+	tomogram costs about as much as a full box.
+	"""
+	def __init__(self, mask, block=16):
+		self.mask = mask
+		self.size = [float(v) for v in mask.shape[::-1]]
+		nz, ny, nx = mask.shape
+		by, bx = -(-ny//block), -(-nx//block)
+		origins, self.volume = [], 0.0
+		for z in range(0, nz, block):
+			slab = np.zeros((block, by*block, bx*block), dtype=bool)
+			slab[:min(block, nz - z), :ny, :nx] = np.asarray(mask[z:z+block]) != 0
+			self.volume += slab.sum()
+			full = slab.reshape(block, by, block, bx, block).any(axis=(0, 2, 4))
+			ys, xs = np.nonzero(full)
+			origins.append(np.column_stack([xs*block, ys*block, np.full(len(xs), z)]))
+		self.origins = np.vstack(origins + [np.zeros((0, 3), dtype=int)])
+		# Blocks on the far edges of the mask are cut short
+		self.extent = np.minimum(self.origins + block, self.size) - self.origins
+		self.cumulative = np.cumsum(np.prod(self.extent, axis=1).astype(float))
+
+	def propose(self, rng, n, integer=True):
+		if len(self.origins) == 0:
+			return np.zeros((0, 3))
+		blocks = np.searchsorted(self.cumulative, rng.random(n)*self.cumulative[-1], side="right")
+		blocks = np.minimum(blocks, len(self.origins) - 1)
+		points = self.origins[blocks] + rng.random((n, 3))*self.extent[blocks]
+		if integer:
+			points = np.floor(points)
+		voxels = np.minimum(points.astype(int), np.array(self.size, dtype=int) - 1)
+		return points[np.asarray(self.mask[voxels[:, 2], voxels[:, 1], voxels[:, 0]]) != 0]
+
+def read_mask(mask_file):
+	# Memory map of an MRC mask, (z, y, x); mrcfile is only needed for --mask
+	try:
+		import mrcfile
+	except ImportError:
+		print("--mask needs the mrcfile module (pip install mrcfile).. exiting")
+		sys.exit()
+	return mrcfile.mmap(mask_file, mode='r', permissive=True).data
+
+def poisson_disk(size, npart, radius, rng, integer=True, batch=131072, verbose=False, region=None):
+	"""
+	Up to npart random points in the box 0 <= x < size[0] (y, z alike), or in the
+	region (BoxRegion, MaskRegion), all more than radius apart: whole numbers with
+	integer, floats otherwise. rng is a NumPy Generator. Stops early, with fewer
+	points, if 100 batches in a row add none. A radius of 0 places the points
+	independently (complete spatial randomness), in distinct voxels with integer.
+	"""
+	region = BoxRegion(size) if region is None else region
+	if radius <= 0:
+		points, stalled = np.zeros((0, 3)), 0
+		dims = np.array(region.size, dtype="int64")
+		while len(points) < npart and stalled < 100:
+			n = len(points)
+			props = region.propose(rng, int(min(batch, max(1024, 2*(npart - n)))), integer)
+			if integer:
+				# Each voxel is taken once at most, as with the old set of excluded voxels
+				props = np.vstack([points, props])
+				voxels = props.astype("int64")
+				first = np.unique((voxels[:, 0]*dims[1] + voxels[:, 1])*dims[2] + voxels[:, 2], return_index=True)[1]
+				first.sort()
+				props = props[first[first >= n]]
+			points = np.vstack([points, props[:npart - n]])
+			stalled = 0 if len(points) > n else stalled + 1
+		return points
+	grid = CellGrid(region.size, radius, npart)
+	stalled = 0
+	while grid.n < npart and stalled < 100:
+		nprop = int(min(batch, max(1024, 4*(npart - grid.n))))
+		props = region.propose(rng, nprop, integer)
+		props = grid.add_batch(props[~grid.conflicts(props)], npart - grid.n)
+		stalled = 0 if len(props) else stalled + 1
+		if verbose:
+			print("%s of %s points placed" % (grid.n, npart))
+	return grid.points[:grid.n]
+
+def main(sizeX, sizeY, sizeZ, npart, radius, cenX, opts):
+	region = None
+	if opts["--mask"]:
+		mask = read_mask(opts["--mask"])
+		if (sizeX, sizeY, sizeZ) != (0, 0, 0) and (sizeX, sizeY, sizeZ) != mask.shape[::-1]:
+			print("The mask is %s x %s x %s, but the box is %s x %s x %s (use 0 0 0 for the mask's size).. exiting"
+				% (tuple(mask.shape[::-1]) + (sizeX, sizeY, sizeZ)))
+			sys.exit()
+		sizeX, sizeY, sizeZ = mask.shape[::-1]
+		region = MaskRegion(mask)
+		volume = region.volume
+		print("Mask: %d voxels (%.1f%% of the box) in %d blocks" % (volume, 100.0*volume/mask.size, len(region.origins)))
+		if volume == 0:
+			print("The mask is empty.. exiting")
+			sys.exit()
+	else:
+		volume = float(sizeX)*sizeY*sizeZ
+	fraction = packing_fraction(npart, radius, volume)
+	print("Packing fraction: %.3f (random packings jam at about %.2f)" % (fraction, MAX_PACKING))
+	if fraction >= MAX_PACKING:
+		# Such packings can never be reached by random placement (the old sampler looped forever)
+		print("%s points more than %s pixels apart cannot be placed at random in %d voxels; at most about %d fit.. exiting"
+			% (npart, radius, volume, MAX_PACKING*volume/packing_fraction(1, radius, 1.0)))
+		sys.exit()
+	if radius <= 0 and not opts["--float"] and npart > volume:
+		print("%s points cannot go in distinct voxels of %d voxels.. exiting" % (npart, volume))
+		sys.exit()
+	rng = np.random.default_rng(opts["--seed"] if opts["--seed"] >= 0 else None)
+	results = poisson_disk((sizeX, sizeY, sizeZ), npart, radius, rng, not opts["--float"], verbose=opts["--verbose"], region=region)
+	if len(results) < npart:
+		print("Warning: only %s of %s points could be placed (packing fraction %.3f)" % (len(results), npart, packing_fraction(len(results), radius, volume)))
+	offX = np.array([cenX,0,0])
+	results += offX
+
+	print(results)
+	np.savetxt("out.txt", results, fmt='%1.2f' if opts["--float"] else '%d', delimiter=" ")
+	ot_imodmodel.write_points("out.mod", results, sphere=6)
+	#ot_imodmodel.write_points("out.mod", results, sphere=radius)
+
+if __name__ == "__main__":
+	#---------- BEGIN User inputs ------------------------------
+	# stackoverflow.com/questions/2194163/python-empty-argument
+	args, opts = ot_common.parse_options(sys.argv[1:], {"--float": False, "--seed": -1, "--verbose": False, "--mask": ""})
+	try:
+		sizeX  = int(args[0])
+		sizeY  = int(args[1])
+		sizeZ  = int(args[2])
+		npart  = int(args[3])
+		radius = float(args[4])
+		cenX   = int(args[5])
+	except IndexError:
+		print("================================================================")
+		print("Usage:>>   ot_rand3Dcoord_rect.py [dimX] [dimY] [dimZ] [npart] [rad] [cenX] [Options]")
+		print("================================================================")
+		print("dimX/Y/Z : box's X/Y/Z axes lengths, in pixels")
+		print("npart:     number of particles")
+		print("rad:       size of particles, for overlap exclusion")
+		print("cenX:      move center of mass along X axes this much")
+		print("----------------------------------------------------------------")
+		print("Options:")
+		print("--mask M   MRC mask: points only in its nonzero voxels (dimX/Y/Z 0 0 0")
+		print("           or the mask's size)")
+		print("--float    Sub-voxel (floating point) coordinates instead of whole voxels")
+		print("--seed N   Seed of the random numbers, for a reproducible set of points")
+		print("--verbose  Report progress after each batch of proposals")
+		print("----------------------------------------------------------------")
+		print("Creates a random array of points within a rectangular box (or a mask)")
+		print("Packings denser than random placement can reach (about 0.38 of the box")
+		print("filled by spheres of diameter rad) are refused up front")
+		print("----------------------------------------------------------------")
+		print("Output:>> out.txt & out.mod")
+		sys.exit()
+	#----------- END User inputs -------------------------------
+	main(sizeX, sizeY, sizeZ, npart, radius, cenX, opts)
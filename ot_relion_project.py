@@ -1,76 +1,211 @@
 #!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Generated with the assistance of Claude (Anthropic).
+# Model: Claude (Anthropic), version not recorded        Date: 2026-10-18
+# Reviewed, tested, and validated by the Gan Lab (Anaphase); the authors take
+# full responsibility for the correctness of this code.
+# Lab: https://github.com/anaphaze | https://www.anaphase.org
+# AI-assisted sections: slab_range, project_slab, new_stack, StackStats,
+#   subtomo_names, project_task and main, which replace the clip/newstack commands;
+#   the usage text predates this header.
+# -----------------------------------------------------------------------------
 # ot_relion_project.py -- average the central N slices in a large number of tomos
 #
 # If you find this script useful for your work, please cite:
 # Cai, 2018, PNAS, Cryo-ET reveals the macromolecular reorganization of S. pombe mitotic chromosomes in vivo
 # https://www.ncbi.nlm.nih.gov/pubmed/30297429
 #
-# Dependencies: IMOD
+# Dependencies: numpy, mrcfile, ot_common.py, ot_starfile.py (for --star only) (works with python 2.7 and 3)
 # Created: 20170713 (Lu Gan)
-
+# Revised: 20261018 (agent) Reads and averages the slices in python instead of running clip avg,
+#   newstack and rm on tmp_*.mrc files
+# Revised: 20261018 (agent) Projects in a pool of processes (--jobs), each image written into its
+#   place in the stack by input order (newstack took the tmp files in glob order); names
+#   from a star file (--star) or a list file (--list); reports throughput
+#
 # Algorithm:
-# 1) Use clip to make projections of subtomorams, N slices thick
-# 2) Use newstack to create image stack from projections
-
-import os, subprocess, sys, struct, math
-
-#---------- BEGIN User inputs ------------------------------
-# stackoverflow.com/questions/2194163/python-empty-argument
-try:
-   name_tomos = sys.argv[2]
-   num_slice = int(sys.argv[1])
-except IndexError:
-   print "================================================================"
-   print "Usage:>>   ot_relion_project.py  [N_slices]  [Subtomos]"
-   print "Run within /Extract/extract/Tomograms/tomo1"
-   print "Example:   ot_relion_project.py 24 *.mrc"
-   print "----------------------------------------------------------------"
-   print "N_slices:  Number of slices to average"
-   print "Subtomos:  Subtomograms to generate projections with"
-   print "----------------------------------------------------------------"
-   print "Output:>>  stack_N-slices_thick.mrcs"
-   sys.exit()
-#----------- END User inputs -------------------------------
-
-
-#----------- BEGIN File and system parameters --------------
-for name_tomo in sys.argv[2:]:
-   name_root1, name_extension = os.path.splitext(name_tomo)
-   name_root = os.path.basename(name_root1)
-   print name_root 
-
-   # Get max number of slices
-   with open (name_tomo, 'rb') as file:
-      content = file.read()
-      pixZ_rec = struct.unpack('3i',content[:12])[2]
-
-      file.seek(76)
-      content = file.read()
-      amin_rec = struct.unpack('3f',content[:12])[0]
-
-   file.close
-   print "Total slices: %s" %(pixZ_rec)
-
-   # Calculate N_lower and N_upper (lower and upper slices to average)
-   N_middle = int(math.ceil(pixZ_rec/2))
-   if (num_slice % 2 == 0):
-      N_lower = N_middle - (num_slice/2)
-      N_upper = N_middle + (num_slice/2) - 1
-   else:
-      N_lower = int(N_middle - math.floor(num_slice/2))
-      N_upper = int(N_middle + math.floor(num_slice/2))
-
-   print "mid: %s    bot: %s    top: %s" % (N_middle, N_lower, N_upper)
-   print "name %s" % (name_root)
-
-   os.system('clip avg -2d -iz %s-%s %s tmp_%s.mrc' % (N_lower, N_upper, name_tomo, name_root))
-os.system('newstack tmp*.mrc stack_%s-slices_thick.mrcs' % (num_slice))
-os.system('/bin/rm tmp*.mrc *~')
-
-print "---------------------------------------------------------------------------"
-print "\n"
-print "Please make backup of your original stack, then rename stack.mrcs to the relion stack"
-print "Copy the new stack.mrcs file to  ../../../proj3d/Tomograms/tomo001/blah.mrcs"
-print "\n"
-
-sys.exit()
+# 1) Read each subtomogram's header, and memory-map its data, so only the central N
+#    slices are read from disk
+# 2) Average them (as "clip avg -2d -iz" did) into a float image, written straight into
+#    its place in the output stack, in the order the subtomograms were given
+
+from __future__ import print_function
+import os, sys, time
+import numpy as np
+import mrcfile
+import ot_common
+
+
+def slab_range(nz, num_slice):
+	"""
+	First and last (0-based, inclusive) of the num_slice central slices of nz, as
+	before: the middle slice is nz//2, with one slice more below it for even N
+	"""
+	N_middle = nz//2
+	N_lower = N_middle - num_slice//2
+	return N_lower, N_lower + num_slice - 1
+
+def project_slab(name_tomo, num_slice):
+	"""
+	Average of the central num_slice slices of an MRC file, as a float32 (y, x) image,
+	and the file's number of slices. Only those slices are read.
+	"""
+	with mrcfile.mmap(name_tomo, mode='r', permissive=True) as mrc:
+		nz = mrc.data.shape[0] if mrc.data.ndim == 3 else 1
+		N_lower, N_upper = slab_range(nz, num_slice)
+		if N_lower < 0 or N_upper >= nz:
+			raise ValueError("has %s slices, fewer than %s" % (nz, num_slice))
+		slab = mrc.data[N_lower:N_upper+1] if mrc.data.ndim == 3 else mrc.data[None]
+		return slab.mean(axis=0, dtype="float64").astype("float32"), nz
+
+def new_stack(out_file, nimage, ny, nx, voxel_size):
+	# Float32 image stack of nimage (ny, nx) images, memory-mapped for writing in place
+	mrc = mrcfile.new_mmap(out_file, shape=(nimage, ny, nx), mrc_mode=2, overwrite=True)
+	mrc.set_image_stack()
+	mrc.voxel_size = voxel_size
+	return mrc
+
+class StackStats(object):
+	# Running min, max, mean and rms of the images written, for the stack's header
+	def __init__(self):
+		self.n, self.total, self.squares = 0, 0.0, 0.0
+		self.amin, self.amax = np.inf, -np.inf
+
+	def add(self, image):
+		self.n += image.size
+		self.total += image.sum(dtype="float64")
+		self.squares += np.square(image, dtype="float64").sum()
+		self.amin = min(self.amin, float(image.min()))
+		self.amax = max(self.amax, float(image.max()))
+
+	def merge(self, other):
+		self.n += other.n
+		self.total += other.total
+		self.squares += other.squares
+		self.amin = min(self.amin, other.amin)
+		self.amax = max(self.amax, other.amax)
+
+	def write(self, mrc):
+		mean = self.total/max(1, self.n)
+		mrc.header.dmin, mrc.header.dmax, mrc.header.dmean = self.amin, self.amax, mean
+		mrc.header.rms = np.sqrt(max(0.0, self.squares/max(1, self.n) - mean*mean))
+
+def subtomo_names(args, opts):
+	# Subtomogram file names, in order: from the command line, a list file (one per line) or a star file column
+	if opts["--list"]:
+		with open(opts["--list"]) as f:
+			return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+	if opts["--star"]:
+		import ot_starfile
+		return [str(name) for name in ot_starfile.read_particles(opts["--star"], [opts["--column"]])[opts["--column"]]]
+	return args
+
+# Shared with the projection workers (see ot_common.worker_pool)
+_project_job = {}
+
+def project_task(task):
+	"""
+	Worker: (index, name) -> (index, name, number of slices, StackStats of the image),
+	or (index, name, message) if it cannot be used. The image is written into image
+	index of the output stack, so the order never depends on which worker is first.
+	"""
+	index, name_tomo = task
+	job = _project_job
+	try:
+		projection, nz = project_slab(name_tomo, job["num_slice"])
+	except (IOError, OSError, ValueError) as err:
+		return index, name_tomo, str(err)
+	if projection.shape != job["shape"]:
+		return index, name_tomo, "is %s x %s, but the stack is %s x %s" % (projection.shape[::-1] + job["shape"][::-1])
+	if "data" not in job:
+		job["data"] = ot_common.data_memmap(job["out_file"])
+	job["data"][index] = projection
+	stats = StackStats()
+	stats.add(projection)
+	return index, name_tomo, nz, stats
+
+def main(num_slice, name_tomos, opts):
+	out_file = "stack_%s-slices_thick.mrcs" % (num_slice)
+	with mrcfile.open(name_tomos[0], mode='r', permissive=True, header_only=True) as mrc:
+		nx, ny = int(mrc.header.nx), int(mrc.header.ny)
+		voxel_size = mrc.voxel_size.copy()
+	new_stack(out_file, len(name_tomos), ny, nx, voxel_size).close()
+
+	_project_job.clear()
+	_project_job.update(out_file=out_file, num_slice=num_slice, shape=(ny, nx))
+	tasks = list(enumerate(name_tomos))
+	start = time.time()
+	pool = None
+	if opts["--jobs"] > 1:
+		pool = ot_common.worker_pool(opts["--jobs"], __name__, "_project_job")
+		results = pool.imap_unordered(project_task, tasks, chunksize=max(1, min(64, len(tasks)//(4*opts["--jobs"]))))
+	else:
+		results = (project_task(task) for task in tasks)
+	stats = StackStats()
+	nread = 0
+	for result in results:
+		if len(result) == 3:
+			print("%s: %s.. exiting" % result[1:])
+			if pool is not None:
+				pool.terminate()
+			# No half-filled stack left behind
+			os.remove(out_file)
+			sys.exit()
+		index, name_tomo, nz, image_stats = result
+		stats.merge(image_stats)
+		nread += 1
+		if opts["--verbose"] or pool is None:
+			name_root = os.path.splitext(os.path.basename(name_tomo))[0]
+			print("%s: %s slices, averaged %s-%s" % ((name_root, nz) + slab_range(nz, num_slice)))
+	if pool is not None:
+		pool.close()
+		pool.join()
+	_project_job.clear()
+	elapsed = time.time() - start
+	with mrcfile.mmap(out_file, mode='r+') as stack:
+		stats.write(stack)
+	nbytes = float(nread)*num_slice*nx*ny*4
+	print("Wrote %s (%s images of %s x %s) in %1.1f s: %1.1f subtomograms/s, about %1.1f MB/s of slices read"
+		% (out_file, nread, nx, ny, elapsed, nread/max(elapsed, 1e-9), nbytes/1e6/max(elapsed, 1e-9)))
+
+	print("---------------------------------------------------------------------------")
+	print("\n")
+	print("Please make backup of your original stack, then rename stack.mrcs to the relion stack")
+	print("Copy the new stack.mrcs file to  ../../../proj3d/Tomograms/tomo001/blah.mrcs")
+	print("\n")
+
+if __name__ == "__main__":
+	#---------- BEGIN User inputs ------------------------------
+	# stackoverflow.com/questions/2194163/python-empty-argument
+	args, opts = ot_common.parse_options(sys.argv[1:], {"--jobs": 1, "--star": "", "--list": "", "--column": "rlnImageName", "--verbose": False})
+	try:
+		num_slice  = int(args[0])
+		name_tomos = subtomo_names(args[1:], opts)
+		name_tomo  = name_tomos[0]
+	except (IOError, OSError, KeyError) as err:
+		print("Cannot read the subtomogram names: %s.. exiting" % err)
+		sys.exit()
+	except (IndexError, ValueError):
+		print("================================================================")
+		print("Usage:>>   ot_relion_project.py  [N_slices]  [Subtomos] [Options]")
+		print("Run within /Extract/extract/Tomograms/tomo1")
+		print("Example:   ot_relion_project.py 24 *.mrc")
+		print("Example:   ot_relion_project.py 24 --star particles.star --jobs 16")
+		print("----------------------------------------------------------------")
+		print("N_slices:  Number of slices to average")
+		print("Subtomos:  Subtomograms to generate projections with")
+		print("----------------------------------------------------------------")
+		print("Options:")
+		print("--jobs N     Project N subtomograms at a time, in N processes (default 1)")
+		print("--star F     Take the subtomograms from star file F, in its order")
+		print("--column C   Star file column with their names (default rlnImageName)")
+		print("--list F     Take the subtomograms from text file F, one name per line")
+		print("--verbose    Report every subtomogram (always done with --jobs 1)")
+		print("----------------------------------------------------------------")
+		print("Output:>>  stack_N-slices_thick.mrcs (one image per subtomogram, in the order given)")
+		sys.exit()
+	#----------- END User inputs -------------------------------
+	if num_slice < 1:
+		print("N_slices must be 1 or more.. exiting")
+		sys.exit()
+	main(num_slice, name_tomos, opts)
@@ -1,268 +1,281 @@
 #!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Generated with the assistance of Claude (Anthropic).
+# Model: Claude (Anthropic), version not recorded        Date: 2026-10-18
+# Reviewed, tested, and validated by the Gan Lab (Anaphase); the authors take
+# full responsibility for the correctness of this code.
+# Lab: https://github.com/anaphaze | https://www.anaphase.org
+# AI-assisted sections: "Data handling", "Transformation functions", "Bookkeeping
+#   calculations", "Parallel work" and the header read; the rest of the file
+#   predates this header.
+# -----------------------------------------------------------------------------
 # ot_remap.py -- creates a remapped model from a RELION subtomogram average
 #
 # If you find this script useful for your work, please cite:
 # Cai, 2018, MBoC, Natural chromatin is heterogeneous and self-associates in vitro
 # https://www.ncbi.nlm.nih.gov/pubmed/29742050
 #
-# Dependencies: EMAN2, IMOD, Bsoft
+# Dependencies: IMOD, Bsoft, numpy, scipy, mrcfile
 # Created: 20161021 (Shujun Cai)
 # Revised: 20161227 (Lu Gan) merged scripts, increased user-friendliness
 # Revised: 20161231 (SC & LG) e2proc3d uses SPIDER Euler convention; read _data.star & class ID
 # Revised: 20180117 (LG) added origin shifts
 # Revised: 20190509 (LG) ignore # comments; fixed range(sub1,sub2) out of index bug
+# Revised: 20261018 (agent) read the star file with ot_starfile.py instead of grep/awk and temp.txt
+# Revised: 20261018 (agent) in-memory rotate/add engine replaces the e2proc3d/bimg/newstack/clip chain
+# Revised: 20261018 (agent) partial sums go to /dev/shm only if it has room for them, else to the
+#   current directory
+# Revised: 20261018 (agent) script body in main(); workers get their data through ot_common.worker_pool,
+#   so they also work when started by spawn (macOS, Windows)
 #
 # Based on Tanmay Bharat's relion_2Dto3D_star.py:
 # http://www.sciencedirect.com/science/article/pii/S0969212615002798
 # http://www2.mrc-lmb.cam.ac.uk/relion/index.php/Sub-tomogram_averaging
 #
 # Algorithm:
-# 1) Rotate all subtomograms  (Euler = SPIDER "ZYZ" and rotates average into subtomo)
-# 2) Enlarge all subtomograms
-# 3) Translate particles to correct positions
-# 4) Add subsets of transformed subtomograms
-# 5) Merge all tomograms with IMOD's clip (not parallelized)
-
-import os, subprocess, csv, sys, multiprocessing, struct, time, math
-
-#---------- BEGIN User inputs ------------------------------
-# stackoverflow.com/questions/2194163/python-empty-argument
-try:
-   name_avg  = sys.argv[1]
-   name_tomo = sys.argv[2]
-   name_star = sys.argv[3]
-   name_cls  = sys.argv[4]
-except IndexError:
-   print "================================================================"
-   print "Usage:>>   ot_remap.py [Average] [Tomogram] [Starfile] [ClassID]"
-   print "----------------------------------------------------------------"
-   print "Average:   the class average you want to remap"
-   print "Tomogram:  original tomogram that has all particles"
-   print "Starfile:  _data.star file that contains all classes"
-   print "ClassID:   Class number you want to remap"
-   print "----------------------------------------------------------------"
-   print "Output:>> syn_tomo_cls[ClassID].mrc"
-   print "To invert tomogram, run 'bimg -invert positive.mrc negative.mrc'"
+# 1) Rotate all subtomograms  (Euler = SPIDER "ZYZ" and rotates average into subtomo; ot_xform.py)
+# 2) Rescale each to 0-5.2 and round to integers, as bimg -rescale / newstack -mode 1 did
+# 3) Add each particle's box at its position in a per-worker partial volume, which only
+#    spans the Z range of that worker's particles (no full-size temporary files)
+# 4) Add the partial volumes pairwise, in parallel, until one is left (tree reduction)
+# 5) Write it as a mode 1 (16-bit integer) tomogram
+
+import os, sys, multiprocessing, struct, time, math, tempfile, shutil
+import numpy, mrcfile
+import ot_common, ot_starfile, ot_xform
+
+
+#---------- BEGIN Transformation functions -----------------
+# Shared with the workers: average, tomogram size, particle positions and angles, scratch directory
+_sum_job = {}
+
+def box_start(dim, box, coord):
+   # Index where the particle box starts along one axis. Same arithmetic as the old
+   # clip resize steps: the box was padded into the middle of a dim-sized volume,
+   # which was then recentered on (dim - coord), truncated to an integer by %d
+   return (dim - box)//2 + dim//2 - int(dim - coord)
+
+def rescale_levels(arr):
+   # bimg -rescale 0,5.2 followed by conversion to integers (newstack -mode 1)
+   lo, hi = arr.min(), arr.max()
+   if hi <= lo:
+      return numpy.zeros(arr.shape)
+   return numpy.rint((arr - lo)*(5.2/(hi - lo)))
+
+def chunk_span(indices, box, dimZ, z):
+   # Number of Z slices of the partial volume of a chunk of particles (see particle_sum)
+   zs = [box_start(dimZ, box, z[i]) for i in indices]
+   return max(0, min(dimZ, max(zs) + box) - max(0, min(zs)))
+
+def free_bytes(path):
+   # Space left for an ordinary user on the file system that holds path
+   st = os.statvfs(path)
+   return st.f_bavail*st.f_frsize
+
+def particle_sum(chunk):
+   # Add the particles of one chunk into a private int32 partial volume that spans
+   # only the Z range of their boxes; returns (file, z0, z1) or None if nothing landed
+   j, indices = chunk
+   job = _sum_job
+   avg, (dimX, dimY, dimZ) = job["avg"], job["dims"]
+   x, y, z, rot, tlt, psi = job["x"], job["y"], job["z"], job["rot"], job["tlt"], job["psi"]
+   time1 = time.time()
+   box = avg.shape[0]
+   starts = [[box_start(dimX, box, x[i]), box_start(dimY, box, y[i]), box_start(dimZ, box, z[i])] for i in indices]
+   z0 = max(0, min(s[2] for s in starts))
+   z1 = min(dimZ, max(s[2] for s in starts) + box)
+   if z1 <= z0:
+      return None
+   path = os.path.join(job["scratch"], 'sum_%05d.dat' % j)
+   partial = numpy.memmap(path, dtype='int32', mode='w+', shape=(z1 - z0, dimY, dimX))
+   # 16 particles at a time, or fewer if their boxes would take more than ot_xform.WORK_BYTES
+   nbatch = min(16, ot_xform.batch_limit(avg.shape))
+   for first in range(0, len(indices), nbatch):
+      batch = indices[first:first+nbatch]
+      mats = ot_xform.spider_matrices([rot[i] for i in batch], [tlt[i] for i in batch], [psi[i] for i in batch])
+      for arr, start in zip(ot_xform.resample(avg, mats), starts[first:first+nbatch]):
+         arr = rescale_levels(rescale_levels(arr)).astype('int32')
+         # Crop the parts of the box that fall outside the tomogram (or this partial)
+         lo = [max(0, -start[0]), max(0, -start[1]), max(0, z0 - start[2])]
+         hi = [min(box, dimX - start[0]), min(box, dimY - start[1]), min(box, z1 - start[2])]
+         if min(hi[k] - lo[k] for k in range(3)) <= 0:
+            continue
+         partial[start[2]+lo[2]-z0:start[2]+hi[2]-z0, start[1]+lo[1]:start[1]+hi[1], start[0]+lo[0]:start[0]+hi[0]] \
+            += arr[lo[2]:hi[2], lo[1]:hi[1], lo[0]:hi[0]]
+   partial.flush()
+   del partial
+   print("Job %s: added %s particles in %.1f seconds" % (j, len(indices), time.time() - time1))
+   return path, z0, z1
+
+def add_partials(pair):
+   # One step of the tree reduction: the sum of two partials, spanning both Z ranges
+   (path_a, a0, a1), (path_b, b0, b1) = pair
+   dimX, dimY, dimZ = _sum_job["dims"]
+   part_a = numpy.memmap(path_a, dtype='int32', mode='r+', shape=(a1 - a0, dimY, dimX))
+   part_b = numpy.memmap(path_b, dtype='int32', mode='r', shape=(b1 - b0, dimY, dimX))
+   if a0 <= b0 and a1 >= b1:
+      path, z0, z1, total = path_a, a0, a1, part_a
+   else:
+      z0, z1 = min(a0, b0), max(a1, b1)
+      path = path_a + '+'
+      total = numpy.memmap(path, dtype='int32', mode='w+', shape=(z1 - z0, dimY, dimX))
+      total[a0-z0:a1-z0] = part_a
+   total[b0-z0:b1-z0] += part_b
+   total.flush()
+   del part_a, part_b, total
+   for old in (path_a, path_b):
+      if old != path:
+         os.remove(old)
+   return path, z0, z1
+#---------- END Transformation functions -------------------
+
+
+def main():
+   #---------- BEGIN User inputs ------------------------------
+   # stackoverflow.com/questions/2194163/python-empty-argument
+   try:
+      name_avg  = sys.argv[1]
+      name_tomo = sys.argv[2]
+      name_star = sys.argv[3]
+      name_cls  = sys.argv[4]
+   except IndexError:
+      print("================================================================")
+      print("Usage:>>   ot_remap.py [Average] [Tomogram] [Starfile] [ClassID] [Jobs]")
+      print("----------------------------------------------------------------")
+      print("Average:   the class average you want to remap")
+      print("Tomogram:  original tomogram that has all particles")
+      print("Starfile:  _data.star file that contains all classes")
+      print("ClassID:   Class number you want to remap")
+      print("Jobs:      (optional) number of parallel jobs, default = number of cores")
+      print("----------------------------------------------------------------")
+      print("Output:>> syn_pos_cls[ClassID].mrc")
+      print("To invert tomogram, run 'bimg -invert positive.mrc negative.mrc'")
+      sys.exit()
+   #----------- END User inputs -------------------------------
+
+
+   #----------- BEGIN File and system parameters --------------
+   # Get x,y,z dimensions (first 12 bytes of the MRC header)
+   with open (name_tomo, 'rb') as file:
+      dimX, dimY, dimZ = struct.unpack('3i', file.read(12))
+
+   # Get system parameters
+   # stackoverflow.com/questions/1006289/how-to-find-out-the-number-of-cpus-using-python
+   # stackoverflow.com/questions/4271740/how-can-i-use-python-to-get-the-system-hostname
+   ncpu = multiprocessing.cpu_count()
+   myhost = os.uname()[1]
+   # stackoverflow.com/questions/2104080/how-to-check-file-size-in-python
+   size_tomo = float(os.stat(name_tomo).st_size)
+   size_tomo_gibi = size_tomo / 1073741824
+   #---------- END File and system parameters -----------------
+
+
+   #---------- BEGIN Data handling ----------------------------
+   # Read only the needed columns of the star file (cached in [Starfile].npz, see ot_starfile.py)
+   columns = ["rlnCoordinateX", "rlnCoordinateY", "rlnCoordinateZ", "rlnOriginX", "rlnOriginY", "rlnOriginZ",
+              "rlnAngleRot", "rlnAngleTilt", "rlnAnglePsi", "rlnClassNumber"]
+   try:
+      star = ot_starfile.read_particles(name_star, columns)
+   except KeyError as err:
+      print("Could not read %s (%s)" % (name_star, err))
+      sys.exit()
+
+   ### Make database of only the relevant values in memory
+   star = star[star["rlnClassNumber"] == float(name_cls)]
+   x = (star["rlnCoordinateX"] - star["rlnOriginX"]).tolist()
+   y = (star["rlnCoordinateY"] - star["rlnOriginY"]).tolist()
+   z = (star["rlnCoordinateZ"] - star["rlnOriginZ"]).tolist()
+   rot = star["rlnAngleRot"].tolist()
+   tlt = star["rlnAngleTilt"].tolist()
+   psi = star["rlnAnglePsi"].tolist()
+   cls = star["rlnClassNumber"].tolist()  # Unessential, but keep for future diagnostics
+   num_line = len(star)
+   with mrcfile.open(name_avg, mode='r', permissive=True) as mrc:
+      avg = numpy.array(mrc.data, dtype='float32')
+   with mrcfile.open(name_tomo, mode='r', header_only=True, permissive=True) as mrc:
+      voxel_size = mrc.voxel_size
+   #---------- END Data handling ------------------------------
+
+
+   #---------- BEGIN Bookkeeping calculations -----------------
+   # Particles are sorted by Z, so each job's partial volume is a thin slab of the tomogram
+   num_jobs = max(1, min(int(sys.argv[5]) if len(sys.argv) > 5 else ncpu, num_line))
+   num_task = int(math.ceil(float(num_line)/num_jobs))  # tasks per core
+   order = sorted(range(num_line), key=lambda i: z[i])
+   chunks = [(j, order[j*num_task:(j+1)*num_task]) for j in range(num_jobs)]
+   chunks = [chunk for chunk in chunks if chunk[1]]
+   # The int32 partials take 4 bytes per voxel of their slabs; while a pair is added the
+   # sum and both parts exist at once, so the reduction never needs more than twice that
+   scratch_need = 2*4*dimX*dimY*sum(chunk_span(chunk[1], avg.shape[0], dimZ, z) for chunk in chunks)
+   # Partial sums go to shared memory (RAM) if it has room, otherwise next to the output
+   scratch_root = None
+   for root in ['/dev/shm', '.']:
+      if os.path.isdir(root) and os.access(root, os.W_OK) and free_bytes(root) > scratch_need:
+         scratch_root = root
+         break
+   print("\"%s\" has %s members in class %s " % (name_avg, num_line, name_cls))
+   print("\"%s\" is %s x %s x %s and uses %.2f GB" % (name_tomo, dimX, dimY, dimZ, size_tomo_gibi))
+   if scratch_root is None:
+      print("The partial sums need %.2f GB, more than is free in /dev/shm or the current directory.. exiting" % (scratch_need/1073741824.0))
+      sys.exit()
+   print("%s has %s cores; partial sums (%.2f GB) go to %s" % (myhost, ncpu, scratch_need/1073741824.0, scratch_root))
+   print("There will be %s parallel jobs handling %s subtomograms each" % (num_jobs, num_task))
+   #---------- END Bookkeeping calculations -------------------
+
+
+   #---------- BEGIN Parallel work ----------------------------
+   sizadd_time1 = time.time()
+   name_cls = int(name_cls)
+   name_pos = 'syn_pos_cls%02d.mrc' % (name_cls)
+
+   scratch = tempfile.mkdtemp(prefix='ot_remap_', dir=scratch_root)
+   try:
+      _sum_job.clear()
+      _sum_job.update(avg=avg, dims=(dimX, dimY, dimZ), x=x, y=y, z=z, rot=rot, tlt=tlt, psi=psi, scratch=scratch)
+      pool = ot_common.worker_pool(num_jobs, __name__, "_sum_job")
+      partials = [p for p in pool.map(particle_sum, chunks) if p is not None]
+      # Tree reduction: add neighbouring partials pairwise, in parallel, until one is left
+      while len(partials) > 1:
+         pairs = [(partials[i], partials[i+1]) for i in range(0, len(partials) - 1, 2)]
+         merged = pool.map(add_partials, pairs)
+         if len(partials) % 2:
+            merged.append(partials[-1])
+         partials = merged
+      pool.close()
+      pool.join()
+
+      out = mrcfile.new_mmap(name_pos, shape=(dimZ, dimY, dimX), mrc_mode=1, overwrite=True)
+      out.voxel_size = voxel_size
+      if partials:
+         path, z0, z1 = partials[0]
+         total = numpy.memmap(path, dtype='int32', mode='r', shape=(z1 - z0, dimY, dimX))
+         for k in range(z0, z1, 64):
+            out.data[k:min(k+64, z1)] = numpy.clip(total[k-z0:min(k+64, z1)-z0], -32768, 32767)
+         del total
+      out.update_header_stats()
+      out.close()
+   finally:
+      shutil.rmtree(scratch, ignore_errors=True)
+
+   sizadd_time2 = time.time()
+   # Uncomment to get synthetic tomo w/ inverted contrast:
+   os.system('bimg -invert syn_pos_cls%02d.mrc syn_neg_cls%02d.mrc' % (name_cls, name_cls))
+
+   os.system('rm -f *.mrc~')  # Comment out for diagnostics
+   #---------- END Parallel work ------------------------------
+
+
+   #---------- Sum all to compare with tomo --------------------
+   os.system('clip add -m 1 syn_pos*mrc syn_sum_pos.mrc')
+   os.system('clip add -m 1 syn_neg*mrc syn_sum_neg.mrc')
+
+   print("--------------------------------------------------------")
+   print("Processing time: %01d seconds" % (sizadd_time2 - sizadd_time1))
+   print("\"%s\" has %s members in class %s " % (name_avg, num_line, name_cls))
+   print("\"%s\" is %s x %s x %s and uses %.2f GB" % (name_tomo, dimX, dimY, dimZ, size_tomo_gibi))
+   print("There were %s parallel jobs handling %s subtomograms each" % (num_jobs, num_task))
+   print("done")
    sys.exit()
-#----------- END User inputs -------------------------------
-
-
-#----------- BEGIN File and system parameters --------------
-# Get x,y,z dimensions
-with open (name_tomo, 'rb') as file:
-   content = file.read()
-   dimX = struct.unpack('3i',content[:12])[0]
-   dimY = struct.unpack('3i',content[:12])[1]
-   dimZ = struct.unpack('3i',content[:12])[2]
-file.close
-
-# Get system parameters
-# stackoverflow.com/questions/1006289/how-to-find-out-the-number-of-cpus-using-python
-# stackoverflow.com/questions/4271740/how-can-i-use-python-to-get-the-system-hostname
-ncpu = multiprocessing.cpu_count()
-myhost = os.uname()[1]
-# Calculate free space; must be done after rotate, expand, & translate operations
-# stackoverflow.com/questions/4260116/find-size-and-free-space-of-the-filesystem-containing-a-given-file
-size_free = os.statvfs('.').f_frsize * os.statvfs('.').f_bavail
-size_free_gibi = size_free / 1073741824
-size_free_tebi = size_free / 1099511627776
-# stackoverflow.com/questions/2104080/how-to-check-file-size-in-python
-size_tomo = float(os.stat(name_tomo).st_size)
-size_tomo_gibi = size_tomo / 1073741824
-#---------- END File and system parameters -----------------
-
-
-#---------- BEGIN RELION header function -------------------
-def read_relion_header(filename):
-
-  ifile = open(filename, 'r')
-
-  # first get the header
-  i, XextCol, YextCol, ZextCol, RotCol, TiltCol, PsiCol, ClassCol, XoriCol, YoriCol, ZoriCol = -1,0,0,0,0,0,0,0,0,0,0
-
-  for line in ifile:
-    emptycheck = line.isspace()     #skip whitespace, usually lines 1 and 3
-    if(emptycheck):
-      continue
-
-    fields = line.split()
-    if fields[0] == 'data_' or fields[0] == 'loop_' or fields[0] == '#':  # skip the data_, loop_, # lines
-      continue
-
-    i= i+1
-
-    firstcol = fields[0]
-
-    if firstcol == '_rlnCoordinateX':
-      XextCol = i
-    if firstcol == '_rlnCoordinateY':
-      YextCol = i
-    if firstcol == '_rlnCoordinateZ':
-      ZextCol = i
-    if firstcol == '_rlnAngleRot':
-      RotCol = i
-    if firstcol == '_rlnAngleTilt':
-      TiltCol = i
-    if firstcol == '_rlnAnglePsi':
-      PsiCol = i
-    if firstcol == '_rlnClassNumber':
-      ClassCol = i
-    if firstcol == '_rlnOriginX':
-      XoriCol = i
-    if firstcol == '_rlnOriginY':
-      YoriCol = i
-    if firstcol == '_rlnOriginZ':
-      ZoriCol = i
-
-    if firstcol[0] != '_':
-      break
-
-  return(XextCol,YextCol,ZextCol,RotCol,TiltCol,PsiCol,ClassCol,XoriCol,YoriCol,ZoriCol)
-#---------- END RELION header function ---------------------
-
-
-#---------- BEGIN Transformation thread function -----------
-def clipadd(j):                # j indexes each core
-   sub1=j*num_task             # first iter index
-   sub2=(j+1)*num_task-1       # last iter index
-   for i in range(sub1,sub2):
-      if (i == sub1 and i < (num_line-1)):     # Initialize 1st sum, making sure not to overcount
-# Rotate i == sub1
-         a=float(rot[i])
-         b=float(tlt[i])
-         c=float(psi[i])
-         os.system('e2proc3d.py --rot=spider:phi=%d:theta=%d:psi=%d %s tmp_ema_%05d.mrc' % (a, b, c, name_avg, i))
-         os.system('bimg -rescale 0,5.2 tmp_ema_{0:05d}.mrc tmp_sca_{0:05d}.mrc'.format(i))
-         os.system('newstack -q -mode 1 tmp_sca_{0:05d}.mrc tmp_mod_{0:05d}.mrc'.format(i))
-         os.system('bimg -rescale 0,5.2 tmp_mod_{0:05d}.mrc tmp_rot_{0:05d}.mrc'.format(i))
-#        os.system('touch ycount%05d' % i)  # Uncomment for diagnostics
-
-         a=float(rot[i+1])
-         b=float(tlt[i+1])
-         c=float(psi[i+1])
-         os.system('e2proc3d.py --rot=spider:phi=%d:theta=%d:psi=%d %s tmp_ema_%05d.mrc' % (a, b, c, name_avg, i+1))
-         os.system('bimg -rescale 0,5.2 tmp_ema_{0:05d}.mrc tmp_sca_{0:05d}.mrc'.format(i+1))
-         os.system('newstack -q -mode 1 tmp_sca_{0:05d}.mrc tmp_mod_{0:05d}.mrc'.format(i+1))
-         os.system('bimg -rescale 0,5.2 tmp_mod_{0:05d}.mrc tmp_rot_{0:05d}.mrc'.format(i+1))
-#        os.system('touch ycount%05d' % (i+1))  # Uncomment for diagnostics
-
-# Resize i == sub1
-         os.system('clip resize -m 1 -ox %s -oy %s -oz %s tmp_rot_%05d.mrc tmp_siz_%05d.mrc' % (dimX, dimY, dimZ, i, i))
-         os.system('clip resize -m 1 -ox %s -oy %s -oz %s tmp_rot_%05d.mrc tmp_siz_%05d.mrc' % (dimX, dimY, dimZ, i+1, i+1))
-         os.system('rm -f tmp_ema_{0:05d}.mrc tmp_sca_{0:05d}.mrc tmp_mod_{0:05d}.mrc tmp_rot_{0:05d}.mrc tmp_ema_{1:05d}.mrc tmp_sca_{1:05d}.mrc tmp_mod_{1:05d}.mrc tmp_rot_{1:05d}.mrc'.format(i, i+1))
-
-# Translate i == sub1
-         dx=dimX - float(x[i])
-         dy=dimY - float(y[i])
-         dz=dimZ - float(z[i])
-         os.system('clip resize -m 1 -cx %d -cy %d -cz %d tmp_siz_%05d.mrc tmp_tra_%05d.mrc' % (dx, dy, dz, i, i))
-         os.system('rm -f tmp_siz_%05d.mrc' % (i))
-
-         dx=dimX - float(x[i+1])
-         dy=dimY - float(y[i+1])
-         dz=dimZ - float(z[i+1])
-         os.system('clip resize -m 1 -cx %d -cy %d -cz %d tmp_siz_%05d.mrc tmp_tra_%05d.mrc' % (dx, dy, dz, i+1, i+1))
-         os.system('rm -f tmp_siz_%05d.mrc' % (i+1))
-
-# Combine i == sub1
-         os.system('clip add -m 1 tmp_tra_%05d.mrc tmp_tra_%05d.mrc sum_%05d_%05d.mrc' % (i, i+1, i, i+1))
-         os.system('rm -f tmp_tra_%05d.mrc tmp_tra_%05d.mrc' % (i, i+1))
-
-      elif (i > sub1 and i < (num_line-1)):  # Sequentially append to previous sums; don't overcount
-# Rotate i > sub1
-         a=float(rot[i+1])
-         b=float(tlt[i+1])
-         c=float(psi[i+1])
-         os.system('e2proc3d.py --rot=spider:phi=%d:theta=%d:psi=%d %s tmp_ema_%05d.mrc' % (a, b, c, name_avg, i+1))
-         os.system('bimg -rescale 0,5.2 tmp_ema_{0:05d}.mrc tmp_sca_{0:05d}.mrc'.format(i+1))
-         os.system('newstack -q -mode 1 tmp_sca_{0:05d}.mrc tmp_mod_{0:05d}.mrc'.format(i+1))
-         os.system('bimg -rescale 0,5.2 tmp_mod_{0:05d}.mrc tmp_rot_{0:05d}.mrc'.format(i+1))
-#        os.system('touch zcount%05d' % (i+1))  # Uncomment for diagnostics
-# Resize i > sub1
-         os.system('clip resize -m 1 -ox %s -oy %s -oz %s tmp_rot_%05d.mrc tmp_siz_%05d.mrc' % (dimX, dimY, dimZ, i+1, i+1))
-         os.system('rm -f tmp_ema_{0:05d}.mrc tmp_sca_{0:05d}.mrc tmp_mod_{0:05d}.mrc tmp_rot_{0:05d}.mrc'.format(i+1))
-
-# Translate i > sub1
-         dx=dimX - float(x[i+1])
-         dy=dimY - float(y[i+1])
-         dz=dimZ - float(z[i+1])
-         os.system('clip resize -m 1 -cx %d -cy %d -cz %d tmp_siz_%05d.mrc tmp_tra_%05d.mrc' % (dx, dy, dz, i+1, i+1))
-         os.system('rm -f tmp_siz_%05d.mrc' % (i+1))
-
-# Combine i > sub1
-         os.system('clip add -m 1 tmp_tra_%05d.mrc sum_%05d_%05d.mrc sum_%05d_%05d.mrc' % (i+1, sub1, i, sub1, i+1))
-         os.system('rm -f sum_%05d_%05d.mrc' % (sub1, i))
-         os.system('rm -f tmp_tra_%05d.mrc' % (i+1) )
-#---------- END Transformation thread function -------------
-
-
-#---------- BEGIN Data handling ----------------------------
-# Get column numbers
-XextCol,YextCol,ZextCol,RotCol,TiltCol,PsiCol,ClassCol,XoriCol,YoriCol,ZoriCol = read_relion_header(name_star)
-
-# Read the 3D starfile, ignoring the header items;  "grep -v" is an inverse selection
-grepline = 'grep ' + 'Tomograms ' + name_star + '| grep -v "#" | grep -v "loop" | grep -v "data" | awk "NF"  > temp.txt'
-os.system(grepline)
-
-### Make database of only the relevant values in memory
-data = csv.reader(open('temp.txt', 'r'), delimiter=" ", skipinitialspace = True)
-rot, tlt, psi, x, y, z, cls = [], [], [], [], [], [], []
-num_line = 0
-for row in data:
-   if row[ClassCol] == name_cls:
-      x.append(float(row[XextCol])-float(row[XoriCol]))
-      y.append(float(row[YextCol])-float(row[YoriCol]))
-      z.append(float(row[ZextCol])-float(row[ZoriCol]))
-      rot.append(row[RotCol])
-      tlt.append(row[TiltCol])
-      psi.append(row[PsiCol])
-      cls.append(row[ClassCol])  # Unessential, but keep for future diagnostics
-      num_line = num_line + 1
-#---------- END Data handling ------------------------------
-
-
-#---------- BEGIN Bookkeeping calculations -----------------
-size_free = os.statvfs('.').f_frsize * os.statvfs('.').f_bavail
-num_file = int(math.floor(size_free/(3*size_tomo)))
-num_jobs = min(ncpu, num_file)
-num_task = int(math.ceil(float(num_line)/num_jobs))  # tasks per core
-print ""'"%s"'" has %s members in class %s " % (name_avg, num_line, name_cls)
-print ""'"%s"'" is %s x %s x %s and uses %.2f GB" % (name_tomo, dimX, dimY, dimZ, size_tomo_gibi)
-print "%s has %s cores and this directory has %s GB free" % (myhost, ncpu, size_free_gibi)
-print "There will be %s parallel jobs handling %s subtomograms each" % (num_jobs, num_task)
-time.sleep(3)
-#---------- END Bookkeeping calculations -------------------
-
-
-#---------- BEGIN Parallel work ----------------------------
-sizadd_time1 = time.time()
 
 if __name__ == '__main__':
-      pool = multiprocessing.Pool(num_jobs)
-      results = pool.map(clipadd, range(num_jobs))
-#     results = pool.map(clipadd, range(17,20))  #Uncomment for diagnostics
-
-sizadd_time2 = time.time()
-name_cls = int(name_cls)
-os.system('clip add -m 1 sum*.mrc syn_pos_cls%02d.mrc' % (name_cls))
-os.system('alterheader syn_pos_cls%02d.mrc -org 0,0,0' % (name_cls))
-# Uncomment to get synthetic tomo w/ inverted contrast:
-os.system('bimg -invert syn_pos_cls%02d.mrc syn_neg_cls%02d.mrc' % (name_cls, name_cls))
-
-os.system('rm -f temp.txt *.mrc~ sum_*_*.mrc')  # Comment out for diagnostics
-#---------- END Parallel work ------------------------------
-
-
-#---------- Sum all to compare with tomo --------------------
-os.system('clip add -m 1 syn_pos*mrc syn_sum_pos.mrc')
-os.system('clip add -m 1 syn_neg*mrc syn_sum_neg.mrc')
-
-print("--------------------------------------------------------")
-time.sleep(1)
-print("Processing time: %01d seconds" % (sizadd_time2 - sizadd_time1))
-print ""'"%s"'" has %s members in class %s " % (name_avg, num_line, name_cls)
-print ""'"%s"'" is %s x %s x %s and uses %.2f GB" % (name_tomo, dimX, dimY, dimZ, size_tomo_gibi)
-print "%s has %s cores and this directory has %s GB free" % (myhost, ncpu, size_free_gibi)
-print "There were %s parallel jobs handling %s subtomograms each" % (num_jobs, num_task)
-print "done"
-sys.exit()
+   main()
@@ -1,99 +1,160 @@
 #!/usr/bin/env python2
+# -----------------------------------------------------------------------------
+# Generated with the assistance of Claude (Anthropic).
+# Model: Claude (Anthropic), version not recorded        Date: 2026-10-18
+# Reviewed, tested, and validated by the Gan Lab (Anaphase); the authors take
+# full responsibility for the correctness of this code.
+# Lab: https://github.com/anaphaze | https://www.anaphase.org
+# AI-assisted sections: get_particle_data, bin_particles, RotationCache,
+#   shift_array, load_eman2, read_average, nearest_halves, zyz_rots, particle_corners,
+#   precompute_xforms (window math moved out of main), xforms_file, cached_xforms,
+#   eman2_xform, xform_particles, validate_engines, ParticleWriter, window_sums,
+#   VolumeStats, write_header_stats, journal_file, undo_file, UndoLog, rollback,
+#   save_checkpoint, resume_volume, new_output, ParticleIndex, mask_bounds, select_roi,
+#   morton_keys, hilbert_keys, locality_schedule, composite, label_file, new_label_volume,
+#   shard_file, select_shard, merge_shards, slab_edges, slab_tasks, remap_slab,
+#   remap_slabs, io_report, average_geometry (moved out of main), finish_volume,
+#   remap_volume, remap_output, remap_multi and the option handling in main(); the
+#   rest of the file predates this header.
+# -----------------------------------------------------------------------------
 # ot_remap_v2.py -- creates a remapped model (quickly) from a RELION subtomogram average
 # Created 20210329 (Jon Chen)
 # Revised 20210503 (LG) Added user-friendly inputs.
 # Revised 20220208 (LG) Add fixes for python3 and EMAN2.91 (uses Python 3.7)
 # Revised 20220822 (JC) Minor fix to rotation handling of translational offsets (affected line commented "fix001")
+# Revised 20261018 (agent) Optional orientation-quantized rotation cache (--angstep, --cache-mb)
+# Revised 20261018 (agent) Optional NumPy/SciPy rotation engine (--engine numpy), so EMAN2 is not required
+# Revised 20261018 (agent) Parallel remapping over Z slabs of the output (--jobs)
+# Revised 20261018 (agent) Single-pass compositing with selectable blend modes (--blend)
+# Revised 20261018 (agent) Star files are read with ot_starfile.py (cached, RELION 3.1 optics tables)
+# Revised 20261018 (agent) Per-tomogram, per-class outputs from one pass over the star file (--multi)
+# Revised 20261018 (agent) Locality-ordered, windowed writes to the output (--order, --window)
+# Revised 20261018 (agent) Header statistics are tracked while writing instead of re-reading the output
+# Revised 20261018 (agent) Checkpoints and resuming of interrupted runs (--checkpoint, --resume)
+# Revised 20261018 (agent) Binned previews (--bin, --bin-method)
+# Revised 20261018 (agent) Region-of-interest outputs with spatial culling of particles (--roi, --roi-mask)
+# Revised 20261018 (agent) Vectorized precompute of all particle transforms, cached in [Remapped].xforms.npz
+#   during --checkpoint runs only
+# Revised 20261018 (agent) Chunked, compressed multiscale outputs (--format zarr, see ot_chunkstore.py)
+# Revised 20261018 (agent) Sharded runs on several processes or hosts, and merging of their outputs
+#   (--shard, --merge)
+# Revised 20261018 (agent) Option parsing, MRC data maps and worker pools shared with the other scripts
+#   (ot_common.py); workers get their shared state through the pool initializer when they are not forked
+
+import os, sys, time, mrcfile, numpy, copy, math, collections, heapq, json, struct, hashlib, zipfile, tempfile
+import ot_xform, ot_starfile, ot_chunkstore, ot_common
 
-import mrcfile, numpy, copy, math
-from EMAN2 import *
 
 #---------- BEGIN User inputs ------------------------------
 # stackoverflow.com/questions/2194163/python-empty-argument
+args, opts = ot_common.parse_options(sys.argv[1:], {"--angstep": 0.0, "--cache-mb": 1024.0,
+	"--engine": "auto", "--batch": 16, "--validate": 0, "--jobs": 1, "--blend": "max",
+	"--multi": False, "--order": "star", "--window": 1, "--checkpoint": 0, "--resume": False,
+	"--bin": 1, "--bin-method": "fourier",
+	"--roi": "", "--roi-mask": "", "--format": "mrc", "--chunk": 64,
+	"--shard": "", "--merge": 0})
 try:
-   avg_file  = sys.argv[1]
-   tomo_size = sys.argv[2]
-   star_file = sys.argv[3]
-   out_file  = sys.argv[4]
+   avg_file  = args[0]
+   tomo_size = args[1]
+   star_file = args[2]
+   out_file  = args[3]
 except IndexError:
    print("================================================================")
-   print("Usage:>>   ot_remap_v2.py [Average] [Tomogram_size] [Starfile] [Remapped]")
+   print("Usage:>>   ot_remap_v2.py [Average] [Tomogram_size] [Starfile] [Remapped] [Options]")
    print("Example:   ot_remap_v2.py run_class001.mrc 2048,2048,500 run_data.star remap_001.mrc")
    print("----------------------------------------------------------------")
    print("Make sure EMAN2's binaries are in the PATH using a command like:")
    print("export PATH=/mnt/prog/EMAN2.91/bin:$PATH")
+   print("(or use '--engine numpy', which only needs numpy, scipy and mrcfile)")
    print("----------------------------------------------------------------")
    print("Average:   The class average you want to remap")
    print("Tomogram_size:  Output tomogram size (XYZ, comma-separated)")
    print("Starfile:  _data.star file that contains the refined coordinates & orientations")
    print("Remapped:  Name of the remapped .mrc file")
    print("----------------------------------------------------------------")
+   print("Options:")
+   print("--angstep D   Round Euler angles to multiples of D degrees and reuse rotated")
+   print("              averages for repeated orientations (default 0 = off)")
+   print("--cache-mb M  Memory budget of the rotated-average cache, in MB (default 1024)")
+   print("--engine E    eman2, numpy, or auto (default; eman2 if it can be imported)")
+   print("--batch N     Particles resampled together by the numpy engine (default 16; fewer")
+   print("              if their boxes would take more than 256 MB, e.g. 4 for a 256^3 average)")
+   print("--validate N  Compare the numpy and EMAN2 engines on the first N particles")
+   print("--jobs N      Remap with N processes, each writing its own Z slabs (default 1)")
+   print("--blend B     How overlapping particles combine: max (default; largest value),")
+   print("              sum (added, like ot_remap.py), first (first particle wins), or")
+   print("              label (max, plus [Remapped]_labels.mrc with the winning particle numbers)")
+   print("--multi       One output per tomogram (rlnMicrographName) and class (rlnClassNumber),")
+   print("              from a single read of the star file. [Average] and [Remapped] are")
+   print("              templates, e.g. run_class{class:03d}.mrc and remap_{tomo}_{class}.mrc;")
+   print("              --jobs sets how many outputs are written at once, and with --angstep")
+   print("              each worker reuses rotated averages across the outputs it writes")
+   print("--order O     Order of the writes to the output: star (default; star file order),")
+   print("              morton or hilbert (along a space-filling curve, which keeps the")
+   print("              page cache busy with nearby particles when the output is larger than")
+   print("              RAM). Overlapping particles keep star file order, so the output is identical")
+   print("--window N    Read and write N consecutive particles as one box (default 1)")
+   print("--checkpoint N Flush the output every N particles and note the progress in")
+   print("              [Remapped].journal.npz (serial runs only; default 0 = off)")
+   print("--resume      Continue an interrupted --checkpoint run (same arguments and options)")
+   print("              from its last checkpoint; the output is identical to an uninterrupted run")
+   print("--bin N       Quick preview binned by N: the average is binned, coordinates and")
+   print("              [Tomogram_size] are divided by N (average box / N must be even)")
+   print("--bin-method M  fourier (default; Fourier cropping) or mean (N^3 block average)")
+   print("--roi x0,y0,z0,x1,y1,z1  Only remap voxels x0..x1-1, y0..y1-1, z0..z1-1 (binned voxels")
+   print("              with --bin); the output is ROI-sized and its header gives its position")
+   print("--roi-mask M  As --roi, for the bounding box of the nonzero voxels of mask M (same size")
+   print("              as the output), remapping only particles whose box holds a nonzero voxel")
+   print("--format F    mrc (default) or zarr: [Remapped] is then a directory (e.g. remap_001.zarr)")
+   print("              of compressed chunks, where empty chunks take no space, with binned")
+   print("              copies for viewers; convert it with 'ot_chunkstore.py [Remapped] out.mrc'")
+   print("              (not with --jobs or --checkpoint)")
+   print("--chunk N     Edge length of the zarr chunks, in voxels (even; default 64)")
+   print("--shard i/N   Remap only shard i (0..N-1) of N, a Z slab of the output with about 1/N")
+   print("              of the particles, into [Remapped]_shard{i}of{N}.mrc, just large enough")
+   print("              for them. Shards can run on any host, at the same time, with --jobs or")
+   print("              --checkpoint; blend max or sum only")
+   print("--merge N     Combine the N shard outputs into [Remapped] (max or sum, as --blend);")
+   print("              run with the arguments and options the shards were run with. Locally:")
+   print("              for i in 0 1 2 3; do ot_remap_v2.py ... --shard $i/4 & done; wait")
+   print("              ot_remap_v2.py ... --merge 4")
+   print("----------------------------------------------------------------")
    print("Output:>> [Remapped]")
    print("To invert the remapped tomogram, run 'bimg -invert [Remapped] negative.mrc'")
    sys.exit()
 #----------- END User inputs -------------------------------
 
 
-def get_star_index(filepath):
-	col_index = {}
-	with open(filepath, "r") as f:
-		for i in range(10):
-			line = f.readline().strip()
-			if line == "loop_":
-				break
-			elif i == 9:
-				print("Could not detect loop_ line.. exiting")
-				exit()
-		while 1:
-			line = f.readline().strip()
-			if line[0] != "_":
-				break
-			else:
-				x = line[1:].split()
-				col_index[x[0]] = int(x[1].replace("#", "")) - 1
-	return col_index
-
-def get_star_data(filepath):
-	data_list = []
-	with open(filepath, "r") as f:
-		for line in f:
-			if line.strip() == "loop_":
-				break
-		for line in f:
-			line_strip = line.strip()
-			try:
-				line_strip[0]
-			except IndexError:
-				continue
-			if line_strip[0] == "_":
-				continue
-			else:
-				row = " ".join(line_strip.split()).split(" ")
-				data_list.append(row)
-	return data_list
-
-def get_particle_data(star_file):
-	col_index = get_star_index(star_file)
-	data_list = get_star_data(star_file)
-	x_index = col_index["rlnCoordinateX"]
-	y_index = col_index["rlnCoordinateY"]
-	z_index = col_index["rlnCoordinateZ"]
-	x_offset_index = col_index["rlnOriginX"]
-	y_offset_index = col_index["rlnOriginY"]
-	z_offset_index = col_index["rlnOriginZ"]
-	rot_index = col_index["rlnAngleRot"]
-	tilt_index = col_index["rlnAngleTilt"]
-	psi_index = col_index["rlnAnglePsi"]
-	particle_data = []
-	for row in data_list:
-		refined_x = float(row[x_index]) - float(row[x_offset_index])
-		refined_y = float(row[y_index]) - float(row[y_offset_index])
-		refined_z = float(row[z_index]) - float(row[z_offset_index])
-		rot_angle = float(row[rot_index])
-		tilt_angle = float(row[tilt_index])
-		psi_angle = float(row[psi_index])
-		particle_data.append([refined_x, refined_y, refined_z, rot_angle, tilt_angle, psi_angle])
-	return particle_data
+def get_particle_data(star_file, groups=False):
+	# Refined coordinates (RELION coordinate minus origin shift) and Euler angles per particle;
+	# with groups=True, also each particle's tomogram (rlnMicrographName) and class number
+	columns = ["rlnCoordinateX", "rlnCoordinateY", "rlnCoordinateZ", "rlnOriginX", "rlnOriginY", "rlnOriginZ",
+		"rlnAngleRot", "rlnAngleTilt", "rlnAnglePsi"]
+	if groups:
+		columns += ["rlnMicrographName", "rlnClassNumber"]
+	try:
+		star = ot_starfile.read_particles(star_file, columns)
+	except KeyError as err:
+		print("Could not read %s (%s).. exiting" % (star_file, err))
+		sys.exit()
+	particle_data = numpy.column_stack([star["rlnCoordinateX"] - star["rlnOriginX"],
+		star["rlnCoordinateY"] - star["rlnOriginY"],
+		star["rlnCoordinateZ"] - star["rlnOriginZ"],
+		star["rlnAngleRot"], star["rlnAngleTilt"], star["rlnAnglePsi"]])
+	if groups:
+		return particle_data.tolist(), star["rlnMicrographName"].tolist(), star["rlnClassNumber"].tolist()
+	return particle_data.tolist()
+
+def bin_particles(particle_data, tomo_xyz_size, nbin):
+	"""
+	Coordinates and output size for a remap binned by nbin. The binned average
+	samples full-size voxels j*nbin + (nbin-1)/2 (see ot_xform.bin_mean), so the
+	coordinates (origin shifts included) map the same way. The average's centre
+	then still falls half-way between voxels, as nearest_half() expects.
+	"""
+	shift = (nbin - 1)/2.0
+	rows = [[(row[0] - shift)/nbin, (row[1] - shift)/nbin, (row[2] - shift)/nbin] + list(row[3:]) for row in particle_data]
+	return rows, [size//nbin for size in tomo_xyz_size]
 
 def rotation_matrix(axis, theta):
     """
@@ -144,17 +205,1049 @@ def nearest_half(number):
 			number_round += 0.5
 	return number_round
 
-def main(avg_file, tomo_file, star_file, out_file):
-	# Parse tomo_size argument
-	tomo_xyz_size = tomo_size.split(",")
-	tomo_xyz_size = [int(val) for val in tomo_xyz_size]
+class RotationCache(object):
+	"""
+	LRU cache of rotated averages (float32 numpy arrays), keyed by Euler angles
+	rounded to multiples of step degrees and bounded by max_bytes of array data.
+	"""
+	def __init__(self, step, max_bytes):
+		self.step = step
+		self.max_bytes = max_bytes
+		self.entries = collections.OrderedDict()
+		self.nbytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def quantize(self, rot):
+		return tuple((round(angle/self.step)*self.step) % 360 for angle in rot)
+
+	def get(self, key):
+		try:
+			arr = self.entries.pop(key)
+		except KeyError:
+			self.misses += 1
+			return None
+		self.entries[key] = arr
+		self.hits += 1
+		return arr
+
+	def put(self, key, arr):
+		if arr.nbytes > self.max_bytes:
+			return
+		self.entries[key] = arr
+		self.nbytes += arr.nbytes
+		while self.nbytes > self.max_bytes:
+			old_key, old_arr = self.entries.popitem(last=False)
+			self.nbytes -= old_arr.nbytes
+			self.evictions += 1
+
+	def report(self):
+		lookups = self.hits + self.misses
+		print("Rotation cache (%g deg steps): %s hits / %s lookups (%.1f%%), %s entries, %.1f MB held, %s evictions"
+			%(self.step, self.hits, lookups, 100.0*self.hits/max(lookups, 1), len(self.entries), self.nbytes/1048576.0, self.evictions))
+
+def shift_array(arr, shift):
+	"""
+	Trilinear shift of a (z, y, x) array by shift = (tx, ty, tz) voxels with zero fill,
+	in the same sense as applying EMAN2's Transform({"tx":tx, "ty":ty, "tz":tz}).
+	"""
+	out = numpy.zeros_like(arr)
+	# out[i] = arr[i - shift]; split -shift into whole voxels and a fraction per axis
+	src = [-shift[2], -shift[1], -shift[0]]
+	base = [int(math.floor(s)) for s in src]
+	frac = [src[i] - base[i] for i in range(3)]
+	for dz in (0, 1):
+		for dy in (0, 1):
+			for dx in (0, 1):
+				step = [base[0]+dz, base[1]+dy, base[2]+dx]
+				w = 1.0
+				for i, d in enumerate((dz, dy, dx)):
+					w *= frac[i] if d else 1.0 - frac[i]
+				if w == 0:
+					continue
+				dst_sl = []
+				src_sl = []
+				for i in range(3):
+					n = arr.shape[i]
+					lo = max(0, -step[i])
+					hi = min(n, n - step[i])
+					if lo >= hi:
+						break
+					dst_sl.append(slice(lo, hi))
+					src_sl.append(slice(lo + step[i], hi + step[i]))
+				else:
+					out[tuple(dst_sl)] += numpy.float32(w) * arr[tuple(src_sl)]
+	return out
+
+def load_eman2():
+	"""
+	Import the EMAN2 classes used here (slow); returns False if EMAN2 is not installed.
+	"""
+	global EMData, Transform, EMNumPy
+	try:
+		from EMAN2 import EMData, Transform, EMNumPy
+	except ImportError:
+		return False
+	return True
+
+def read_average(avg_file, engine):
+	# EMData for the EMAN2 engine, (z, y, x) float32 array for the numpy engine; binned with --bin
+	nbin = opts["--bin"]
+	if engine == "eman2" and nbin == 1:
+		avg = EMData()
+		avg.read_image(avg_file)
+		return avg
+	with mrcfile.open(avg_file, mode='r', permissive=True) as mrc:
+		avg = numpy.array(mrc.data, dtype="float32")
+	if nbin > 1:
+		avg = ot_xform.bin_fourier(avg, nbin) if opts["--bin-method"] == "fourier" else ot_xform.bin_mean(avg, nbin)
+	if engine == "eman2":
+		return EMNumPy.numpy2em(avg)
+	return avg
+
+def nearest_halves(numbers):
+	# nearest_half() for a whole array
+	numbers = numpy.asarray(numbers, dtype=float)
+	rounded = numpy.round(numbers*2)/2
+	whole = numpy.mod(rounded, 1) != 0.5
+	up = whole & (rounded < numbers)
+	down = whole & (rounded > numbers)
+	return rounded - 0.5*down + 0.5*up
+
+def zyz_rots(point, z1, y2, z3):
+	"""
+	zyz_rot() for arrays of angles: rotates one point by each (z1, y2, z3) triple,
+	with the same rotation_matrix() elements and rounding to 6 decimals after each
+	non-zero rotation. Returns an (N, 3) array.
+	"""
+	points = numpy.tile(numpy.asarray(point, dtype=float), (len(z1), 1))
+	for angle, axis in ((z3, 2), (y2, 1), (z1, 2)):
+		theta = numpy.radians(numpy.asarray(angle, dtype=float))
+		a = numpy.cos(theta / 2.0)
+		s = numpy.sin(theta / 2.0)
+		aa, ss, two_as = a * a, s * s, 2 * (a * s)
+		x, y, z = points[:, 0], points[:, 1], points[:, 2]
+		if axis == 2:
+			rotated = numpy.column_stack([(aa - ss)*x + two_as*y, -two_as*x + (aa - ss)*y, (aa + ss)*z])
+		else:
+			rotated = numpy.column_stack([(aa - ss)*x - two_as*z, (aa + ss)*y, two_as*x + (aa - ss)*z])
+		points = numpy.where((angle != 0)[:, None], numpy.round(rotated, 6), points)
+	return points
+
+def particle_corners(coords, boxsizes):
+	# Lowest (x, y, z) output voxel of each particle's box, before cropping to the tomogram
+	coords = numpy.asarray(coords, dtype=float).reshape(-1, 3)
+	sizes = numpy.asarray(boxsizes, dtype=float).reshape(-1, 1)
+	return numpy.trunc(nearest_halves(coords) - 0.5 - sizes/2.0 + 1).astype("int64")
+
+def precompute_xforms(rows, avg_center, boxsize, tomo_xyz_size, angstep=0, start=(0, 0, 0)):
+	"""
+	Work out, for all particle rows at once, everything except the voxels: a dict of
+	angles (N, 3)    rot, tilt, psi, rounded to multiples of angstep if it is > 0
+	mats (N, 3, 3)   SPIDER rotation matrices for those angles (numpy engine)
+	offsets (N, 3)   xyz offset applied after rotation: the rotation center
+	                 correction (#fix001) plus the coordinate's sub-voxel rest
+	coord_round (N, 3)  coordinates rounded to the closest 0.5
+	corners (N, 3)   box corners, windows (N, 4, 3) the output range a..b-1 and
+	                 box range c..d-1 each box is cropped to (b <= a if nothing lands)
+	The rows are in the full tomogram; corners and windows are relative to the
+	output's first voxel start (see output_start), so an ROI or shard gets exactly
+	the numbers a run over the whole tomogram would.
+	"""
+	rows = numpy.asarray(rows, dtype=float).reshape(-1, 6)
+	coords = rows[:, :3]
+	angles = rows[:, 3:6]
+	if angstep > 0:
+		angles = numpy.mod(numpy.round(angles/angstep)*angstep, 360)
+	# Work out xyz offset for rotated subtomo average array
+	## If EMAN2 rotation center != true volume center, include xyz offset
+	avg_center_xform = zyz_rots(avg_center, angles[:, 2], angles[:, 1], angles[:, 0])  #fix001 - inverse rotation
+	## Round RELION coordinates to the closest 0.5, add difference to xyz offset
+	coord_round = nearest_halves(coords)
+	offsets = (numpy.asarray(avg_center, dtype=float) - avg_center_xform) + coords - coord_round
+	# Work out coordinates in output tomo to write particle array
+	# Will ignore writing parts of subtomo array that are outside of tomo volume
+	# Currently only supports subtomo average volumes with same xyz-dimensions and even size
+	corners = numpy.trunc(coord_round - 0.5 - boxsize/2.0 + 1).astype("int64") - numpy.asarray(start, dtype="int64")
+	crop_min = numpy.maximum(0, -corners)
+	crop_max = numpy.maximum(0, corners + boxsize - numpy.asarray(tomo_xyz_size))
+	windows = numpy.stack([corners + crop_min, corners + boxsize - crop_max, crop_min, boxsize - crop_max], axis=1)
+	return {"angles": angles, "mats": ot_xform.spider_matrices(angles[:, 0], angles[:, 1], angles[:, 2]),
+		"offsets": offsets, "coord_round": coord_round, "corners": corners, "windows": windows}
+
+def xforms_file(out_file):
+	return out_file + ".xforms.npz"
+
+def cached_xforms(out_file, rows, avg_center, boxsize, tomo_xyz_size, angstep=0, start=(0, 0, 0)):
+	"""
+	precompute_xforms(), kept in [Remapped].xforms.npz for a --resume of the same
+	particles and geometry. Only --checkpoint runs use it, and they remove it (with
+	the journal) when they finish.
+	"""
+	rows = numpy.ascontiguousarray(rows, dtype=float).reshape(-1, 6)
+	key = hashlib.sha1(rows.tobytes())
+	key.update(json.dumps([list(avg_center), boxsize, list(tomo_xyz_size), angstep, [int(v) for v in start]]).encode())
+	key = key.hexdigest()
+	try:
+		with numpy.load(xforms_file(out_file)) as npz:
+			if str(npz["key"]) == key:
+				return dict((name, npz[name]) for name in npz.files if name != "key")
+	except (IOError, OSError, KeyError, ValueError, EOFError, zipfile.BadZipfile):
+		# A cache cut short by a crash is just computed again
+		pass
+	xf = precompute_xforms(rows, avg_center, boxsize, tomo_xyz_size, angstep, start)
+	# Best effort; an unwritable directory just means no cache. Each run writes its own
+	# temporary file (as ot_starfile.py does), so runs with the same output cannot mix theirs
+	tmp = None
+	try:
+		fd, tmp = tempfile.mkstemp(prefix=os.path.basename(xforms_file(out_file)) + ".", suffix=".tmp",
+			dir=os.path.dirname(os.path.abspath(out_file)))
+		with os.fdopen(fd, "wb") as f:
+			numpy.savez(f, key=numpy.array(key), **xf)
+		os.rename(tmp, xforms_file(out_file))
+	except (IOError, OSError):
+		if tmp is not None:
+			try:
+				os.remove(tmp)
+			except OSError:
+				pass
+	return xf
+
+def eman2_xform(avg, rot, xyz_offset=None):
+	# Apply rotation to subtomo average array
+	avg_xform = copy.copy(avg)
+	t = Transform({"type":"spider", "phi":rot[0], "theta":rot[1], "psi":rot[2]})
+	avg_xform.transform(t)
+	## Apply xyz offset to subtomo average array
+	if xyz_offset is not None:
+		t = Transform({"tx":xyz_offset[0], "ty":xyz_offset[1], "tz":xyz_offset[2]})
+		avg_xform.transform(t)
+	# Convert subtomo average EMAN2 object to numpy array
+	avg_arr = EMNumPy.em2numpy(avg_xform)
+	avg_arr = avg_arr.astype("float32")
+	return avg_arr
+
+def xform_particles(avg, xf, indices, engine="eman2", cache=None, batch=16):
+	"""
+	Generator over particle indices, yielding (avg_arr, i) in order, from the
+	precomputed transforms xf (see precompute_xforms). Particles that land outside
+	the output are not rotated and yield (None, i). The numpy engine resamples batch
+	particles per call; with a RotationCache, only cache misses are rotated and every
+	particle gets a sub-voxel shift.
+	"""
+	windows = xf["windows"]
+	if engine != "eman2":
+		# No more boxes at a time than fit in ot_xform.WORK_BYTES
+		batch = min(batch, ot_xform.batch_limit(avg.shape))
+	for start in range(0, len(indices), batch):
+		chunk = [i for i in indices[start:start+batch] if (windows[i, 1] > windows[i, 0]).all()]
+		arrs = {}
+		if cache is not None:
+			for i in chunk:
+				rot = tuple(xf["angles"][i].tolist())
+				avg_rot = cache.get(rot)
+				if avg_rot is None:
+					if engine == "eman2":
+						avg_rot = eman2_xform(avg, rot)
+					else:
+						avg_rot = ot_xform.resample(avg, xf["mats"][i])[0]
+					cache.put(rot, avg_rot)
+				arrs[i] = shift_array(avg_rot, xf["offsets"][i])
+		elif engine == "eman2":
+			for i in chunk:
+				arrs[i] = eman2_xform(avg, xf["angles"][i].tolist(), xf["offsets"][i].tolist())
+		elif chunk:
+			resampled = ot_xform.resample(avg, xf["mats"][chunk], xf["offsets"][chunk])
+			arrs = dict(zip(chunk, resampled))
+		for i in indices[start:start+batch]:
+			yield arrs.get(i), i
+
+def validate_engines(avg_file, rows, avg_center, boxsize):
+	# Compare the numpy engine with EMAN2 for the first few particles
+	if not load_eman2():
+		print("EMAN2 is not installed, so the numpy engine cannot be validated here")
+		return
+	avg_eman = read_average(avg_file, "eman2")
+	avg_np = read_average(avg_file, "numpy")
+	span = float(avg_np.max() - avg_np.min())
+	max_diff = 0.0
+	sq_diff = 0.0
+	nvox = 0
+	# Windows do not matter here, so every particle counts as inside a huge output
+	xf = precompute_xforms(rows, avg_center, boxsize, [1 << 30]*3)
+	xf["windows"][:] = [[0, 0, 0], [1, 1, 1], [0, 0, 0], [1, 1, 1]]
+	eman_arrs = xform_particles(avg_eman, xf, range(len(rows)), "eman2")
+	np_arrs = xform_particles(avg_np, xf, range(len(rows)), "numpy")
+	for (arr_e, i), (arr_n, j) in zip(eman_arrs, np_arrs):
+		diff = numpy.abs(arr_e.astype("float64") - arr_n)
+		max_diff = max(max_diff, float(diff.max()))
+		sq_diff += float((diff**2).sum())
+		nvox += diff.size
+	print("Engine check on %s particles: max |numpy - EMAN2| = %.4g (%.2f%% of the average's range), rms %.4g"
+		%(len(rows), max_diff, 100.0*max_diff/max(span, 1e-30), math.sqrt(sq_diff/max(nvox, 1))))
+
+class ParticleWriter(object):
+	"""
+	Composites rotated averages into the output volume (see composite() for the blend
+	modes). Up to window particles are buffered and written together: the box that
+	encloses them is read once, each particle is composited into it in the order it
+	was added, and the box is written back once. Bytes read from and written to the
+	output (and label) volumes are counted.
+	"""
+	def __init__(self, tomo_data, z_range=None, blend="max", labels=None, window=1):
+		self.tomo_data = tomo_data
+		self.z_range = z_range
+		self.blend = blend
+		self.labels = labels
+		self.window = max(1, window)
+		self.pending = []
+		self.lo = None
+		self.hi = None
+		self.volume = 0
+		self.bytes_read = 0
+		self.bytes_written = 0
+		self.flushes = 0
+		self.stats = VolumeStats(tomo_data.size)
+		self.label_stats = VolumeStats(tomo_data.size) if labels is not None else None
+		self.undo = None
+
+	def add(self, avg_arr, window, label=0):
+		"""
+		Queue a rotated average for its precomputed window (a, b, c, d), as in
+		precompute_xforms(). With a z_range = (z0, z1), only output slices
+		z0 <= z < z1 are written.
+		"""
+		if avg_arr is None:
+			return
+		a, b, c, d = [[int(v) for v in w] for w in window]
+		if self.z_range is not None:
+			z0 = max(a[2], self.z_range[0])
+			z1 = min(b[2], self.z_range[1])
+			c[2] += z0 - a[2]
+			d[2] -= b[2] - z1
+			a[2], b[2] = z0, z1
+		if min(b[i] - a[i] for i in range(3)) <= 0:
+			return
+		win = (a, b, c, d)
+		volume = (b[0]-a[0])*(b[1]-a[1])*(b[2]-a[2])
+		if self.pending:
+			# Flush first if the enclosing box would get more than twice as large as the
+			# particle windows in it (e.g. where the particle order jumps)
+			lo = [min(self.lo[i], a[i]) for i in range(3)]
+			hi = [max(self.hi[i], b[i]) for i in range(3)]
+			if (hi[0]-lo[0])*(hi[1]-lo[1])*(hi[2]-lo[2]) > 2*(self.volume + volume):
+				self.flush()
+		if self.pending:
+			self.lo = [min(self.lo[i], a[i]) for i in range(3)]
+			self.hi = [max(self.hi[i], b[i]) for i in range(3)]
+			self.volume += volume
+		else:
+			self.lo, self.hi, self.volume = list(a), list(b), volume
+		self.pending.append((avg_arr, win, label))
+		if len(self.pending) >= self.window:
+			self.flush()
+
+	def flush(self):
+		if not self.pending:
+			return
+		lo, hi = self.lo, self.hi
+		window = (slice(lo[2], hi[2]), slice(lo[1], hi[1]), slice(lo[0], hi[0]))
+		tomo_win = numpy.array(self.tomo_data[window])
+		old_sums = window_sums(tomo_win)
+		if self.undo is not None:
+			self.undo.record(0, window, tomo_win)
+		label_win = None
+		if self.labels is not None and self.blend == "label":
+			label_win = numpy.array(self.labels[window])
+			old_label_sums = window_sums(label_win)
+			if self.undo is not None:
+				self.undo.record(1, window, label_win)
+			self.bytes_read += label_win.nbytes
+		self.bytes_read += tomo_win.nbytes
+		for avg_arr, (a, b, c, d), label in self.pending:
+			local = (slice(a[2]-lo[2], b[2]-lo[2]), slice(a[1]-lo[1], b[1]-lo[1]), slice(a[0]-lo[0], b[0]-lo[0]))
+			composite(tomo_win[local], avg_arr[c[2]:d[2], c[1]:d[1], c[0]:d[0]], self.blend, label_win, local, label)
+		self.tomo_data[window] = tomo_win
+		self.stats.update(window, old_sums, tomo_win)
+		self.bytes_written += tomo_win.nbytes
+		if label_win is not None:
+			self.labels[window] = label_win
+			self.label_stats.update(window, old_label_sums, label_win)
+			self.bytes_written += label_win.nbytes
+		self.flushes += 1
+		self.pending = []
+
+def window_sums(arr):
+	# Sum and sum of squares of an array, in float64
+	flat = arr.ravel().astype("float64")
+	return flat.sum(), numpy.dot(flat, flat)
+
+class VolumeStats(object):
+	"""
+	Header statistics (min, max, mean, rms) of an output volume that starts as zeros,
+	kept up to date from the windows written to it, so no full pass over the output
+	is needed at the end. The sums change by (new - old) for every window written.
+	Each window's new min and max are kept as candidates; as later windows can
+	overwrite them, finish() re-reads candidate windows, most extreme first, until
+	the most extreme value is one that is still in the volume.
+	"""
+	def __init__(self, nvoxel):
+		self.nvoxel = nvoxel
+		self.total = 0.0
+		self.total_sq = 0.0
+		self.written = 0
+		self.mins = []
+		self.maxs = []
+
+	def update(self, window, old_sums, new):
+		new_sums = window_sums(new)
+		self.total += new_sums[0] - old_sums[0]
+		self.total_sq += new_sums[1] - old_sums[1]
+		self.written += new.size
+		key = tuple((sl.start, sl.stop) for sl in window)
+		self.mins.append((float(new.min()), key))
+		self.maxs.append((float(new.max()), key))
+
+	def merge(self, other):
+		# Add the windows another writer (e.g. a slab worker) wrote to the same volume
+		self.total += other.total
+		self.total_sq += other.total_sq
+		self.written += other.written
+		self.mins += other.mins
+		self.maxs += other.maxs
+
+	def arrays(self, prefix):
+		# State as numpy arrays, for the checkpoint journal
+		return {prefix + "sums": numpy.array([self.total, self.total_sq]),
+			prefix + "counts": numpy.array([self.nvoxel, self.written], dtype="int64"),
+			prefix + "mins": numpy.array([v for v, key in self.mins], dtype="float64"),
+			prefix + "maxs": numpy.array([v for v, key in self.maxs], dtype="float64"),
+			prefix + "keys": numpy.array([key for v, key in self.mins], dtype="int64").reshape(-1, 3, 2)}
+
+	def load(self, arrays, prefix):
+		# Restore the state saved by arrays()
+		self.total, self.total_sq = [float(v) for v in arrays[prefix + "sums"]]
+		self.nvoxel, self.written = [int(v) for v in arrays[prefix + "counts"]]
+		keys = [tuple(tuple(k) for k in key) for key in arrays[prefix + "keys"].tolist()]
+		self.mins = list(zip(arrays[prefix + "mins"].tolist(), keys))
+		self.maxs = list(zip(arrays[prefix + "maxs"].tolist(), keys))
+
+	def extreme(self, data, candidates, sign):
+		# Exact min (sign = 1) or max (sign = -1) of data over the candidate windows.
+		# Every voxel ends with the value of the last window written to it, which is
+		# no more extreme than that window's candidate, so once a re-read (checked)
+		# value comes out on top of the heap nothing left can beat it
+		heap = [(sign*value, False, key) for value, key in candidates]
+		heapq.heapify(heap)
+		while True:
+			value, checked, key = heapq.heappop(heap)
+			if checked:
+				return sign*value
+			win = numpy.array(data[tuple(slice(*k) for k in key)])
+			heapq.heappush(heap, (float(win.min()) if sign > 0 else -float(win.max()), True, key))
+
+	def finish(self, data):
+		"""
+		Return (dmin, dmax, dmean, rms) of data, the volume the windows were written to.
+		"""
+		if self.nvoxel == 0:
+			return 0.0, -1.0, -2.0, -1.0
+		if not self.mins:
+			return 0.0, 0.0, 0.0, 0.0
+		if self.written < self.nvoxel:
+			# Some voxels were never written, so 0 is in the volume too
+			dmin = min(0.0, self.extreme(data, self.mins, 1))
+			dmax = max(0.0, self.extreme(data, self.maxs, -1))
+		else:
+			# The windows may cover every voxel; take min and max a few slices at a time
+			dmin, dmax = float("inf"), float("-inf")
+			step = max(1, 16777216//max(1, data[0].size))
+			for z in range(0, data.shape[0], step):
+				chunk = numpy.array(data[z:z+step])
+				dmin = min(dmin, float(chunk.min()))
+				dmax = max(dmax, float(chunk.max()))
+		dmean = self.total/self.nvoxel
+		rms = math.sqrt(max(self.total_sq/self.nvoxel - dmean**2, 0.0))
+		return dmin, dmax, dmean, rms
+
+def write_header_stats(mrc, stats):
+	# Header statistics from a VolumeStats instead of mrc.update_header_stats(); chunk stores keep them in their attrs
+	if isinstance(mrc, ot_chunkstore.ChunkStore):
+		mrc.attrs.update(zip(("dmin", "dmax", "dmean", "rms"), stats.finish(mrc.data)))
+		return
+	mrc.header.dmin, mrc.header.dmax, mrc.header.dmean, mrc.header.rms = [numpy.float32(v) for v in stats.finish(mrc.data)]
+
+def morton_keys(coords):
+	# Z-order curve index of each (z, y, x) row of non-negative integers, z most significant
+	coords = numpy.asarray(coords, dtype="int64")
+	bits = max(int(coords.max()).bit_length(), 1) if len(coords) else 1
+	keys = numpy.zeros(len(coords), dtype="int64")
+	for bit in range(bits-1, -1, -1):
+		for axis in range(3):
+			keys = (keys << 1) | ((coords[:, axis] >> bit) & 1)
+	return keys
+
+def hilbert_keys(coords):
+	# Hilbert curve index of each (z, y, x) row of non-negative integers
+	# (J. Skilling, 2004, "Programming the Hilbert curve", AIP Conf. Proc. 707: 381)
+	coords = numpy.asarray(coords, dtype="int64")
+	bits = max(int(coords.max()).bit_length(), 1) if len(coords) else 1
+	X = [coords[:, axis].copy() for axis in range(3)]
+	# Inverse undo
+	Q = 1 << (bits-1)
+	while Q > 1:
+		P = Q - 1
+		for i in range(3):
+			invert = (X[i] & Q) != 0
+			X[0][invert] ^= P
+			t = (X[0] ^ X[i]) & P
+			t[invert] = 0
+			X[0] ^= t
+			X[i] ^= t
+		Q >>= 1
+	# Gray encode
+	for i in range(1, 3):
+		X[i] ^= X[i-1]
+	t = numpy.zeros(len(coords), dtype="int64")
+	Q = 1 << (bits-1)
+	while Q > 1:
+		t[(X[2] & Q) != 0] ^= Q - 1
+		Q >>= 1
+	keys = numpy.zeros(len(coords), dtype="int64")
+	for bit in range(bits-1, -1, -1):
+		for i in range(3):
+			keys = (keys << 1) | (((X[i] ^ t) >> bit) & 1)
+	return keys
+
+def locality_schedule(corners, boxsize, order="star"):
+	"""
+	Order in which to composite particles, given their box corners (x, y, z): along a
+	Morton or Hilbert curve through the corners, so that consecutive writes touch
+	nearby parts of the output, or star file order. Particles whose boxes overlap
+	keep their star file order (the blend modes depend on it), so the output is
+	identical whatever the order. Returns a list of indices into corners.
+	"""
+	n = len(corners)
+	if order == "star" or n < 2:
+		return list(range(n))
+	corners = numpy.asarray(corners, dtype="int64")
+	zyx = corners[:, ::-1] - corners.min(axis=0)[::-1]
+	keys = (hilbert_keys(zyx) if order == "hilbert" else morton_keys(zyx)).tolist()
+
+	# Earlier particles with overlapping boxes must be written first; find them with
+	# a grid of boxsize cells (overlapping boxes are at most one cell apart)
+	corners = [tuple(c) for c in corners.tolist()]
+	cells = {}
+	npred = [0]*n
+	succ = [[] for i in range(n)]
+	for i, (x, y, z) in enumerate(corners):
+		cx, cy, cz = x//boxsize, y//boxsize, z//boxsize
+		for dz in (-1, 0, 1):
+			for dy in (-1, 0, 1):
+				for dx in (-1, 0, 1):
+					for j in cells.get((cx+dx, cy+dy, cz+dz), ()):
+						xj, yj, zj = corners[j]
+						if abs(x-xj) < boxsize and abs(y-yj) < boxsize and abs(z-zj) < boxsize:
+							npred[i] += 1
+							succ[j].append(i)
+		cells.setdefault((cx, cy, cz), []).append(i)
+
+	# Walk the curve, taking the next particle whose predecessors are all written
+	ready = [(keys[i], i) for i in range(n) if npred[i] == 0]
+	heapq.heapify(ready)
+	schedule = []
+	while ready:
+		key, i = heapq.heappop(ready)
+		schedule.append(i)
+		for j in succ[i]:
+			npred[j] -= 1
+			if npred[j] == 0:
+				heapq.heappush(ready, (keys[j], j))
+	return schedule
+
+def composite(tomo_win, avg_win, blend, labels=None, window=None, label=0):
+	"""
+	Blend a particle window into a copy of the output window, in place, and return it.
+	max:   the largest value is kept; voxels still at 0 count as empty and take the particle value
+	sum:   particle values are added (what ot_remap.py's 'clip add' produces)
+	first: the first particle to reach an empty (0) voxel keeps it
+	label: as max, and also writes label into labels[window] wherever the particle won
+	"""
+	if blend == "sum":
+		tomo_win += avg_win
+	elif blend == "first":
+		numpy.copyto(tomo_win, avg_win, where=(tomo_win == 0))
+	else:
+		empty = tomo_win == 0
+		if labels is not None:
+			won = (avg_win > tomo_win) | (empty & (avg_win != 0))
+			label_win = numpy.array(labels[window])
+			label_win[won] = label
+			labels[window] = label_win
+		numpy.maximum(tomo_win, avg_win, out=tomo_win)
+		numpy.copyto(tomo_win, avg_win, where=empty)
+	return tomo_win
+
+def label_file(out_file):
+	return os.path.splitext(out_file)[0] + ("_labels.zarr" if opts["--format"] == "zarr" else "_labels.mrc")
+
+def new_label_volume(out_file, tomo_xyz_size, nparticle):
+	# uint16 (mode 6) labels while the particle numbers fit, float32 (exact up to 2^24) beyond that
+	mode = 6 if nparticle < 65536 else 2
+	return new_output(label_file(out_file), tomo_xyz_size, mode, pyramid=False)
 
+# Voxel size and position of a --roi output, written into the header of every new output
+_roi_header = {}
+
+def output_start():
+	# First voxel (x, y, z) of the output in the full tomogram: not 0 for --roi and --shard outputs
+	return _roi_header.get("start", [0, 0, 0])
+
+def main_state():
+	# What main() sets beyond the command line, for the job dicts of worker pools: a spawned
+	# worker parses sys.argv again and starts with an empty _roi_header
+	return {"roi_header": dict(_roi_header), "format": opts["--format"]}
+
+def load_main_state(job):
+	# Worker side of main_state()
+	_roi_header.clear()
+	_roi_header.update(job["roi_header"])
+	opts["--format"] = job["format"]
+
+def new_output(out_file, tomo_xyz_size, mode=2, pyramid=True):
+	# New memory-mapped output volume, or chunk store for --format zarr (binned levels only
+	# with pyramid, as averaged labels mean nothing); for --roi, its header places it in the full tomogram
+	if opts["--format"] == "zarr":
+		store = ot_chunkstore.ChunkStore.create(out_file, (tomo_xyz_size[2], tomo_xyz_size[1], tomo_xyz_size[0]),
+			{2: "float32", 6: "uint16"}[mode], opts["--chunk"], None if pyramid else 1)
+		store.attrs.update(_roi_header)
+		return store
+	mrc = mrcfile.new_mmap(out_file, shape=(tomo_xyz_size[2], tomo_xyz_size[1], tomo_xyz_size[0]), mrc_mode=mode)
+	if _roi_header:
+		voxel_size = _roi_header["voxel_size"]
+		start = _roi_header["start"]
+		mrc.voxel_size = voxel_size
+		mrc.header.nxstart, mrc.header.nystart, mrc.header.nzstart = start
+		# IMOD convention: origin = -(first voxel's index) * voxel size
+		mrc.header.origin.x = -start[0]*voxel_size
+		mrc.header.origin.y = -start[1]*voxel_size
+		mrc.header.origin.z = -start[2]*voxel_size
+	return mrc
+
+class ParticleIndex(object):
+	"""
+	Grid of cells over the particles' box corners, so that the particles whose boxes
+	can touch a region are found without testing every particle. boxsizes holds each
+	particle's box size; the cells are as large as the largest box.
+	"""
+	def __init__(self, corners, boxsizes):
+		self.corners = numpy.asarray(corners, dtype="int64").reshape(-1, 3)
+		self.boxsizes = numpy.asarray(boxsizes, dtype="int64")
+		self.cell = int(self.boxsizes.max()) if len(self.boxsizes) else 1
+		self.cells = {}
+		for i, cell in enumerate((self.corners//self.cell).tolist()):
+			self.cells.setdefault(tuple(cell), []).append(i)
+
+	def query(self, lo, hi):
+		"""
+		Indices, in star file order, of the particles whose boxes overlap voxels
+		lo..hi-1 (x, y, z).
+		"""
+		# A box touches the region if lo - boxsize < corner < hi along every axis
+		clo = [(lo[i] - self.cell + 1)//self.cell for i in range(3)]
+		chi = [(hi[i] - 1)//self.cell for i in range(3)]
+		found = []
+		ncell = 1
+		for i in range(3):
+			ncell *= max(0, chi[i] - clo[i] + 1)
+		if ncell <= len(self.cells):
+			# Look up just the cells of the region
+			for cx in range(clo[0], chi[0] + 1):
+				for cy in range(clo[1], chi[1] + 1):
+					for cz in range(clo[2], chi[2] + 1):
+						found += self.cells.get((cx, cy, cz), [])
+		else:
+			# The region has more cells than there are occupied ones
+			for cell, members in self.cells.items():
+				if all(clo[i] <= cell[i] <= chi[i] for i in range(3)):
+					found += members
+		found = numpy.array(sorted(found), dtype="int64")
+		if len(found) == 0:
+			return found
+		corners = self.corners[found]
+		sizes = self.boxsizes[found, None]
+		inside = ((corners > numpy.array(lo) - sizes) & (corners < numpy.array(hi))).all(axis=1)
+		return found[inside]
+
+def mask_bounds(mask):
+	# Bounding box (x, y, z) lo, hi of the nonzero voxels of a (z, y, x) mask, read a few slices at a time
+	lo, hi = None, None
+	step = max(1, 16777216//max(1, mask[0].size))
+	for z in range(0, mask.shape[0], step):
+		chunk = numpy.array(mask[z:z+step]) != 0
+		if not chunk.any():
+			continue
+		zs = numpy.nonzero(chunk.any(axis=(1, 2)))[0] + z
+		ys = numpy.nonzero(chunk.any(axis=(0, 2)))[0]
+		xs = numpy.nonzero(chunk.any(axis=(0, 1)))[0]
+		box = [[xs[0], ys[0], zs[0]], [xs[-1] + 1, ys[-1] + 1, zs[-1] + 1]]
+		if lo is None:
+			lo, hi = box
+		else:
+			lo = [min(lo[i], box[0][i]) for i in range(3)]
+			hi = [max(hi[i], box[1][i]) for i in range(3)]
+	return lo, hi
+
+def select_roi(particle_data, boxsizes, tomo_xyz_size):
+	"""
+	Particles that can touch the --roi box or the nonzero voxels of the --roi-mask.
+	Returns their indices (star file order), the ROI's first voxel and its size.
+	"""
+	corners = particle_corners([row[:3] for row in particle_data], boxsizes).tolist()
+	index = ParticleIndex(corners, boxsizes)
+	if opts["--roi-mask"]:
+		mask_file = mrcfile.mmap(opts["--roi-mask"], mode='r', permissive=True)
+		mask = mask_file.data
+		if list(mask.shape[::-1]) != list(tomo_xyz_size):
+			print("The ROI mask is %s x %s x %s, but the output is %s x %s x %s.. exiting" % (tuple(mask.shape[::-1]) + tuple(tomo_xyz_size)))
+			sys.exit()
+		lo, hi = mask_bounds(mask)
+		if lo is None:
+			print("The ROI mask is empty.. exiting")
+			sys.exit()
+		# Keep only the particles whose (cropped) box holds a nonzero mask voxel
+		keep = []
+		for i in index.query(lo, hi):
+			a = [max(corners[i][k], 0) for k in range(3)]
+			b = [min(corners[i][k] + boxsizes[i], tomo_xyz_size[k]) for k in range(3)]
+			if (mask[a[2]:b[2], a[1]:b[1], a[0]:b[0]] != 0).any():
+				keep.append(i)
+		mask_file.close()
+	else:
+		try:
+			roi = [int(val) for val in opts["--roi"].split(",")]
+			lo, hi = roi[:3], roi[3:]
+			bad = len(roi) != 6 or any(not 0 <= lo[i] < hi[i] <= tomo_xyz_size[i] for i in range(3))
+		except ValueError:
+			bad = True
+		if bad:
+			print("--roi needs x0,y0,z0,x1,y1,z1 with 0 <= x0 < x1 <= the output's X size (same for Y, Z).. exiting")
+			sys.exit()
+		keep = index.query(lo, hi).tolist()
+	return keep, [int(v) for v in lo], [int(hi[i] - lo[i]) for i in range(3)]
+
+def shard_file(out_file, shard, nshard):
+	return "%s_shard%sof%s.mrc" % (os.path.splitext(out_file)[0], shard, nshard)
+
+def select_shard(particle_data, boxsize, tomo_xyz_size, shard, nshard, start=(0, 0, 0)):
+	"""
+	Particles of shard number shard of nshard. Like the --jobs slabs (see slab_edges),
+	the shards are Z slabs of the output holding similar numbers of particles, and
+	a particle is in every shard its box overlaps, so the shards never write the same
+	voxel and merge into exactly the output of a single run. Returns the particle
+	indices (star file order), and the first voxel and size of the part of the slab
+	their boxes reach (None if there is none), relative to the first voxel start of
+	the output being sharded (an ROI).
+	"""
+	corners = particle_corners([row[:3] for row in particle_data], [boxsize]*len(particle_data)) - numpy.asarray(start, dtype="int64")
+	edges = slab_edges(corners, boxsize, tomo_xyz_size[2], nshard) if len(corners) else []
+	if shard >= len(edges) - 1:
+		return [], None, None
+	z0, z1 = edges[shard], edges[shard+1]
+	keep = numpy.nonzero((corners[:, 2] < z1) & (corners[:, 2] + boxsize > z0))[0]
+	if len(keep) == 0:
+		return [], None, None
+	lo = numpy.maximum(corners[keep].min(axis=0), 0)
+	hi = numpy.minimum(corners[keep].max(axis=0) + boxsize, tomo_xyz_size)
+	lo[2], hi[2] = max(lo[2], z0), min(hi[2], z1)
+	if (hi <= lo).any():
+		return [], None, None
+	return keep.tolist(), [int(v) for v in lo], [int(v) for v in hi - lo]
+
+def merge_shards(out_file, tomo_xyz_size, nshard, blend):
+	"""
+	Combine the nshard shard outputs, in shard order, into a new output: each shard's
+	header (nxstart, ...) gives its position, and it is read a slab at a time.
+	sum adds the shards; max keeps the largest value, treating 0 (a voxel no particle
+	of the shard reached) as empty on both sides. As shards do not overlap, either
+	gives the output of a single run; they also merge outputs of other sharded runs.
+	"""
+	names = [shard_file(out_file, i, nshard) for i in range(nshard)]
+	missing = [name for name in names if not os.path.exists(name)]
+	if missing:
+		print("Missing shard outputs (%s of %s): %s.. exiting" % (len(missing), nshard, ", ".join(missing)))
+		sys.exit()
+	roi_start = _roi_header.get("start", [0, 0, 0])
+	tomo = new_output(out_file, tomo_xyz_size)
+	stats = VolumeStats(tomo.data.size)
+	time_start = time.time()
+	nbytes, nwrites = 0, 0
+	for name in names:
+		with mrcfile.mmap(name, mode='r', permissive=True) as mrc:
+			header = mrc.header
+			start = [int(header.nxstart) - roi_start[0], int(header.nystart) - roi_start[1], int(header.nzstart) - roi_start[2]]
+			shape = mrc.data.shape
+			if any(start[i] < 0 or start[i] + shape[2-i] > tomo_xyz_size[i] for i in range(3)):
+				print("%s (%s x %s x %s at %s, %s, %s) does not fit in the %s x %s x %s output; were the shards run with other options?.. exiting"
+					% ((name,) + shape[::-1] + tuple(start) + tuple(tomo_xyz_size)))
+				sys.exit()
+			step = max(1, 16777216//max(1, shape[1]*shape[2]))
+			for z in range(0, shape[0], step):
+				shard_win = numpy.array(mrc.data[z:z+step], dtype="float32")
+				window = (slice(start[2] + z, start[2] + z + len(shard_win)), slice(start[1], start[1] + shape[1]),
+					slice(start[0], start[0] + shape[2]))
+				tomo_win = numpy.array(tomo.data[window])
+				old_sums = window_sums(tomo_win)
+				if blend == "sum":
+					tomo_win += shard_win
+				else:
+					numpy.copyto(tomo_win, numpy.where(tomo_win == 0, shard_win, numpy.maximum(tomo_win, shard_win)),
+						where=(shard_win != 0))
+				tomo.data[window] = tomo_win
+				stats.update(window, old_sums, tomo_win)
+				nbytes += tomo_win.nbytes
+				nwrites += 1
+	print("Merged %s shards (%s) in %.1f s" % (nshard, blend, time.time() - time_start))
+	io_report(nbytes, nbytes, nwrites)
+	finish_volume(tomo, None, out_file, True, stats)
+
+# Shared with the slab workers (see ot_common.worker_pool)
+_slab_job = {}
+
+def slab_edges(corners, boxsize, nz, nslab):
+	# Edges z0 = 0 < z1 < ... < nz of up to nslab Z slabs holding similar numbers of particles
+	zmin = numpy.asarray(corners)[:, 2]
+	centers = numpy.clip(zmin + boxsize//2, 0, nz)
+	cuts = numpy.unique(numpy.percentile(centers, numpy.linspace(0, 100, nslab+1)[1:-1]).astype(int))
+	return [0] + [int(cut) for cut in cuts if 0 < cut < nz] + [nz]
+
+def slab_tasks(corners, boxsize, nz, nslab):
+	"""
+	Split the output Z range into nslab slabs holding similar numbers of particles.
+	Returns a list of (z0, z1, particle indices), each particle listed in every slab
+	its box overlaps, in star file order.
+	"""
+	zmin = numpy.asarray(corners)[:, 2]
+	zmax = zmin + boxsize
+	edges = slab_edges(corners, boxsize, nz, nslab)
+	tasks = []
+	for z0, z1 in zip(edges[:-1], edges[1:]):
+		indices = numpy.nonzero((zmin < z1) & (zmax > z0))[0]
+		if len(indices) > 0:
+			tasks.append((z0, z1, indices))
+	return tasks
+
+def remap_slab(task):
+	"""
+	Worker: composite every particle overlapping output slices z0..z1-1 into the
+	shared output file. No other worker writes these slices, so no locking is needed,
+	and particles keep star file order, so the result matches a serial run bit for bit.
+	"""
+	z0, z1, indices = task
+	job = _slab_job
+	time_start = time.time()
+	load_main_state(job)
+	data = ot_common.data_memmap(job["out_file"])
+	labels = None
+	if opts["--blend"] == "label":
+		labels = ot_common.data_memmap(label_file(job["out_file"]))
+	if "avg" not in job:
+		# Spawned workers import EMAN2 themselves (forked ones inherit it)
+		if job["engine"] == "eman2":
+			load_eman2()
+		job["avg"] = read_average(job["avg_file"], job["engine"])
+		job["cache"] = None
+		if opts["--angstep"] > 0:
+			job["cache"] = RotationCache(opts["--angstep"], int(opts["--cache-mb"]*1048576))
+	xf = job["xforms"]
+	indices = [indices[k] for k in locality_schedule(xf["corners"][indices], job["boxsize"], opts["--order"])]
+	writer = ParticleWriter(data, (z0, z1), opts["--blend"], labels, opts["--window"])
+	for avg_arr, i in xform_particles(job["avg"], xf, indices, job["engine"], job["cache"], opts["--batch"]):
+		writer.add(avg_arr, xf["windows"][i], job["label_ids"][i])
+	writer.flush()
+	data.flush()
+	del data
+	if labels is not None:
+		labels.flush()
+		del labels
+	cache = job["cache"]
+	cache_counts = (cache.hits, cache.misses) if cache is not None else (0, 0)
+	return os.getpid(), len(indices), time.time() - time_start, cache_counts, (writer.bytes_read, writer.bytes_written, writer.flushes), \
+		(writer.stats, writer.label_stats)
+
+def remap_slabs(avg_file, engine, xf, boxsize, tomo_xyz_size, out_file, jobs, label_ids):
+	# Run remap_slab over a pool of jobs workers and print a per-worker throughput report
+	tasks = slab_tasks(xf["corners"], boxsize, tomo_xyz_size[2], min(4*jobs, tomo_xyz_size[2]))
+	tasks.sort(key=lambda task: -len(task[2]))
+	_slab_job.clear()
+	_slab_job.update(avg_file=avg_file, engine=engine, xforms=xf, boxsize=boxsize, out_file=out_file, label_ids=label_ids,
+		**main_state())
+	print("Remapping in %s Z slabs with %s workers" % (len(tasks), jobs))
+	time_start = time.time()
+	workers = collections.OrderedDict()
+	pool = ot_common.worker_pool(jobs, __name__, "_slab_job")
+	io = [0, 0, 0]
+	nvoxel = tomo_xyz_size[0]*tomo_xyz_size[1]*tomo_xyz_size[2]
+	vol_stats = VolumeStats(nvoxel)
+	label_stats = VolumeStats(nvoxel) if opts["--blend"] == "label" else None
+	for pid, nrows, seconds, cache_counts, io_counts, slab_stats in pool.imap_unordered(remap_slab, tasks):
+		# The slabs are disjoint, so their statistics just add up
+		vol_stats.merge(slab_stats[0])
+		if label_stats is not None:
+			label_stats.merge(slab_stats[1])
+		stats = workers.setdefault(pid, [0, 0, 0.0, 0, 0])
+		stats[0] += 1
+		stats[1] += nrows
+		stats[2] += seconds
+		stats[3] += cache_counts[0]
+		stats[4] += cache_counts[1]
+		io = [io[i] + io_counts[i] for i in range(3)]
+	pool.close()
+	pool.join()
+	for n, (pid, stats) in enumerate(workers.items()):
+		line = "Worker %s: %s slabs, %s particle writes in %.1f s (%.1f particles/s)" % (n+1, stats[0], stats[1], stats[2], stats[1]/max(stats[2], 1e-9))
+		if stats[3] + stats[4] > 0:
+			line += ", rotation cache hit rate %.1f%%" % (100.0*stats[3]/(stats[3] + stats[4]))
+		print(line)
+	elapsed = time.time() - time_start
+	print("All workers: %s particle writes in %.1f s (%.1f particles/s)" % (sum(s[1] for s in workers.values()), elapsed, len(label_ids)/max(elapsed, 1e-9)))
+	io_report(*io)
+	return len(label_ids), vol_stats, label_stats
+
+def journal_file(out_file):
+	return out_file + ".journal.npz"
+
+def undo_file(out_file):
+	return out_file + ".undo"
+
+class UndoLog(object):
+	"""
+	Old contents of every window written since the last checkpoint, saved just before
+	the window is overwritten, so that --resume can roll the output back to exactly
+	that checkpoint. The file starts with the number of particles the checkpoint covers;
+	each record is (volume, z0, z1, y0, y1, x0, x1) followed by the window's old bytes.
+	"""
+	def __init__(self, filename, done):
+		self.file = open(filename, "wb")
+		self.reset(done)
+
+	def reset(self, done):
+		self.file.seek(0)
+		self.file.truncate()
+		self.file.write(struct.pack("<q", done))
+		self.file.flush()
+		os.fsync(self.file.fileno())
+
+	def record(self, volume, window, arr):
+		self.file.write(struct.pack("<7q", volume, *[v for sl in window for v in (sl.start, sl.stop)]))
+		self.file.write(numpy.ascontiguousarray(arr).tobytes())
+		# Out of this process before the output window is touched, so a killed run can be undone
+		self.file.flush()
+
+	def close(self):
+		self.file.close()
+
+def rollback(filename, volumes, done):
+	"""
+	Restore the windows recorded in an undo log, newest first, if the log belongs to
+	the checkpoint at done particles. volumes are the data arrays the record numbers
+	refer to. A record cut short at the end of the file was never followed by its
+	write, so it is skipped. Returns the number of windows restored.
+	"""
+	with open(filename, "rb") as f:
+		head = f.read(8)
+		if len(head) < 8 or struct.unpack("<q", head)[0] != done:
+			return 0
+		records = []
+		while True:
+			rec = f.read(56)
+			if len(rec) < 56:
+				break
+			rec = struct.unpack("<7q", rec)
+			window = (slice(rec[1], rec[2]), slice(rec[3], rec[4]), slice(rec[5], rec[6]))
+			data = volumes[rec[0]]
+			shape = (rec[2]-rec[1], rec[4]-rec[3], rec[6]-rec[5])
+			nbytes = shape[0]*shape[1]*shape[2]*data.dtype.itemsize
+			offset = f.tell()
+			f.seek(nbytes, 1)
+			if f.tell() > os.fstat(f.fileno()).st_size:
+				break
+			records.append((rec[0], window, shape, offset))
+		for volume, window, shape, offset in reversed(records):
+			f.seek(offset)
+			data = volumes[volume]
+			data[window] = numpy.frombuffer(f.read(data.dtype.itemsize*shape[0]*shape[1]*shape[2]), dtype=data.dtype).reshape(shape)
+	return len(records)
+
+def save_checkpoint(tomo, labels, writer, out_file, run, done):
+	"""
+	Flush the output (and label) volumes, then record in [Remapped].journal.npz that
+	the first done particles of the schedule are in them, with the header statistics
+	so far; the undo log then starts over from this checkpoint.
+	"""
+	writer.flush()
+	tomo.flush()
+	if labels is not None:
+		labels.flush()
+	arrays = writer.stats.arrays("stats/")
+	if writer.label_stats is not None:
+		arrays.update(writer.label_stats.arrays("label_stats/"))
+	meta = json.dumps({"run": run, "done": done})
+	tmp = journal_file(out_file) + ".tmp"
+	with open(tmp, "wb") as f:
+		numpy.savez(f, __meta__=numpy.array(meta), **arrays)
+		f.flush()
+		os.fsync(f.fileno())
+	os.rename(tmp, journal_file(out_file))
+	writer.undo.reset(done)
+
+def resume_volume(out_file, run, blend):
+	"""
+	Reopen an interrupted output for --resume: check that the journal was written by a
+	run with the same settings, roll back the writes made after its last checkpoint,
+	and return (tomo, labels, done, stats arrays).
+	"""
+	try:
+		with numpy.load(journal_file(out_file)) as npz:
+			meta = json.loads(str(npz["__meta__"]))
+			arrays = dict((key, npz[key]) for key in npz.files if key != "__meta__")
+	except (IOError, OSError, KeyError, ValueError):
+		print("No checkpoint journal %s to resume from.. exiting" % journal_file(out_file))
+		sys.exit()
+	changed = [key for key in sorted(run) if meta["run"].get(key) != run[key]]
+	if changed:
+		print("Cannot resume: %s changed since the interrupted run.. exiting" % ", ".join(changed))
+		sys.exit()
+	done = meta["done"]
+	tomo = mrcfile.mmap(out_file, mode='r+')
+	labels = None
+	volumes = [tomo.data]
+	if blend == "label":
+		labels = mrcfile.mmap(label_file(out_file), mode='r+')
+		volumes.append(labels.data)
+	restored = 0
+	if os.path.exists(undo_file(out_file)):
+		restored = rollback(undo_file(out_file), volumes, done)
+	print("Resuming after particle %s of %s (%s windows written since that checkpoint were rolled back)" % (done, run["particles"], restored))
+	return tomo, labels, done, arrays
+
+def io_report(bytes_read, bytes_written, flushes):
+	print("Output I/O: %.1f MB read, %.1f MB written in %s window writes" % (bytes_read/1048576.0, bytes_written/1048576.0, flushes))
+
+def average_geometry(avg_file):
 	# Get dimensions of subtomo average file
 	avg_xyz_size = [0, 0, 0]
 	with mrcfile.mmap(avg_file, mode='r') as tomo:
 		avg_xyz_size[0] = tomo.header.nx.item()
 		avg_xyz_size[1] = tomo.header.ny.item()
 		avg_xyz_size[2] = tomo.header.nz.item()
+	nbin = opts["--bin"]
+	if nbin > 1:
+		if any(size % (2*nbin) for size in avg_xyz_size):
+			print("The average (%s x %s x %s) must bin by %s to an even box size.. exiting" % (tuple(avg_xyz_size) + (nbin,)))
+			sys.exit()
+		avg_xyz_size = [size//nbin for size in avg_xyz_size]
 
 	# Work out the offset coordinate of subtomo average center 
 	# with respect to EMAN2's rotation center:
@@ -165,81 +1258,307 @@ def main(avg_file, tomo_file, star_file, out_file):
 			avg_center[i] = -0.5
 		elif avg_xyz_size[i]%2 == 1:
 			avg_center[i] = 0
+	return avg_xyz_size, boxsize, avg_center
+
+def finish_volume(tomo, labels, out_file, verbose=True, stats=None, label_stats=None):
+	# Header statistics (tracked while writing, see VolumeStats), then close the output (and label) volumes
+	if verbose:
+		print("Updating tomo stats..")
+	write_header_stats(tomo, stats)
+	if verbose:
+		print("Closing tomo..")
+	tomo.close()
+	if verbose and isinstance(tomo, ot_chunkstore.ChunkStore):
+		tomo.report()
+	if labels is not None:
+		write_header_stats(labels, label_stats)
+		labels.close()
+		if verbose:
+			print("Particle labels (star file row numbers, 1 = first particle) written to %s" % label_file(out_file))
+
+def remap_volume(avg, rows, avg_center, engine, cache, boxsize, tomo_xyz_size, out_file, blend, label_ids, verbose=True, checkpoint=0, run=None):
+	"""
+	Serially remap the particle rows into a new output file (plus its label volume
+	for blend = "label"); label_ids are the particles' star file row numbers.
+	With checkpoint > 0, the output is flushed every checkpoint particles and a journal
+	records how far it got (see save_checkpoint); run holds this run's settings, which
+	a --resume run must match to continue from the journal.
+	"""
+	if checkpoint > 0:
+		xf = cached_xforms(out_file, rows, avg_center, boxsize, tomo_xyz_size, cache.step if cache is not None else 0, output_start())
+	else:
+		xf = precompute_xforms(rows, avg_center, boxsize, tomo_xyz_size, cache.step if cache is not None else 0, output_start())
+	schedule = locality_schedule(xf["corners"], boxsize, opts["--order"])
+	done = 0
+	if run is not None and opts["--resume"]:
+		tomo, labels, done, arrays = resume_volume(out_file, run, blend)
+	else:
+		# Create output mrc file as memory-mapped object using mrcfile
+		tomo = new_output(out_file, tomo_xyz_size)
+		labels = None
+		if blend == "label":
+			labels = new_label_volume(out_file, tomo_xyz_size, max(label_ids) if len(label_ids) else 0)
+	label_data = labels.data if labels is not None else None
+	writer = ParticleWriter(tomo.data, None, blend, label_data, opts["--window"])
+	if done > 0:
+		writer.stats.load(arrays, "stats/")
+		if labels is not None:
+			writer.label_stats.load(arrays, "label_stats/")
+	if checkpoint > 0:
+		writer.undo = UndoLog(undo_file(out_file), done)
+		if done == 0:
+			save_checkpoint(tomo, labels, writer, out_file, run, 0)
+	k = done
+	for avg_arr, i in xform_particles(avg, xf, schedule[done:], engine, cache, opts["--batch"]):
+		writer.add(avg_arr, xf["windows"][i], label_ids[i])
+		k += 1
+		# Checkpoints fall on multiples of checkpoint, so a resumed run flushes where an uninterrupted one does
+		if checkpoint > 0 and k % checkpoint == 0 and k < len(schedule):
+			save_checkpoint(tomo, labels, writer, out_file, run, k)
+			if verbose:
+				print("Checkpoint: %s of %s particles" % (k, len(schedule)))
+	writer.flush()
+	if verbose:
+		print("Remapped %s particles!"%(k - done))
+		if cache is not None:
+			cache.report()
+		io_report(writer.bytes_read, writer.bytes_written, writer.flushes)
+	finish_volume(tomo, labels, out_file, verbose, writer.stats, writer.label_stats)
+	if writer.undo is not None:
+		writer.undo.close()
+		os.remove(undo_file(out_file))
+		os.remove(journal_file(out_file))
+		if os.path.exists(xforms_file(out_file)):
+			os.remove(xforms_file(out_file))
+	return k
+
+# Shared with the workers of --multi runs (see ot_common.worker_pool)
+_multi_job = {}
+
+def remap_output(task):
+	"""
+	Worker: remap the particles of one tomogram and class into their own output file.
+	Class averages and their rotation caches stay loaded in the worker, so they are
+	reused by every output of that class the worker handles.
+	"""
+	tomo_name, cls, indices = task
+	job = _multi_job
+	time_start = time.time()
+	load_main_state(job)
+	avgs = job.setdefault("avgs", {})
+	if cls not in avgs:
+		avg_file = job["avg_template"].format(**{"class": cls})
+		if job["engine"] == "eman2" and not avgs:
+			load_eman2()
+		avg_xyz_size, boxsize, avg_center = average_geometry(avg_file)
+		cache = None
+		if opts["--angstep"] > 0:
+			cache = RotationCache(opts["--angstep"], int(opts["--cache-mb"]*1048576))
+		avgs[cls] = (read_average(avg_file, job["engine"]), boxsize, avg_center, cache)
+	avg, boxsize, avg_center, cache = avgs[cls]
+	out = job["out_template"].format(**{"tomo": tomo_name, "class": cls})
+	rows = [job["particle_data"][i] for i in indices]
+	remap_volume(avg, rows, avg_center, job["engine"], cache, boxsize, job["tomo_xyz_size"], out, opts["--blend"],
+		[job["label_ids"][i] for i in indices], verbose=False)
+	return out, len(rows), time.time() - time_start
+
+def remap_multi(avg_template, tomo_xyz_size, particle_data, tomos, classes, out_template, engine, jobs, label_ids):
+	"""
+	Group the particles by tomogram (rlnMicrographName) and class (rlnClassNumber) and
+	write one output per group, farming the outputs out to a pool of jobs workers.
+	"""
+	groups = collections.OrderedDict()
+	for i, (tomo_name, cls) in enumerate(zip(tomos, classes)):
+		key = (os.path.splitext(os.path.basename(tomo_name))[0], int(cls))
+		groups.setdefault(key, []).append(i)
+	tasks = [(tomo_name, cls, indices) for (tomo_name, cls), indices in sorted(groups.items())]
+	try:
+		outs = [out_template.format(**{"tomo": tomo_name, "class": cls}) for tomo_name, cls, indices in tasks]
+		for cls in set(task[1] for task in tasks):
+			avg_template.format(**{"class": cls})
+	except (KeyError, IndexError, ValueError) as err:
+		print("Could not fill in the file name templates (%s).. exiting" % err)
+		sys.exit()
+	if len(set(outs)) < len(outs):
+		print("[Remapped] must contain {tomo} and {class} so that every output gets its own file.. exiting")
+		sys.exit()
+	print("%s particles in %s tomograms x %s classes -> %s outputs, %s workers"
+		%(len(particle_data), len(set(t[0] for t in tasks)), len(set(t[1] for t in tasks)), len(tasks), jobs))
+	_multi_job.clear()
+	_multi_job.update(avg_template=avg_template, out_template=out_template, engine=engine,
+		particle_data=particle_data, tomo_xyz_size=tomo_xyz_size, label_ids=label_ids, **main_state())
+	time_start = time.time()
+	pool = None
+	if jobs > 1:
+		pool = ot_common.worker_pool(jobs, __name__, "_multi_job")
+		results = pool.imap_unordered(remap_output, tasks)
+	else:
+		results = (remap_output(task) for task in tasks)
+	timings = []
+	for n, (out, nrows, seconds) in enumerate(results):
+		timings.append((seconds, out, nrows))
+		print("[%s/%s] %s: %s particles in %.1f s" % (n+1, len(tasks), out, nrows, seconds))
+	if pool is not None:
+		pool.close()
+		pool.join()
+	elapsed = time.time() - time_start
+	timings.sort(reverse=True)
+	print("Wrote %s outputs (%s particles) in %.1f s; %.1f s per output on average, slowest %s (%.1f s)"
+		%(len(timings), sum(t[2] for t in timings), elapsed, sum(t[0] for t in timings)/max(len(timings), 1), timings[0][1], timings[0][0]))
+
+def main(avg_file, tomo_size, star_file, out_file):
+	# Parse tomo_size argument
+	tomo_xyz_size = tomo_size.split(",")
+	tomo_xyz_size = [int(val) for val in tomo_xyz_size]
 
 	# Get particle coordinates and orientation from star file
-	particle_data = get_particle_data(star_file)
+	if opts["--multi"]:
+		particle_data, tomos, classes = get_particle_data(star_file, groups=True)
+	else:
+		particle_data = get_particle_data(star_file)
 
-	# Read subtomo average file using EMAN2 functions
-	avg = EMData()
-	avg.read_image(avg_file)
+	# Preview at a lower sampling
+	if opts["--bin"] < 1 or opts["--bin-method"] not in ("fourier", "mean"):
+		print("--bin needs a factor of 1 or more and --bin-method fourier or mean.. exiting")
+		sys.exit()
+	if opts["--bin"] > 1:
+		particle_data, tomo_xyz_size = bin_particles(particle_data, tomo_xyz_size, opts["--bin"])
+		print("Binning by %s (%s): output is %s x %s x %s" % ((opts["--bin"], opts["--bin-method"]) + tuple(tomo_xyz_size)))
 
-	# Create output mrc file as memory-mapped object using mrcfile
-	tomo = mrcfile.new_mmap(out_file, shape=(tomo_xyz_size[2], tomo_xyz_size[1], tomo_xyz_size[0]), mrc_mode=2)
+	# Only the particles that can touch the region of interest are remapped, into an ROI-sized output
+	label_ids = list(range(1, len(particle_data)+1))
+	if opts["--roi"] or opts["--roi-mask"]:
+		try:
+			if opts["--multi"]:
+				avg_files = dict((cls, avg_file.format(**{"class": int(cls)})) for cls in set(classes))
+			else:
+				avg_files = {None: avg_file}
+		except (KeyError, IndexError, ValueError) as err:
+			print("Could not fill in the file name templates (%s).. exiting" % err)
+			sys.exit()
+		sizes = dict((cls, average_geometry(name)[1]) for cls, name in avg_files.items())
+		boxsizes = [sizes[cls] for cls in classes] if opts["--multi"] else [sizes[None]]*len(particle_data)
+		full_size = tomo_xyz_size
+		keep, roi_start, tomo_xyz_size = select_roi(particle_data, boxsizes, tomo_xyz_size)
+		# Coordinates stay in the full tomogram; output_start() places them in the ROI
+		particle_data = [particle_data[i] for i in keep]
+		label_ids = [label_ids[i] for i in keep]
+		if opts["--multi"]:
+			tomos = [tomos[i] for i in keep]
+			classes = [classes[i] for i in keep]
+		with mrcfile.open(list(avg_files.values())[0], mode='r', header_only=True, permissive=True) as mrc:
+			_roi_header.update(voxel_size=float(mrc.voxel_size.x)*opts["--bin"], start=roi_start)
+		print("ROI %s x %s x %s at (%s, %s, %s) of the %s x %s x %s output: %s of %s particles can touch it"
+			% (tuple(tomo_xyz_size) + tuple(roi_start) + tuple(full_size) + (len(keep), len(boxsizes))))
+		if not keep:
+			print("No particles in the ROI.. exiting")
+			sys.exit()
 
-	# Start remapping
-	k = 0
-	for row in particle_data:
-		k += 1
-		xyz_offset = [0, 0, 0]
-		avg_xform = copy.copy(avg)
-		coord = [row[0], row[1], row[2]]
-		rot = [row[3], row[4], row[5]]
+	# Shards: a subset of the particles into a sub-volume, or the merge of all of them
+	if opts["--shard"] or opts["--merge"]:
+		try:
+			shard, nshard = [int(val) for val in opts["--shard"].split("/")] if opts["--shard"] else (0, opts["--merge"])
+			bad = not 0 <= shard < nshard or (opts["--shard"] and opts["--merge"])
+		except ValueError:
+			bad = True
+		if bad or opts["--multi"] or opts["--blend"] not in ("max", "sum"):
+			print("Use either --shard i/N (0 <= i < N) or --merge N, without --multi and with --blend max or sum.. exiting")
+			sys.exit()
+		if opts["--merge"]:
+			merge_shards(out_file, tomo_xyz_size, nshard, opts["--blend"])
+			return
+		roi_start = output_start()
+		keep, shard_start, shard_size = select_shard(particle_data, average_geometry(avg_file)[1], tomo_xyz_size, shard, nshard, roi_start)
+		if not _roi_header:
+			with mrcfile.open(avg_file, mode='r', header_only=True, permissive=True) as mrc:
+				_roi_header["voxel_size"] = float(mrc.voxel_size.x)*opts["--bin"]
+		out_file = shard_file(out_file, shard, nshard)
+		# The shards are MRC sub-volumes whose headers give their position; --format is for the merged output
+		opts["--format"] = "mrc"
+		if shard_start is None:
+			# Nothing to remap; an empty 1-voxel output tells --merge this shard is done
+			_roi_header["start"] = roi_start
+			new_output(out_file, [1, 1, 1]).close()
+			print("Shard %s of %s has no particles in the output; wrote an empty %s" % (shard, nshard, out_file))
+			return
+		particle_data = [particle_data[i] for i in keep]
+		label_ids = [label_ids[i] for i in keep]
+		_roi_header["start"] = [roi_start[k] + shard_start[k] for k in range(3)]
+		print("Shard %s of %s: %s particles, %s x %s x %s at (%s, %s, %s) -> %s"
+			% ((shard, nshard, len(keep)) + tuple(shard_size) + tuple(shard_start) + (out_file,)))
+		tomo_xyz_size = shard_size
 
-		# Apply rotation to subtomo average array
-		t = Transform({"type":"spider", "phi":rot[0], "theta":rot[1], "psi":rot[2]})
-		avg_xform.transform(t)
+	# Pick the rotation engine; EMAN2 is only imported if it will be used
+	engine = opts["--engine"]
+	if engine not in ("auto", "eman2", "numpy"):
+		print("Unknown engine %s.. exiting" % engine)
+		sys.exit()
+	if engine != "numpy" and not load_eman2():
+		if engine == "eman2":
+			print("Could not import EMAN2.. exiting")
+			sys.exit()
+		engine = "numpy"
+	elif engine == "auto":
+		engine = "eman2"
+	print("Rotating the average with the %s engine" % engine)
+	blend = opts["--blend"]
+	if blend not in ("max", "sum", "first", "label"):
+		print("Unknown blend mode %s.. exiting" % blend)
+		sys.exit()
+	if opts["--order"] not in ("star", "morton", "hilbert"):
+		print("Unknown particle order %s.. exiting" % opts["--order"])
+		sys.exit()
+	if opts["--resume"] and opts["--checkpoint"] <= 0:
+		print("--resume needs the --checkpoint interval of the interrupted run.. exiting")
+		sys.exit()
+	if opts["--checkpoint"] > 0 and (opts["--jobs"] > 1 or opts["--multi"]):
+		print("--checkpoint only works for serial runs (no --jobs or --multi).. exiting")
+		sys.exit()
+	if opts["--format"] not in ("mrc", "zarr") or opts["--chunk"] < 2 or opts["--chunk"] % 2:
+		print("--format must be mrc or zarr, and --chunk an even number.. exiting")
+		sys.exit()
+	if opts["--format"] == "zarr" and ((opts["--jobs"] > 1 and not opts["--multi"]) or opts["--checkpoint"] > 0):
+		print("--format zarr is written by a single process, without --checkpoint (use --multi for parallel outputs).. exiting")
+		sys.exit()
+	if opts["--multi"]:
+		remap_multi(avg_file, tomo_xyz_size, particle_data, tomos, classes, out_file, engine, opts["--jobs"], label_ids)
+		return
 
-		# Work out xyz offset for rotated subtomo average array
-		## If EMAN2 rotation center != true volume center, include xyz offset
-		avg_center_xform = zyz_rot(avg_center, rot[2], rot[1], rot[0])  #fix001 - changed to inverse rotation (20220822)
-		xyz_offset = [(avg_center[i] - avg_center_xform[i]) for i in range(len(avg_center))]
-		## Round RELION coordinates to the closest 0.5, add difference to xyz offset
-		coord_round = [nearest_half(coord[i]) for i in range(len(coord))]
-		for i in range(len(xyz_offset)):
-			xyz_offset[i] = xyz_offset[i] + coord[i] - coord_round[i]
-		## Apply xyz offset to subtomo average array
-		t = Transform({"tx":xyz_offset[0], "ty":xyz_offset[1], "tz":xyz_offset[2]})
-		avg_xform.transform(t)
+	avg_xyz_size, boxsize, avg_center = average_geometry(avg_file)
+	if opts["--validate"] > 0:
+		validate_engines(avg_file, particle_data[:opts["--validate"]], avg_center, boxsize)
 
-		# Convert subtomo average EMAN2 object to numpy array
-		avg_arr = EMNumPy.em2numpy(avg_xform)
-		avg_arr = avg_arr.astype("float32")
-		# Work out coordinates in output tomo to write particle array
-		# Will ignore writing parts of subtomo array that are outside of tomo volume
-		# Currently only supports subtomo average volumes with same xyz-dimensions and even size
-		corner_coord_min = [int(coord_round[i]-0.5-boxsize/2+1) for i in range(len(coord_round))]
-		corner_coord_max = [corner_coord_min[i]+boxsize for i in range(len(corner_coord_min))]
-		crop_min = [0, 0, 0]
-		crop_max = [0, 0, 0]
-		for i in range(len(corner_coord_min)):
-			if corner_coord_min[i] < 0:
-				crop_min[i] = 0 - corner_coord_min[i]
-		for i in range(len(corner_coord_max)):
-			if corner_coord_max[i] > tomo_xyz_size[i]:
-				crop_max[i] = corner_coord_max[i] - tomo_xyz_size[i]
-		a = [corner_coord_min[i] + crop_min[i] for i in range(len(corner_coord_min))]
-		b = [corner_coord_max[i] - crop_max[i] for i in range(len(corner_coord_max))]
-		c = [0 + crop_min[i] for i in range(len(corner_coord_min))]
-		d = [boxsize - crop_max[i] for i in range(len(corner_coord_max))]
-		
-		# Write final subtomo volume array to out tomo
-		## If multiple volumes have overlapping voxels in output tomo,
-		## the largest value will be retained:
-		mask = numpy.ma.masked_not_equal(tomo.data[a[2]:b[2], a[1]:b[1], a[0]:b[0]], 0, copy=True)
-		masked_avg_arr = numpy.ma.masked_where(numpy.ma.getmask(mask), avg_arr[c[2]:d[2], c[1]:d[1], c[0]:d[0]])
-		masked_avg_arr = numpy.ma.filled(masked_avg_arr, fill_value=9999)
-		temp_arr = numpy.minimum.reduce([masked_avg_arr, tomo.data[a[2]:b[2], a[1]:b[1], a[0]:b[0]]])
-		tomo.data[a[2]:b[2], a[1]:b[1], a[0]:b[0]] = numpy.maximum.reduce([avg_arr[c[2]:d[2], c[1]:d[1], c[0]:d[0]], temp_arr])
-
-	print("Remapped %s particles!"%k)
-	print("Updating tomo stats..")
-	tomo.update_header_stats()
-	print("Closing tomo..")
-	tomo.close()
+	# Read subtomo average file (EMData for EMAN2, numpy array otherwise)
+	avg = read_average(avg_file, engine)
+
+	# Optional cache of rotated averages for repeated (quantized) orientations
+	cache = None
+	if opts["--angstep"] > 0:
+		cache = RotationCache(opts["--angstep"], int(opts["--cache-mb"]*1048576))
+
+	# Start remapping
+	if opts["--jobs"] > 1:
+		# Workers write straight into the data block of the file(s), one Z slab each
+		new_output(out_file, tomo_xyz_size).close()
+		labels = None
+		if blend == "label":
+			new_label_volume(out_file, tomo_xyz_size, max(label_ids) if label_ids else 0).close()
+		xf = precompute_xforms(particle_data, avg_center, boxsize, tomo_xyz_size, opts["--angstep"], output_start())
+		k, stats, label_stats = remap_slabs(avg_file, engine, xf, boxsize, tomo_xyz_size, out_file, opts["--jobs"], label_ids)
+		print("Remapped %s particles!"%k)
+		tomo = mrcfile.mmap(out_file, mode='r+')
+		if blend == "label":
+			labels = mrcfile.mmap(label_file(out_file), mode='r+')
+		finish_volume(tomo, labels, out_file, True, stats, label_stats)
+	else:
+		# Settings that must not change between an interrupted run and its --resume
+		run = {"average": os.path.abspath(avg_file), "star": os.path.abspath(star_file), "size": tomo_xyz_size,
+			"particles": len(particle_data), "engine": engine, "blend": blend, "order": opts["--order"],
+			"window": opts["--window"], "checkpoint": opts["--checkpoint"], "angstep": opts["--angstep"],
+			"bin": opts["--bin"], "bin_method": opts["--bin-method"], "roi": opts["--roi"], "roi_mask": opts["--roi-mask"],
+			"shard": opts["--shard"]}
+		remap_volume(avg, particle_data, avg_center, engine, cache, boxsize, tomo_xyz_size, out_file, blend,
+			label_ids, True, opts["--checkpoint"], run)
 
 if __name__ == "__main__":
-	avg_mrc = sys.argv[1]
-	tomo_mrc = sys.argv[2]
-	avg_star = sys.argv[3]
-	out_mrc = sys.argv[4]
-	main(avg_mrc, tomo_mrc, avg_star, out_mrc)
+	main(avg_file, tomo_size, star_file, out_file)
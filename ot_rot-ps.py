@@ -1,90 +1,195 @@
 #!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Generated with the assistance of Claude (Anthropic).
+# Model: Claude (Anthropic), version not recorded        Date: 2026-10-18
+# Reviewed, tested, and validated by the Gan Lab (Anaphase); the authors take
+# full responsibility for the correctness of this code.
+# Lab: https://github.com/anaphaze | https://www.anaphase.org
+# AI-assisted sections: read_image, normalize_edgemean, polar_image,
+#   polar_correlation, eman2_correlation, power_spectrum, plot_spectrum and main;
+#   the usage text and the plot layout predate this header.
+# -----------------------------------------------------------------------------
 # ot_rot-ps.py -- Generate a rotational correlation and power spectrum from an image
 #
 # If you find this script useful for your work, please cite:
 # Ng, 2019, JCB, Electron cryotomography analysis of Dam1C/DASH at the kinetochore–spindle interface in situ
 # https://www.ncbi.nlm.nih.gov/pubmed/30504246
 #
-# Dependencies: EMAN2
+# Dependencies: numpy, scipy, ot_common.py, matplotlib (for the plot), mrcfile (for MRC images),
+#   EMAN2 (for --engine eman2 only)
 # Created: 20170510 (Lu Gan)
 # Revised: 20171211 tightened comments (LG)
 # Revised: 20191116 updated reference (LG)
+# Revised: 20261018 (agent) Polar engine: the image is resampled on a polar grid once, and the
+#   correlation at every angle comes from one FFT along the angle (any --step); EMAN2
+#   is optional; the spectrum is computed from memory, not reread from corr_*.txt, and
+#   plotted at whole symmetries
 #
-import os
-from EMAN2 import *
+# The rotational correlation of an image f with itself rotated by phi is, on a polar
+# grid f(r, theta) weighted by the area r dr dtheta of each sample,
+#   C(phi) = sum_r r sum_theta g(r, theta) g(r, theta + phi)
+# where g is f less its (area-weighted) mean over the disk that fits in the image,
+# and, by the correlation theorem, C = IFFT_theta(sum_r r |FFT_theta g(r, .)|^2).
+# Divided by C(0), C is the correlation coefficient of the image and its rotated copy
+# over that disk, which is what "cmp ccc" gave over the whole square. The rotational
+# power spectrum is |FFT(C)|^2, whose nth term is the power of n-fold symmetry, scaled
+# by (360/N)^2 for N angles, so it does not change with --step (and is as before at 1
+# degree).
+
+from __future__ import print_function
+import os, sys
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.fftpack import fft, ifft
+from scipy import ndimage
+import ot_common
 
 # http://blake.bcm.edu/emanwiki/FAQ_EMAN_USING_20
 # https://matplotlib.org/users/pyplot_tutorial.html
 # http://stackoverflow.com/questions/38812611/numpys-fast-fourier-transform-yields-unexpected-results
 # http://stackoverflow.com/questions/24943991/matplotlib-change-grid-interval-and-specify-tick-labels
 
-#---------- BEGIN User inputs ------------------------------
-try:
-   name_img = sys.argv[1]
-   max_sym  = int(sys.argv[2])
-except IndexError:
-   print "================================================================"
-   print "Usage:>>   ot_rot-ps.py [Image] [max_sym]"
-   print "----------------------------------------------------------------"
-   print "Image:     Grayscale 2-D image, PNG or TIFF format"
-   print "max_sym:   Maximum rotational symmetry"
-   print "----------------------------------------------------------------"
-   print "Output:>>  corr_[Image].txt  (rotational correlation, 0 - 360 degrees)"
-   print "Output:>>  ps_[Image].txt  (rotational power spectrum, 0 - max_sym)"
-   print "Output:>>  A graphical plot of the rotational power spectrum"
-   sys.exit()
-name_root, name_extension = os.path.splitext(name_img)
-#----------- END User inputs -------------------------------
-
-# Calculate CCCs with EMAN2
-a=EMData(name_img,0)
-a.process_inplace("normalize.edgemean")
-out=open("corr_%s.txt" % name_root,"w")
-
-for angle in range(0,360):
-    b=a.copy()
-    b.rotate(float(angle),0,0)
-    out.write("%d\t%f\n"%(angle,a.cmp("ccc",b,{"negative":0})))
-out.close()
-
-# Number of samplepoints and spacing
-N = 360
-T = 1.0 / N
-
-# Input by numpy, using column 1
-y = np.genfromtxt("corr_%s.txt" % name_root, dtype = float, delimiter = '\t', usecols = 1)
-xf = np.linspace(0.0, 1.0/(2.0*T), N/2)
-
-# Power spectrum by numpy
-yf = np.abs(np.fft.fft(y, axis=0))**2
-
-fig = plt.figure()
-ax = fig.add_subplot(1,1,1)
-
-# major ticks every 10, minor ticks every 1
-major_ticks = np.arange(0, max_sym, 10)
-minor_ticks = np.arange(0, max_sym, 1)
-ax.set_xticks(major_ticks)
-ax.set_xticks(minor_ticks, minor=True)
-
-# Minor ticks have lighter shading
-ax.grid(which='minor', alpha=0.5)
-ax.grid(which='major', alpha=1)
-
-ax.plot(xf, (2.0/N)*(yf[0:N//2]))
-ax.set_xlim(0,max_sym)
-
-# Save FFT as text file
-np.savetxt("ps_%s.txt" % name_root, yf)
-
-# Open up graphical plot
-plt.title('Rotational power spectrum')
-plt.ylabel('Power')
-plt.xlabel('Symmetry')
-plt.grid()
-plt.show()
-
-sys.exit()
+
+def read_image(name_img):
+	# 2-D float image (y, x): MRC (first section) with mrcfile, others (PNG, TIFF, ...) with matplotlib; color is averaged to gray
+	if os.path.splitext(name_img)[1].lower() in (".mrc", ".mrcs", ".map", ".rec"):
+		import mrcfile
+		with mrcfile.open(name_img, mode='r', permissive=True) as mrc:
+			img = np.array(mrc.data[0] if mrc.data.ndim == 3 else mrc.data, dtype=float)
+	else:
+		import matplotlib.pyplot as plt
+		img = np.asarray(plt.imread(name_img), dtype=float)
+		if img.ndim == 3:
+			img = img[:, :, :3].mean(axis=2)
+		# Image files have their first row at the top; MRC and EMAN2 at the bottom
+		img = img[::-1]
+	return img
+
+def normalize_edgemean(img):
+	# As EMAN2's normalize.edgemean: the mean of the border pixels becomes 0, the standard deviation 1
+	edge = np.concatenate([img[0], img[-1], img[1:-1, 0], img[1:-1, -1]])
+	sigma = img.std()
+	return (img - edge.mean())/(sigma if sigma > 0 else 1.0)
+
+def polar_image(img, nangle):
+	"""
+	Image resampled (bilinear) on a polar grid about its center (nx/2, ny/2), as
+	EMAN2 rotates: (nradius, nangle) samples, 1 pixel and 360/nangle degrees apart,
+	out to the largest circle inside the image. Returns the samples and the radii.
+	"""
+	ny, nx = img.shape
+	radii = np.arange(0, min(nx, ny)//2)
+	theta = np.arange(nangle)*2*np.pi/nangle
+	x = nx//2 + radii[:, None]*np.cos(theta)[None, :]
+	y = ny//2 + radii[:, None]*np.sin(theta)[None, :]
+	return ndimage.map_coordinates(img, [y, x], order=1, mode="constant"), radii
+
+def polar_correlation(img, step):
+	# Rotational correlation at 0, step, 2 step, ... degrees, from one FFT along the angle
+	nangle = int(round(360.0/step))
+	polar, radii = polar_image(img, nangle)
+	# Without the mean, each ring's constant term would add to C at every angle
+	polar = polar - (polar*radii[:, None]).sum()/(radii.sum()*nangle)
+	power = (np.abs(np.fft.fft(polar, axis=1))**2*radii[:, None]).sum(axis=0)
+	corr = np.fft.ifft(power).real
+	return corr/corr[0] if corr[0] > 0 else corr
+
+def eman2_correlation(name_img, step):
+	# The original engine: cmp("ccc") of the image with a copy rotated in real space, at each angle
+	try:
+		from EMAN2 import EMData
+	except ImportError:
+		print("--engine eman2 needs EMAN2.. exiting")
+		sys.exit()
+	a = EMData(name_img, 0)
+	a.process_inplace("normalize.edgemean")
+	nangle = int(round(360.0/step))
+	corr = np.zeros(nangle)
+	for i in range(nangle):
+		b = a.copy()
+		b.rotate(i*360.0/nangle, 0, 0)
+		corr[i] = a.cmp("ccc", b, {"negative": 0})
+	return corr
+
+def power_spectrum(corr):
+	# Rotational power spectrum: term n is the power of n-fold symmetry, on the scale of 360 samples whatever the step
+	return np.abs(np.fft.fft(corr, axis=0))**2*(360.0/len(corr))**2
+
+def plot_spectrum(yf, max_sym):
+	import matplotlib.pyplot as plt
+	N = len(yf)
+	fig = plt.figure()
+	ax = fig.add_subplot(1,1,1)
+
+	# major ticks every 10, minor ticks every 1
+	major_ticks = np.arange(0, max_sym, 10)
+	minor_ticks = np.arange(0, max_sym, 1)
+	ax.set_xticks(major_ticks)
+	ax.set_xticks(minor_ticks, minor=True)
+
+	# Minor ticks have lighter shading
+	ax.grid(which='minor', alpha=0.5)
+	ax.grid(which='major', alpha=1)
+
+	# Term n of the spectrum is n-fold symmetry (the plot used to stretch 0..N/2-1 over 0..N/2)
+	xf = np.arange(N//2)
+	ax.plot(xf, (2.0/360)*(yf[0:N//2]))
+	ax.set_xlim(0,max_sym)
+
+	# Open up graphical plot
+	plt.title('Rotational power spectrum')
+	plt.ylabel('Power')
+	plt.xlabel('Symmetry')
+	plt.grid()
+	plt.show()
+
+def main(name_img, max_sym, opts):
+	name_root, name_extension = os.path.splitext(name_img)
+	step = opts["--step"]
+	if not 0 < step <= 360.0/(2*max_sym):
+		print("--step must be above 0 and at most %1.4g degrees, to resolve %s-fold symmetry.. exiting" % (360.0/(2*max_sym), max_sym))
+		sys.exit()
+	if opts["--engine"] == "eman2":
+		corr = eman2_correlation(name_img, step)
+	elif opts["--engine"] == "polar":
+		corr = polar_correlation(normalize_edgemean(read_image(name_img)), step)
+	else:
+		print("Unknown engine %s.. exiting" % opts["--engine"])
+		sys.exit()
+	angles = np.arange(len(corr))*360.0/len(corr)
+	np.savetxt("corr_%s.txt" % name_root, np.column_stack([angles, corr]), fmt=['%g', '%f'], delimiter='\t')
+
+	# Power spectrum by numpy, straight from the correlation in memory
+	yf = power_spectrum(corr)
+
+	# Save FFT as text file
+	np.savetxt("ps_%s.txt" % name_root, yf)
+	# Only up to max_sym, like the plot; --step keeps that within the Nyquist frequency
+	top = np.argsort(yf[1:max_sym+1])[::-1][:3] + 1
+	print("Strongest symmetries: %s" % ", ".join("%d-fold" % n for n in top))
+	if not opts["--noplot"]:
+		plot_spectrum(yf, max_sym)
+
+if __name__ == "__main__":
+	#---------- BEGIN User inputs ------------------------------
+	args, opts = ot_common.parse_options(sys.argv[1:], {"--step": 1.0, "--engine": "polar", "--noplot": False})
+	try:
+		name_img = args[0]
+		max_sym  = int(args[1])
+	except IndexError:
+		print("================================================================")
+		print("Usage:>>   ot_rot-ps.py [Image] [max_sym] [Options]")
+		print("----------------------------------------------------------------")
+		print("Image:     Grayscale 2-D image, PNG or TIFF format (or MRC)")
+		print("max_sym:   Maximum rotational symmetry")
+		print("----------------------------------------------------------------")
+		print("Options:")
+		print("--step D     Angular sampling of the correlation, in degrees (default 1)")
+		print("--engine E   polar (default; one FFT of the image on a polar grid) or eman2")
+		print("             (rotates the image at every angle, as before; needs EMAN2)")
+		print("--noplot     Only write the text files")
+		print("----------------------------------------------------------------")
+		print("Output:>>  corr_[Image].txt  (rotational correlation, 0 - 360 degrees)")
+		print("Output:>>  ps_[Image].txt  (rotational power spectrum, 0 - max_sym)")
+		print("Output:>>  A graphical plot of the rotational power spectrum")
+		sys.exit()
+	#----------- END User inputs -------------------------------
+	main(name_img, max_sym, opts)
@@ -1,13 +1,23 @@
 #!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Generated with the assistance of Claude (Anthropic).
+# Model: Claude (Anthropic), version not recorded        Date: 2026-10-18
+# Reviewed, tested, and validated by the Gan Lab (Anaphase); the authors take
+# full responsibility for the correctness of this code.
+# Lab: https://github.com/anaphaze | https://www.anaphase.org
+# AI-assisted sections: reading and writing .mod files (ot_imodmodel.py) and the
+#   print() calls; the rest of the file predates this header.
+# -----------------------------------------------------------------------------
 # ot_unskew.py -- Compensate .mod coordinates for compression artifacts
 #
 # If you find this script useful for your work, please cite:
 # Cai, 2018, PNAS, Cryo-ET reveals the macromolecular reorganization of S. pombe mitotic chromosomes in vivo
 # https://www.ncbi.nlm.nih.gov/pubmed/30297429
 #
-# Dependencies: python 2.7, IMOD
+# Dependencies: numpy, ot_imodmodel.py (python 2.7 or 3)
 # Created: 20170715 (Lu Gan)
 # Revised: 20180621 (LG) Revised comments
+# Revised: 20261018 (agent) Reads and writes IMOD .mod files directly, instead of running point2model
 #
 # To calculate the correction matrix, multiply the following matrices
 # 1) Rotate so that knife marks are parallel w/ X axis
@@ -16,8 +26,10 @@
 # http://scipython.com/book/chapter-6-numpy/examples/creating-a-rotation-matrix-in-numpy/
 # https://en.wikipedia.org/wiki/Rotation_matrix#Basic_rotations
 
+from __future__ import print_function
 import os, subprocess, sys, struct, math
 import numpy as np
+import ot_imodmodel
 
 #---------- BEGIN User inputs ------------------------------
 # stackoverflow.com/questions/2194163/python-empty-argument
@@ -26,23 +38,23 @@ try:
    compress = float(sys.argv[2])
    coords =   sys.argv[3]
 except IndexError:
-   print "================================================================"
-   print "Usage:>>   ot_unskew.py [angle] [compress] [mod.txt]"
-   print "================================================================"
-   print "Note 1:  Tomo has to be accurately positioned w/ section surface perpendicular to Z axis"
-   print "Note 2:  Measure or estimate the following values first:" 
-   print "angle:     Slicer clockwise Z rotation (positive, degrees) to align knife mark to X axis"
-   print "compress:  Estimated compression ratio (greater than one)"
-   print "mod.txt:   Coordinates of your template-matching hits, ascii format"
-   print "----------------------------------------------------------------"
-   print "This script assumes your tomo was aligned so section surface is parallel to XY plane"
-   print "[Unskew] = [Rz^-1] * [Stretch] * [Rz]"
-   print "[Unskew]:  overall correction matrix"
-   print "[Rz]:      aligns knife marks to X axis"
-   print "[Rz^-1]:   rotates back to original orientation"
-   print "[Stretch]: undistorts along knife-mark and perpendicular to section surface"
-   print "----------------------------------------------------------------"
-   print "Output:>> mod_unskewed.txt & mod_unskewed.mod"
+   print("================================================================")
+   print("Usage:>>   ot_unskew.py [angle] [compress] [mod.txt or .mod]")
+   print("================================================================")
+   print("Note 1:  Tomo has to be accurately positioned w/ section surface perpendicular to Z axis")
+   print("Note 2:  Measure or estimate the following values first:")
+   print("angle:     Slicer clockwise Z rotation (positive, degrees) to align knife mark to X axis")
+   print("compress:  Estimated compression ratio (greater than one)")
+   print("mod.txt:   Coordinates of your template-matching hits, ascii format, or an IMOD model")
+   print("----------------------------------------------------------------")
+   print("This script assumes your tomo was aligned so section surface is parallel to XY plane")
+   print("[Unskew] = [Rz^-1] * [Stretch] * [Rz]")
+   print("[Unskew]:  overall correction matrix")
+   print("[Rz]:      aligns knife marks to X axis")
+   print("[Rz^-1]:   rotates back to original orientation")
+   print("[Stretch]: undistorts along knife-mark and perpendicular to section surface")
+   print("----------------------------------------------------------------")
+   print("Output:>> mod_unskewed.txt & mod_unskewed.mod")
    sys.exit()
 #----------- END User inputs -------------------------------
 outname = os.path.splitext(coords)[0]
@@ -52,27 +64,42 @@ Rzinv = Rz.I
 Stretch = np.matrix([[compress,0,0],[0,1,0],[0,0,1/compress]])
 Unskew = Rzinv*Stretch*Rz
 Unskewarray = np.array(Unskew)
-vectors = np.genfromtxt(coords, delimiter="").T
-vectorarray = np.array(vectors)
+model = None
+if os.path.splitext(coords)[1].lower() == ".mod":
+   model = ot_imodmodel.read_model(coords)
+   vectorarray = ot_imodmodel.model_points(model)[0].T
+else:
+   vectors = np.genfromtxt(coords, delimiter="").T
+   vectorarray = np.array(vectors)
 results = np.dot(Unskewarray,vectorarray).T
 
 #----------- Print diagnostics -----------------------------
 np.set_printoptions(precision=2, suppress=True)
-print "rotate %s radians" % (angle)
-print "Rotation:"
+print("rotate %s radians" % (angle))
+print("Rotation:")
 print(Rz)
-print "Inverse rotation:"
+print("Inverse rotation:")
 print(Rzinv)
-print "Stretch:"
+print("Stretch:")
 print(Stretch)
-print "Unskew:"
+print("Unskew:")
 print(Unskew)
-print "vectors:"
+print("vectors:")
 print(vectorarray)
 #print "results:"
 #print(results)
 
 #np.savetxt("unskewed.txt", results, fmt='%1.2f', delimiter=" ")
 np.savetxt("%s_unskewed.txt" % (outname), results, fmt='%1.2f', delimiter=" ")
-os.system('point2model %s_unskewed.txt %s_unskewed.mod' % (outname, outname))
+if model is not None:
+   # Same objects and contours as the input model, with the unskewed points
+   start = 0
+   for obj in model["objects"]:
+      for i, contour in enumerate(obj["contours"]):
+         obj["contours"][i] = results[start:start+len(contour)]
+         start += len(contour)
+   size = [max(model["size"][k], int(np.ceil(results[:,k].max())) + 1 if len(results) else 0) for k in range(3)]
+   ot_imodmodel.write_model("%s_unskewed.mod" % (outname), model["objects"], size, model["name"], model["pixel_size"], model["units"])
+else:
+   ot_imodmodel.write_points("%s_unskewed.mod" % (outname), results)
 sys.exit()
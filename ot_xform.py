@@ -0,0 +1,148 @@
+# -----------------------------------------------------------------------------
+# Generated with the assistance of Claude (Anthropic).
+# Model: Claude (Anthropic), version not recorded        Date: 2026-10-18
+# Reviewed, tested, and validated by the Gan Lab (Anaphase); the authors take
+# full responsibility for the correctness of this code.
+# Lab: https://github.com/anaphaze | https://www.anaphase.org
+# -----------------------------------------------------------------------------
+# ot_xform.py -- rotates and shifts subtomogram averages with NumPy/SciPy instead of EMAN2
+#
+# Dependencies: numpy, scipy
+# Created 20261018 (agent)
+#
+# Follows EMAN2's conventions, so the results can stand in for
+#   avg.transform(Transform({"type":"spider", "phi":rot, "theta":tilt, "psi":psi}))
+#   avg.transform(Transform({"tx":tx, "ty":ty, "tz":tz}))
+# 1) SPIDER "ZYZ" Euler angles: M = Rz(psi) * Ry(tilt) * Rz(rot), with the same
+#    (clockwise) single-axis matrices as rotation_matrix() in ot_remap_v2.py
+# 2) Rotation is about EMAN2's center, voxel n//2 along each axis
+# 3) Output voxels are pulled from the input with trilinear interpolation:
+#    out(x) = avg(M^T * (x - c - t) + c), and zero outside the input box
+# Arrays are indexed (z, y, x) like mrcfile and EMNumPy; vectors are (x, y, z).
+#
+# bin_mean() and bin_fourier() shrink an average by an integer factor n for previews.
+# Both sample it on the same grid, binned voxel j = full voxel j*n + (n-1)/2 (the
+# centre of each n-voxel block), so either can be used with the same coordinates.
+
+import numpy
+from scipy import ndimage
+
+_grids = {}
+# Work space of resample() and of the batches of resampled boxes, in bytes
+WORK_BYTES = 268435456
+
+
+def spider_matrices(rot, tilt, psi):
+	"""
+	Return an (N, 3, 3) array of SPIDER ZYZ rotation matrices for arrays of
+	rot/tilt/psi angles in degrees.
+	"""
+	rot = numpy.radians(numpy.atleast_1d(numpy.asarray(rot, dtype=float)))
+	tilt = numpy.radians(numpy.atleast_1d(numpy.asarray(tilt, dtype=float)))
+	psi = numpy.radians(numpy.atleast_1d(numpy.asarray(psi, dtype=float)))
+	ca, sa = numpy.cos(rot), numpy.sin(rot)
+	cb, sb = numpy.cos(tilt), numpy.sin(tilt)
+	cg, sg = numpy.cos(psi), numpy.sin(psi)
+	mats = numpy.empty((len(rot), 3, 3))
+	mats[:, 0, 0] = cg*cb*ca - sg*sa
+	mats[:, 0, 1] = cg*cb*sa + sg*ca
+	mats[:, 0, 2] = -cg*sb
+	mats[:, 1, 0] = -sg*cb*ca - cg*sa
+	mats[:, 1, 1] = -sg*cb*sa + cg*ca
+	mats[:, 1, 2] = sg*sb
+	mats[:, 2, 0] = sb*ca
+	mats[:, 2, 1] = sb*sa
+	mats[:, 2, 2] = cb
+	return mats
+
+
+def eman_center(shape):
+	"""
+	EMAN2's rotation center (x, y, z) for an array of shape (nz, ny, nx).
+	"""
+	return numpy.array([shape[2]//2, shape[1]//2, shape[0]//2], dtype=float)
+
+
+def _grid(shape):
+	# Output voxel coordinates (x, y, z) relative to the rotation center, shape (3, V)
+	if shape not in _grids:
+		grid = numpy.indices(shape, dtype=float).reshape(3, -1)[::-1]
+		_grids[shape] = grid - eman_center(shape)[:, None]
+	return _grids[shape]
+
+
+def batch_limit(shape, max_bytes=WORK_BYTES):
+	"""
+	Number of particles of an average of shape (z, y, x) whose float32 resampled
+	boxes fit in max_bytes (at least 1). Callers that batch particles use it to
+	cap their batches, so memory does not grow with the batch size for large boxes.
+	"""
+	return max(1, int(max_bytes//(4*shape[0]*shape[1]*shape[2])))
+
+
+def resample(avg_arr, mats, shifts=None, order=1, max_bytes=WORK_BYTES):
+	"""
+	Rotate a (z, y, x) average by each matrix in mats (N, 3, 3), then shift it by
+	shifts (N, 3) voxels in xyz, in one interpolation per particle. Returns a
+	float32 array of shape (N, nz, ny, nx). The source coordinates take 52 bytes per
+	voxel and particle, so they are worked out for as many particles (or, for very
+	large boxes, voxels of one particle) at a time as fit in max_bytes.
+	"""
+	mats = numpy.asarray(mats, dtype=float).reshape(-1, 3, 3)
+	nbatch = len(mats)
+	if shifts is None:
+		shifts = numpy.zeros((nbatch, 3))
+	shifts = numpy.asarray(shifts, dtype=float).reshape(nbatch, 3)
+	shape = tuple(avg_arr.shape)
+	center = eman_center(shape)
+	mt = numpy.transpose(mats, (0, 2, 1))
+	offsets = center - (mt[:, :, 0]*shifts[:, 0, None] + mt[:, :, 1]*shifts[:, 1, None] + mt[:, :, 2]*shifts[:, 2, None])
+	grid = _grid(shape)
+	nvox = grid.shape[1]
+	# src and coords (3 float64 each) and the float32 samples
+	per_batch = max(1, int(max_bytes//(52*nvox)))
+	per_span = min(nvox, max(1, int(max_bytes//(52*per_batch))))
+	out = numpy.empty((nbatch, nvox), dtype=numpy.float32)
+	for b in range(0, nbatch, per_batch):
+		mtb, offb = mt[b:b+per_batch], offsets[b:b+per_batch]
+		for v in range(0, nvox, per_span):
+			part = grid[:, v:v+per_span]
+			# Written out per element (not einsum/matmul) so that every particle gets
+			# bit-identical coordinates whatever batch or span it is resampled in
+			src = numpy.empty((len(mtb), 3, part.shape[1]))
+			for i in range(3):
+				src[:, i] = mtb[:, i, 0, None]*part[0] + mtb[:, i, 1, None]*part[1] + mtb[:, i, 2, None]*part[2] + offb[:, i, None]
+			# (batch, xyz, voxel) -> (zyx, batch*voxel) for map_coordinates
+			coords = src[:, ::-1, :].transpose(1, 0, 2).reshape(3, -1)
+			out[b:b+per_batch, v:v+per_span] = ndimage.map_coordinates(avg_arr, coords, order=order, mode="constant",
+				cval=0.0, output=numpy.float32).reshape(len(mtb), -1)
+	return out.reshape((nbatch,) + shape)
+
+
+def bin_mean(arr, n):
+	"""
+	Bin a (z, y, x) array by n, averaging each n x n x n block. Every dimension
+	must be a multiple of n.
+	"""
+	nz, ny, nx = arr.shape
+	blocks = numpy.asarray(arr, dtype=float).reshape(nz//n, n, ny//n, n, nx//n, n)
+	return blocks.mean(axis=(1, 3, 5)).astype(numpy.float32)
+
+
+def bin_fourier(arr, n):
+	"""
+	Bin a (z, y, x) array by n by Fourier cropping: only the lowest 1/n of the
+	frequencies along each axis are kept, with a phase shift so that the samples
+	fall on the block centres, like bin_mean(). Every dimension must be a multiple of n.
+	"""
+	arr = numpy.asarray(arr, dtype=float)
+	ft = numpy.fft.fftn(arr)
+	shape = tuple(dim//n for dim in arr.shape)
+	# Frequencies -m/2 .. m/2-1 of the full spectrum, in numpy's FFT order
+	index = numpy.ix_(*[numpy.fft.fftfreq(m, 1.0/m).astype(int) % dim for m, dim in zip(shape, arr.shape)])
+	ft = ft[index]
+	# Shift by (n-1)/2 full voxels, i.e. (n-1)/(2n) binned voxels
+	for axis, m in enumerate(shape):
+		ramp = numpy.exp(2j*numpy.pi*numpy.fft.fftfreq(m)*(n - 1)/(2.0*n))
+		ft *= ramp.reshape([-1 if i == axis else 1 for i in range(3)])
+	return (numpy.fft.ifftn(ft).real/n**3).astype(numpy.float32)
@@ -0,0 +1,63 @@
+# Shared fixtures for the ot_ script tests: the scripts sit at the top of the
+# repository, so it goes on sys.path, and the command-line scripts are run in a
+# subprocess from a scratch directory.
+
+import os, sys, subprocess
+import numpy
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Runs a script with spawned rather than forked workers, as on macOS and Windows
+SPAWN = """
+import sys, runpy, multiprocessing
+multiprocessing.set_start_method("spawn")
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+def run_script(script, args, cwd, check=True, spawn=False):
+	"""
+	Run ot_ script with args in cwd; returns its combined stdout and stderr. With
+	spawn, its worker pools start their processes by spawn.
+	"""
+	env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+	command = [sys.executable, "-c", SPAWN] if spawn else [sys.executable]
+	proc = subprocess.run(command + [os.path.join(ROOT, script)] + [str(a) for a in args],
+		cwd=str(cwd), env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+	if check:
+		assert proc.returncode == 0, proc.stdout
+	return proc.stdout
+
+
+@pytest.fixture
+def remap_data(tmp_path):
+	"""
+	A 24^3 average (avg.mrc, two blobs so that rotations show), and data.star with
+	60 particles of classes 1 and 2 on three tomograms, in a 120 x 100 x 60 volume,
+	some of them partly outside it.
+	"""
+	import mrcfile
+	rng = numpy.random.default_rng(0)
+	n = 24
+	z, y, x = numpy.mgrid[:n, :n, :n]
+	avg = numpy.exp(-((x - 10)**2 + (y - 13)**2 + (z - 12)**2)/20.0) + 0.5*numpy.exp(-((x - 15)**2 + (y - 9)**2 + (z - 14)**2)/8.0)
+	with mrcfile.new(str(tmp_path / "avg.mrc")) as mrc:
+		mrc.set_data((avg - 0.1).astype("float32"))
+		mrc.voxel_size = 10.0
+	columns = ["rlnCoordinateX", "rlnCoordinateY", "rlnCoordinateZ", "rlnOriginX", "rlnOriginY", "rlnOriginZ",
+		"rlnAngleRot", "rlnAngleTilt", "rlnAnglePsi", "rlnClassNumber", "rlnMicrographName"]
+	with open(str(tmp_path / "data.star"), "w") as f:
+		f.write("\ndata_\n\nloop_\n")
+		for i, name in enumerate(columns):
+			f.write("_%s #%d\n" % (name, i + 1))
+		for i in range(60):
+			xyz = rng.uniform([-5, -5, -5], [125, 105, 65])
+			origin = rng.uniform(-2, 2, 3)
+			angles = rng.uniform(-180, 180, 3)
+			angles[1] = abs(angles[1]) % 180
+			f.write("%.3f %.3f %.3f %.3f %.3f %.3f %.2f %.2f %.2f %d Tomograms/tomo%d.mrc\n"
+				% (tuple(xyz) + tuple(origin) + tuple(angles) + (1 + i % 2, 1 + i % 3)))
+	return tmp_path
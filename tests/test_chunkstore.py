@@ -0,0 +1,49 @@
+import os
+import numpy as np
+import pytest
+
+import ot_chunkstore
+from conftest import run_script
+
+
+def test_round_trip(tmp_path):
+	path = str(tmp_path / "vol.zarr")
+	rng = np.random.default_rng(0)
+	volume = np.zeros((40, 50, 70), dtype=np.float32)
+	volume[5:20, 10:45, 30:64] = rng.random((15, 35, 34))
+	# A small cache, so chunks are evicted (and written) while the volume is filled
+	store = ot_chunkstore.ChunkStore.create(path, volume.shape, chunk=16, cache_mb=0.05)
+	for z in range(0, 40, 7):
+		store.data[z:z+7] = volume[z:z+7]
+	store.attrs["voxel_size"] = 5.0
+	store.close()
+	store = ot_chunkstore.ChunkStore.open(path)
+	assert np.array_equal(store.data[:], volume)
+	assert np.array_equal(store.data[12, 3:40, 31], volume[12, 3:40, 31])
+	# All-zero chunks are not stored
+	stored = [name for name in os.listdir(os.path.join(path, "0")) if not name.startswith(".")]
+	assert 0 < len(stored) < 3*4*5
+	# Each level is the 2 x 2 x 2 mean of the one before, down to one chunk
+	assert [level.shape for level in store.levels] == [(40, 50, 70), (20, 25, 35), (10, 13, 18), (5, 7, 9)]
+	binned = volume.astype(np.float64).reshape(20, 2, 25, 2, 35, 2).mean(axis=(1, 3, 5))
+	assert np.allclose(store.levels[1][:], binned, atol=1e-6)
+
+
+def test_no_steps(tmp_path):
+	store = ot_chunkstore.ChunkStore.create(str(tmp_path / "vol.zarr"), (8, 8, 8), chunk=4)
+	with pytest.raises(IndexError):
+		store.data[::2]
+	with pytest.raises(ValueError):
+		ot_chunkstore.ChunkStore.create(str(tmp_path / "vol.zarr"), (8, 8, 8), chunk=4)
+
+
+def test_remap_zarr(remap_data):
+	mrcfile = pytest.importorskip("mrcfile")
+	args = ["avg.mrc", "120,100,60", "data.star"]
+	run_script("ot_remap_v2.py", args + ["plain.mrc", "--engine", "numpy"], remap_data)
+	run_script("ot_remap_v2.py", args + ["chunked.zarr", "--engine", "numpy", "--format", "zarr", "--chunk", 32], remap_data)
+	run_script("ot_chunkstore.py", ["chunked.zarr", "chunked.mrc"], remap_data)
+	with mrcfile.open(str(remap_data / "plain.mrc")) as a, mrcfile.open(str(remap_data / "chunked.mrc")) as b:
+		assert np.array_equal(a.data, b.data)
+		for key in ("dmin", "dmax", "dmean", "rms"):
+			assert np.isclose(a.header[key], b.header[key])
@@ -0,0 +1,36 @@
+import numpy as np
+
+import ot_imodmodel
+
+
+def test_points_round_trip(tmp_path):
+	name = str(tmp_path / "out.mod")
+	points = np.random.default_rng(0).random((250, 3))*[500, 400, 100]
+	ot_imodmodel.write_points(name, points, sphere=4)
+	back = ot_imodmodel.read_points(name)
+	# Stored as 32-bit floats
+	assert back.shape == (250, 3)
+	assert np.allclose(back, points.astype(np.float32))
+	model = ot_imodmodel.read_model(name)
+	assert len(model["objects"]) == 1
+	assert model["objects"][0]["sphere"] == 4
+
+
+def test_objects_and_contours(tmp_path):
+	name = str(tmp_path / "two.mod")
+	objects = [{"name": "a", "contours": [np.zeros((2, 3)), np.ones((3, 3))]},
+		{"name": "b", "contours": [np.full((1, 3), 7.0)]}]
+	ot_imodmodel.write_model(name, objects)
+	points, object_ids, contour_ids = ot_imodmodel.model_points(ot_imodmodel.read_model(name))
+	assert points.tolist() == [[0, 0, 0]]*2 + [[1, 1, 1]]*3 + [[7, 7, 7]]
+	assert object_ids.tolist() == [1, 1, 1, 1, 1, 2]
+	assert contour_ids.tolist() == [1, 1, 2, 2, 2, 1]
+	assert ot_imodmodel.read_points(name, objects=[2]).tolist() == [[7, 7, 7]]
+
+
+def test_nnd_reads_models(tmp_path):
+	import ot_nnd
+	points = np.random.default_rng(1).random((30, 3))*100
+	ot_imodmodel.write_points(str(tmp_path / "hits.mod"), points)
+	np.savetxt(str(tmp_path / "hits.txt"), points.astype(np.float32))
+	assert np.array_equal(ot_nnd.read_coords(str(tmp_path / "hits.mod")), ot_nnd.read_coords(str(tmp_path / "hits.txt")))
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+import ot_nnd
+from conftest import run_script
+
+
+def random_points(n, seed, integer=False):
+	rng = np.random.default_rng(seed)
+	points = rng.random((n, 3))*40
+	return np.floor(points) if integer else points
+
+
+@pytest.mark.parametrize("integer", [False, True])
+def test_tree_matches_brute(integer):
+	# Integer coordinates have many tied distances, which must be broken by index in both engines
+	points = random_points(3000, 1, integer)
+	for k in (1, 4, 11):
+		dist_t, ind_t = ot_nnd.nearest_neighbors(points, k, engine="tree", chunk=700)
+		dist_b, ind_b = ot_nnd.nearest_neighbors(points, k, engine="brute", chunk=700)
+		assert np.array_equal(ind_t, ind_b)
+		assert np.array_equal(dist_t, dist_b)
+
+
+def test_jobs_match_serial():
+	points = random_points(5000, 4, integer=True)
+	serial = ot_nnd.nearest_neighbors(points, 5, engine="tree", chunk=600)
+	parallel = ot_nnd.nearest_neighbors(points, 5, engine="tree", jobs=3, chunk=600)
+	assert np.array_equal(serial[0], parallel[0])
+	assert np.array_equal(serial[1], parallel[1])
+
+
+def test_too_few_points():
+	with pytest.raises(ValueError):
+		ot_nnd.nearest_neighbors(random_points(3, 5), 4)
+
+
+
+def test_profiles(tmp_path):
+	rng = np.random.default_rng(7)
+	sets = [rng.random((n, 3))*50 for n in (40, 60, 3)]
+	for i, points in enumerate(sets):
+		np.savetxt(str(tmp_path / ("tomo%d_hits.txt" % i)), points)
+	run_script("ot_nnd.py", ["tomo0_hits.txt", 3, 2.0, "--profile", "--bins", 5], tmp_path)
+	profile = np.loadtxt(str(tmp_path / "nn_profile.txt"))
+	dist, ind = ot_nnd.nearest_neighbors(sets[0], 4, engine="brute")
+	assert np.allclose(profile, 2.0*dist[:, 1:], atol=0.006)
+	assert np.loadtxt(str(tmp_path / "nn_hist.txt"))[:, 2:].sum(axis=0).tolist() == [40]*3
+	# Several files: one worker per file, the file with too few points skipped
+	output = run_script("ot_nnd.py", ["tomo*_hits.txt", 3, 2.0, "--profile", "--jobs", 2, "--out", "all"], tmp_path)
+	assert "Skipping tomo2_hits.txt" in output
+	table = np.loadtxt(str(tmp_path / "all_table.txt"))
+	assert table.shape == (100, 5)
+	assert np.allclose(table[:40, 2:], profile, atol=0.006)
+	summary = np.loadtxt(str(tmp_path / "all_summary.txt"))
+	assert summary[:, :3].tolist() == [[0, 1, 40], [0, 2, 40], [0, 3, 40], [1, 1, 60], [1, 2, 60], [1, 3, 60]]
+	with open(str(tmp_path / "all_files.txt")) as f:
+		assert f.read().split() == ["0", "tomo0_hits.txt", "1", "tomo1_hits.txt"]
+
+
+def test_cross_queries():
+	points, queries = random_points(2500, 2), random_points(300, 3)
+	dist, ind = ot_nnd.nearest_neighbors(points, 3, queries=queries, engine="tree")
+	d = np.sqrt(((queries[:, None] - points[None])**2).sum(axis=2))
+	assert np.allclose(dist, np.sort(d, axis=1)[:, :3])
+	assert np.array_equal(ind, np.argsort(d, axis=1, kind="mergesort")[:, :3])
+
+
+def test_pair_correlation_of_random_points():
+	# Complete spatial randomness: g(r) = 1 and L(r) = r, up to noise
+	box = np.array([100.0, 80.0, 60.0])
+	points = np.random.default_rng(6).random((4000, 3))*box
+	tree = ot_nnd.pair_correlation(points, None, box, 15.0, 10, engine="tree")
+	brute = ot_nnd.pair_correlation(points, None, box, 15.0, 10, engine="brute", jobs=2, chunk=900)
+	assert np.allclose(tree, brute)
+	assert abs(tree[2:, 3].mean() - 1) < 0.05
+	assert np.allclose(tree[-1, 5], 15.0, rtol=0.05)
+	with pytest.raises(ValueError):
+		ot_nnd.pair_correlation(points, None, box, 60.0, 10)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from conftest import run_script
+
+
+@pytest.fixture
+def hits(tmp_path):
+	points = np.random.default_rng(0).integers(0, [80, 70, 40], (150, 3))
+	np.savetxt(str(tmp_path / "hits.txt"), points, fmt="%d")
+	return tmp_path
+
+
+def ensemble(cwd, out, *options):
+	run_script("ot_nnd_ensemble.py", ["hits.txt", 1, 1.0, 80, 70, 40, 3, 12, "--out", out] + list(options), cwd)
+	return dict((name, np.loadtxt(str(cwd / ("%s_%s.txt" % (out, name))))) for name in ("envelope", "replicates"))
+
+
+def test_seed_and_jobs(hits):
+	serial = ensemble(hits, "a", "--seed", 5)
+	again = ensemble(hits, "b", "--seed", 5)
+	parallel = ensemble(hits, "c", "--seed", 5, "--jobs", 3)
+	other = ensemble(hits, "d", "--seed", 6)
+	# The replicates only depend on the seed, not on the number of processes
+	for name in serial:
+		assert np.array_equal(serial[name], again[name])
+		assert np.array_equal(serial[name], parallel[name])
+	assert not np.array_equal(serial["replicates"], other["replicates"])
+	assert len(serial["replicates"]) == 12
+	# Every replicate placed all its points at least rad apart
+	assert (serial["replicates"][:, 1] == 150).all()
+	assert (serial["replicates"][:, 2] > 3).all()
+
+
+def test_no_replicate_placed(hits, monkeypatch, capsys):
+	import ot_nnd_ensemble, ot_rand3Dcoord_rect
+	# As when a mask has room for fewer points than a Kth nearest neighbor needs
+	monkeypatch.setattr(ot_rand3Dcoord_rect, "poisson_disk", lambda *args, **kwargs: np.zeros((1, 3)))
+	monkeypatch.chdir(str(hits))
+	opts = {"--seed": 1, "--jobs": 1, "--engine": "auto", "--mask": "", "--float": False, "--npart": 0, "--bins": 10,
+		"--rmax": 0.0, "--quantiles": "0.025,0.975", "--gr": 0.0, "--out": "none", "--verbose": False}
+	with pytest.raises(SystemExit):
+		ot_nnd_ensemble.main("hits.txt", 1, 1.0, [80, 70, 40], 3, 4, opts)
+	assert "No replicate placed the 2 points" in capsys.readouterr().out
+	assert not (hits / "none_envelope.txt").exists()
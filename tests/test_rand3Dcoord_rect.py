@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from scipy.spatial import cKDTree
+
+import ot_rand3Dcoord_rect as rand3d
+from conftest import run_script
+
+
+def min_distance(points):
+	return cKDTree(points).query(points, 2)[0][:, 1].min()
+
+
+@pytest.mark.parametrize("integer", [True, False])
+def test_minimum_distance(integer):
+	rng = np.random.default_rng(1)
+	points = rand3d.poisson_disk((200, 150, 100), 3000, 8.0, rng, integer)
+	assert len(points) == 3000
+	assert min_distance(points) > 8.0
+	assert (points >= 0).all() and (points < [200, 150, 100]).all()
+	if integer:
+		assert np.array_equal(points, np.round(points))
+
+
+def test_sparse_grid():
+	# A box with far more cells than points keeps a sorted table instead of a dense one
+	points = rand3d.poisson_disk((20000, 20000, 20000), 2000, 5.0, np.random.default_rng(2))
+	assert len(points) == 2000
+	assert min_distance(points) > 5.0
+
+
+def test_seed_repeats():
+	a = rand3d.poisson_disk((100, 100, 100), 500, 6.0, np.random.default_rng(7))
+	b = rand3d.poisson_disk((100, 100, 100), 500, 6.0, np.random.default_rng(7))
+	assert np.array_equal(a, b)
+
+
+@pytest.mark.parametrize("dense", [True, False])
+def test_batch_is_sequential(dense):
+	# A batch gives what adding its proposals one at a time would
+	rng = np.random.default_rng(3)
+	for _ in range(10):
+		radius = rng.uniform(2, 10)
+		grid = rand3d.CellGrid((60, 50, 40), radius, 500, dense=dense)
+		grid.add_batch(rng.random((30, 3))*(60, 50, 40), 1000)
+		props = rng.random((400, 3))*(60, 50, 40)
+		props = props[~grid.conflicts(props)]
+		added = grid.add_batch(props, 1000)
+		kept = []
+		for p in props:
+			if all(((p - q)**2).sum() > radius**2 for q in kept):
+				kept.append(p)
+		assert np.array_equal(added, np.array(kept).reshape(-1, 3))
+
+
+def test_radius_zero():
+	# Whole voxels are taken once each; floats are placed independently
+	points = rand3d.poisson_disk((10, 10, 10), 1000, 0, np.random.default_rng(4))
+	assert len(np.unique(points, axis=0)) == 1000
+	points = rand3d.poisson_disk((10, 10, 10), 1500, 0, np.random.default_rng(4), integer=False)
+	assert len(points) == 1500
+
+
+def test_mask_region():
+	mask = np.zeros((40, 50, 60), dtype=np.int8)
+	mask[10:30, 5:45, 20:50] = 1
+	region = rand3d.MaskRegion(mask)
+	assert region.volume == mask.sum()
+	points = rand3d.poisson_disk(None, 300, 3.0, np.random.default_rng(5), region=region)
+	voxels = points.astype(int)
+	assert len(points) == 300
+	assert mask[voxels[:, 2], voxels[:, 1], voxels[:, 0]].all()
+	assert min_distance(points) > 3.0
+
+
+def test_packing_fraction_limit(tmp_path):
+	assert "cannot be placed at random" in run_script("ot_rand3Dcoord_rect.py", [50, 50, 50, 2000, 8, 0], tmp_path)
+	assert "distinct voxels" in run_script("ot_rand3Dcoord_rect.py", [5, 5, 5, 126, 0, 0], tmp_path)
+
+
+def test_outputs(tmp_path):
+	import ot_imodmodel
+	run_script("ot_rand3Dcoord_rect.py", [100, 80, 60, 200, 6, 10, "--seed", 3], tmp_path)
+	points = np.loadtxt(str(tmp_path / "out.txt"))
+	assert points.shape == (200, 3)
+	assert (points[:, 0] >= 10).all() and (points[:, 0] < 110).all()
+	assert np.allclose(ot_imodmodel.read_points(str(tmp_path / "out.mod")), points)
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from conftest import run_script
+
+mrcfile = pytest.importorskip("mrcfile")
+import ot_relion_project
+
+
+def test_slab_range():
+	assert ot_relion_project.slab_range(10, 4) == (3, 6)
+	assert ot_relion_project.slab_range(10, 3) == (4, 6)
+	assert ot_relion_project.slab_range(9, 9) == (0, 8)
+
+
+@pytest.fixture
+def subtomos(tmp_path):
+	rng = np.random.default_rng(0)
+	names, volumes = [], []
+	for i in range(7):
+		# Different depths, same image size
+		volume = rng.random((12 + i, 16, 20)).astype(np.float32)
+		name = "sub%02d.mrc" % (6 - i)
+		with mrcfile.new(str(tmp_path / name)) as mrc:
+			mrc.set_data(volume)
+			mrc.voxel_size = 4.0
+		names.append(name)
+		volumes.append(volume)
+	with open(str(tmp_path / "list.txt"), "w") as f:
+		f.write("# subtomograms\n" + "\n".join(names) + "\n")
+	return tmp_path, names, volumes
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_stack(subtomos, jobs):
+	cwd, names, volumes = subtomos
+	run_script("ot_relion_project.py", [5, "--list", "list.txt", "--jobs", jobs], cwd)
+	with mrcfile.open(str(cwd / "stack_5-slices_thick.mrcs")) as mrc:
+		stack = mrc.data.copy()
+		header = mrc.header.copy()
+		assert mrc.is_image_stack()
+		assert np.isclose(mrc.voxel_size.x, 4.0)
+	# One image per subtomogram, in the order of the list
+	assert stack.shape == (7, 16, 20)
+	for image, volume in zip(stack, volumes):
+		lower, upper = ot_relion_project.slab_range(len(volume), 5)
+		assert np.allclose(image, volume[lower:upper+1].mean(axis=0), atol=1e-6)
+	assert np.isclose(header.dmax, stack.max()) and np.isclose(header.dmean, stack.mean(), rtol=1e-5)
+
+
+def test_too_thin(subtomos):
+	cwd, names, volumes = subtomos
+	out = run_script("ot_relion_project.py", [14] + names, cwd)
+	assert "fewer than 14" in out
+	assert not (cwd / "stack_14-slices_thick.mrcs").exists()
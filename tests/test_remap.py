@@ -0,0 +1,51 @@
+import os
+import numpy as np
+import pytest
+
+from conftest import run_script
+
+mrcfile = pytest.importorskip("mrcfile")
+
+
+@pytest.fixture
+def remap_tomo(remap_data):
+	# ot_remap.py takes the output size and voxel size from a tomogram
+	with mrcfile.new(str(remap_data / "tomo.mrc")) as mrc:
+		mrc.set_data(np.zeros((60, 100, 120), dtype=np.int8))
+		mrc.voxel_size = 10.0
+	return remap_data
+
+
+def remap(cwd, jobs, spawn=False):
+	run_script("ot_remap.py", ["avg.mrc", "tomo.mrc", "data.star", 1, jobs], cwd, spawn=spawn)
+	with mrcfile.open(str(cwd / "syn_pos_cls01.mrc")) as mrc:
+		return mrc.data.copy(), mrc.header.copy()
+
+
+def test_jobs_match_serial(remap_tomo):
+	serial, header = remap(remap_tomo, 1)
+	assert serial.shape == (60, 100, 120)
+	assert serial.dtype == np.int16
+	assert serial.max() > 0
+	assert np.isclose(header.dmax, serial.max())
+	for jobs in (2, 3, 7):
+		parallel, parallel_header = remap(remap_tomo, jobs)
+		assert np.array_equal(serial, parallel)
+
+
+def test_spawn(remap_tomo):
+	forked, header = remap(remap_tomo, 3)
+	spawned, spawned_header = remap(remap_tomo, 3, spawn=True)
+	assert np.array_equal(forked, spawned)
+
+
+def scratch_dirs(*roots):
+	return set(os.path.join(root, name) for root in roots if os.path.isdir(root)
+		for name in os.listdir(root) if name.startswith("ot_remap_"))
+
+
+def test_scratch_cleaned(remap_tomo):
+	before = scratch_dirs("/dev/shm", str(remap_tomo))
+	remap(remap_tomo, 3)
+	# Partial sums are removed whichever scratch directory they went to
+	assert scratch_dirs("/dev/shm", str(remap_tomo)) <= before
@@ -0,0 +1,241 @@
+import os, sys, subprocess
+import numpy as np
+import pytest
+
+from conftest import ROOT, run_script
+
+mrcfile = pytest.importorskip("mrcfile")
+
+SIZE = "120,100,60"
+
+# Runs ot_remap_v2.py as a module and kills the process (no clean-up) after limit
+# particles have been written, as a crash would
+CRASH = """
+import os, sys, importlib.util
+path, limit = sys.argv[1], int(sys.argv[2])
+sys.argv = [path] + sys.argv[3:]
+spec = importlib.util.spec_from_file_location("remap_crash", path)
+remap = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(remap)
+add = remap.ParticleWriter.add
+written = [0]
+def add_then_crash(self, *args):
+	add(self, *args)
+	written[0] += 1
+	if written[0] == limit:
+		os._exit(3)
+remap.ParticleWriter.add = add_then_crash
+remap.main(remap.avg_file, remap.tomo_size, remap.star_file, remap.out_file)
+"""
+
+
+def remap(cwd, out, *options):
+	output = run_script("ot_remap_v2.py", ["avg.mrc", SIZE, "data.star", out, "--engine", "numpy"] + list(options), cwd)
+	with mrcfile.open(str(cwd / out)) as mrc:
+		return mrc.data.copy(), mrc.header.copy(), output
+
+
+def same_header_stats(a, b):
+	return all(np.isclose(a[key], b[key]) for key in ("dmin", "dmax", "dmean", "rms"))
+
+
+def test_angstep_cache(remap_data):
+	# Rotated averages taken from the cache are those the engine would make again
+	cached, header, output = remap(remap_data, "cached.mrc", "--angstep", 60)
+	assert "Rotation cache (60 deg steps)" in output
+	assert "9 hits / 60 lookups" in output
+	uncached, uncached_header, output = remap(remap_data, "uncached.mrc", "--angstep", 60, "--cache-mb", 0)
+	assert np.array_equal(cached, uncached)
+	# Coarse steps change the orientations, not where the particles go
+	exact, exact_header, output = remap(remap_data, "exact.mrc")
+	assert not np.array_equal(cached, exact)
+	assert np.corrcoef(cached.ravel(), exact.ravel())[0, 1] > 0.8
+
+
+def test_serial_output(remap_data):
+	data, header, output = remap(remap_data, "serial.mrc")
+	assert "numpy engine" in output
+	assert data.shape == (60, 100, 120)
+	assert data.dtype == np.float32
+	assert data.max() > 0
+
+
+def test_jobs_match_serial(remap_data):
+	serial, serial_header, output = remap(remap_data, "serial.mrc")
+	for jobs in (2, 3):
+		parallel, parallel_header, output = remap(remap_data, "parallel%d.mrc" % jobs, "--jobs", jobs)
+		assert np.array_equal(serial, parallel)
+
+
+@pytest.mark.parametrize("blend", ["sum", "first", "label"])
+def test_blend_jobs_match_serial(remap_data, blend):
+	serial, serial_header, output = remap(remap_data, "serial.mrc", "--blend", blend)
+	parallel, parallel_header, output = remap(remap_data, "parallel.mrc", "--blend", blend, "--jobs", 3)
+	assert np.array_equal(serial, parallel)
+	if blend == "label":
+		with mrcfile.open(str(remap_data / "serial_labels.mrc")) as a, mrcfile.open(str(remap_data / "parallel_labels.mrc")) as b:
+			assert np.array_equal(a.data, b.data)
+			assert a.data.max() <= 60
+
+
+def test_blends(remap_data):
+	largest, header, output = remap(remap_data, "max.mrc")
+	first, header, output = remap(remap_data, "first.mrc", "--blend", "first")
+	total, header, output = remap(remap_data, "sum.mrc", "--blend", "sum")
+	labelled, header, output = remap(remap_data, "label.mrc", "--blend", "label")
+	# The largest particle value beats a positive first one (0 counts as empty, so
+	# negative values can be overwritten); label writes what max does
+	assert (largest >= first)[first > 0].all()
+	assert np.array_equal(labelled, largest)
+	# Where only one particle reaches a voxel, every blend gives its value
+	with mrcfile.open(str(remap_data / "label_labels.mrc")) as mrc:
+		reached = mrc.data != 0
+	single = reached & np.isclose(total, largest) & np.isclose(total, first)
+	assert single.sum() > reached.sum()//2
+
+
+def test_multi(remap_data):
+	import shutil
+	for cls in (1, 2):
+		shutil.copy(str(remap_data / "avg.mrc"), str(remap_data / ("cls%03d.mrc" % cls)))
+	run_script("ot_remap_v2.py", ["cls{class:03d}.mrc", SIZE, "data.star", "m_{tomo}_{class}.mrc", "--engine", "numpy",
+		"--multi", "--blend", "sum", "--jobs", 2], remap_data)
+	outputs = sorted(name for name in os.listdir(str(remap_data)) if name.startswith("m_"))
+	assert outputs == ["m_tomo%d_%d.mrc" % (t, c) for t in (1, 2, 3) for c in (1, 2)]
+	# Every particle is in the output of its tomogram and class (rows i with i % 3 and i % 2)
+	total = 0
+	for name in outputs:
+		with mrcfile.open(str(remap_data / name)) as mrc:
+			total += mrc.data.astype(float).sum()
+	serial, header, output = remap(remap_data, "serial.mrc", "--blend", "sum")
+	assert np.isclose(total, serial.astype(float).sum(), rtol=1e-3)
+
+
+def test_multi_roi_spawn(remap_data):
+	# Spawned workers get the ROI from the job, not from main()
+	args = ["avg.mrc", SIZE, "data.star", "{tomo}_{class}.mrc", "--engine", "numpy", "--multi", "--roi", "20,10,5,90,70,45"]
+	run_script("ot_remap_v2.py", args, remap_data)
+	os.mkdir(str(remap_data / "spawn"))
+	run_script("ot_remap_v2.py", args[:3] + ["spawn/{tomo}_{class}.mrc"] + args[4:] + ["--jobs", 2], remap_data, spawn=True)
+	outputs = sorted(os.listdir(str(remap_data / "spawn")))
+	assert outputs == sorted(name for name in os.listdir(str(remap_data)) if name.startswith("tomo"))
+	for name in outputs:
+		with mrcfile.open(str(remap_data / name)) as a, mrcfile.open(str(remap_data / "spawn" / name)) as b:
+			assert np.array_equal(a.data, b.data)
+			assert (int(b.header.nxstart), int(b.header.nystart), int(b.header.nzstart)) == (20, 10, 5)
+			assert np.isclose(b.header.cella.x/b.header.mx, 10.0)
+
+
+@pytest.mark.parametrize("blend", ["max", "sum"])
+def test_order_and_window(remap_data, blend):
+	# Overlapping particles are written in star file order whatever the order of the rest
+	serial, header, output = remap(remap_data, "serial.mrc", "--blend", blend)
+	for order in ("morton", "hilbert"):
+		for window in (1, 4):
+			ordered, ordered_header, output = remap(remap_data, "%s%d.mrc" % (order, window), "--blend", blend,
+				"--order", order, "--window", window)
+			assert np.array_equal(serial, ordered)
+
+
+@pytest.mark.parametrize("options", [["--blend", "max"], ["--blend", "first"], ["--blend", "sum", "--jobs", 3],
+	["--window", 4, "--order", "hilbert"]])
+def test_header_stats(remap_data, options):
+	# Kept while writing, they are what a pass over the finished output gives
+	data, header, output = remap(remap_data, "out.mrc", *options)
+	data = data.astype(np.float64)
+	assert header.dmin == np.float32(data.min()) and header.dmax == np.float32(data.max())
+	assert np.isclose(header.dmean, data.mean(), rtol=1e-5)
+	assert np.isclose(header.rms, data.std(), rtol=1e-5)
+
+
+def crash_after(cwd, limit, args):
+	env = dict(os.environ, PYTHONPATH=ROOT)
+	crash = subprocess.run([sys.executable, "-c", CRASH, os.path.join(ROOT, "ot_remap_v2.py"), str(limit)] + [str(a) for a in args],
+		cwd=str(cwd), env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+	assert crash.returncode == 3, crash.stdout
+
+
+@pytest.mark.parametrize("blend", ["max", "label"])
+def test_resume(remap_data, blend):
+	complete, header, output = remap(remap_data, "complete.mrc", "--blend", blend, "--checkpoint", 10)
+	args = ["avg.mrc", SIZE, "data.star", "resumed.mrc", "--engine", "numpy", "--blend", blend, "--checkpoint", 10]
+	crash_after(remap_data, 25, args)
+	assert os.path.exists(str(remap_data / "resumed.mrc.journal.npz"))
+	output = run_script("ot_remap_v2.py", args + ["--resume"], remap_data)
+	assert "Resuming after particle 20" in output
+	with mrcfile.open(str(remap_data / "resumed.mrc")) as mrc:
+		assert np.array_equal(mrc.data, complete)
+		assert same_header_stats(mrc.header, header)
+	if blend == "label":
+		with mrcfile.open(str(remap_data / "complete_labels.mrc")) as a, mrcfile.open(str(remap_data / "resumed_labels.mrc")) as b:
+			assert np.array_equal(a.data, b.data)
+	# The journal and undo log go when the run completes
+	assert not [name for name in os.listdir(str(remap_data)) if "journal" in name or "undo" in name]
+
+
+@pytest.mark.parametrize("method", ["fourier", "mean"])
+def test_binned_preview(remap_data, method):
+	full, header, output = remap(remap_data, "full.mrc", "--blend", "sum")
+	binned, binned_header, output = remap(remap_data, "bin2.mrc", "--blend", "sum", "--bin", 2, "--bin-method", method)
+	assert binned.shape == (30, 50, 60)
+	# Summed densities per binned voxel follow the means of 2 x 2 x 2 full voxels
+	reference = full.reshape(30, 2, 50, 2, 60, 2).mean(axis=(1, 3, 5))
+	assert np.corrcoef(binned.ravel(), reference.ravel())[0, 1] > 0.95
+
+
+def test_roi(remap_data):
+	full, header, output = remap(remap_data, "full.mrc")
+	roi, roi_header, output = remap(remap_data, "roi.mrc", "--roi", "20,10,5,90,70,45")
+	assert roi.shape == (40, 60, 70)
+	assert np.array_equal(roi, full[5:45, 10:70, 20:90])
+	assert (int(roi_header.nxstart), int(roi_header.nystart), int(roi_header.nzstart)) == (20, 10, 5)
+	assert np.isclose(roi_header.cella.x/roi_header.mx, 10.0)
+	assert np.isclose(roi_header.origin.x, -200.0)
+	# Particles whose boxes miss the ROI are not remapped
+	assert "21 of 60 particles can touch it" in output
+
+
+def test_roi_mask(remap_data):
+	full, header, output = remap(remap_data, "full.mrc", "--blend", "sum")
+	mask = np.zeros((60, 100, 120), dtype=np.int8)
+	mask[20:30, 40:50, 50:70] = 1
+	with mrcfile.new(str(remap_data / "mask.mrc")) as mrc:
+		mrc.set_data(mask)
+	roi, roi_header, output = remap(remap_data, "roi.mrc", "--blend", "sum", "--roi-mask", "mask.mrc")
+	assert roi.shape == (10, 10, 20)
+	# Every particle with a box over the masked voxels is remapped, so they come out as in the full output
+	assert np.allclose(roi, full[20:30, 40:50, 50:70])
+
+
+@pytest.mark.parametrize("broken", [False, True])
+def test_xforms_cache(remap_data, broken):
+	complete, header, output = remap(remap_data, "complete.mrc", "--checkpoint", 10)
+	# Only --checkpoint runs keep the transforms, and only until they finish
+	plain, plain_header, output = remap(remap_data, "plain.mrc")
+	assert not [name for name in os.listdir(str(remap_data)) if "xforms" in name]
+	args = ["avg.mrc", SIZE, "data.star", "resumed.mrc", "--engine", "numpy", "--checkpoint", 10]
+	crash_after(remap_data, 25, args)
+	assert [name for name in os.listdir(str(remap_data)) if "xforms" in name] == ["resumed.mrc.xforms.npz"]
+	if broken:
+		# A cache cut short is worked out again
+		with open(str(remap_data / "resumed.mrc.xforms.npz"), "wb") as f:
+			f.write(b"not a zip file")
+	run_script("ot_remap_v2.py", args + ["--resume"], remap_data)
+	with mrcfile.open(str(remap_data / "resumed.mrc")) as mrc:
+		assert np.array_equal(mrc.data, complete)
+	assert sorted(os.listdir(str(remap_data))) == ["avg.mrc", "complete.mrc", "data.star", "data.star.npz", "plain.mrc", "resumed.mrc"]
+
+
+@pytest.mark.parametrize("options", [[], ["--blend", "sum", "--roi", "10,0,3,110,90,57"]])
+def test_shards(remap_data, options):
+	serial, header, output = remap(remap_data, "serial.mrc", *options)
+	for i in range(3):
+		run_script("ot_remap_v2.py", ["avg.mrc", SIZE, "data.star", "sharded.mrc", "--engine", "numpy", "--shard", "%d/3" % i] + options,
+			remap_data)
+		assert os.path.exists(str(remap_data / ("sharded_shard%dof3.mrc" % i)))
+	merged, merged_header, output = remap(remap_data, "sharded.mrc", "--merge", 3, *options)
+	# Bit for bit what a single run writes
+	assert np.array_equal(serial, merged)
+	assert same_header_stats(header, merged_header)
+	assert [int(v) for v in (merged_header.nxstart, merged_header.nystart, merged_header.nzstart)] == [int(v) for v in
+		(header.nxstart, header.nystart, header.nzstart)]
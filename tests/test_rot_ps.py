@@ -0,0 +1,63 @@
+import os, importlib.util
+import numpy as np
+import pytest
+
+from conftest import ROOT, run_script
+
+# The script's name is not a module name
+spec = importlib.util.spec_from_file_location("ot_rot_ps", os.path.join(ROOT, "ot_rot-ps.py"))
+rot_ps = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(rot_ps)
+
+
+def flower(n=128, fold=7, offset=0.0):
+	# Petals of an n-fold symmetric pattern about the image center, on a constant background
+	y, x = np.mgrid[:n, :n] - n//2
+	r, theta = np.hypot(x, y), np.arctan2(y, x)
+	return offset + np.exp(-(r - 30)**2/60.0)*(1 + np.cos(fold*theta))
+
+
+def test_correlation():
+	corr = rot_ps.polar_correlation(rot_ps.normalize_edgemean(flower()), 1.0)
+	assert len(corr) == 360
+	assert np.isclose(corr[0], 1.0)
+	# Turned by one petal, the image is itself again
+	assert np.isclose(corr[int(round(360/7.0))], 1.0, atol=0.05)
+	# and half a petal puts petals on gaps
+	assert corr[int(round(180/7.0))] < 0.5
+
+
+@pytest.mark.parametrize("fold", [5, 7, 12])
+def test_strongest_symmetry(fold):
+	ps = rot_ps.power_spectrum(rot_ps.polar_correlation(rot_ps.normalize_edgemean(flower(fold=fold)), 1.0))
+	assert np.argmax(ps[1:len(ps)//2]) + 1 == fold
+
+
+def test_spectrum_independent_of_step():
+	img = rot_ps.normalize_edgemean(flower())
+	coarse = rot_ps.power_spectrum(rot_ps.polar_correlation(img, 1.0))
+	fine = rot_ps.power_spectrum(rot_ps.polar_correlation(img, 0.5))
+	assert np.allclose(coarse[:30], fine[:30], rtol=1e-2, atol=1e-2*coarse[7])
+
+
+def test_background_does_not_matter():
+	a = rot_ps.polar_correlation(rot_ps.normalize_edgemean(flower()), 2.0)
+	b = rot_ps.polar_correlation(rot_ps.normalize_edgemean(flower(offset=50.0)), 2.0)
+	assert np.allclose(a, b, atol=1e-6)
+
+
+def test_script(tmp_path):
+	mrcfile = pytest.importorskip("mrcfile")
+	with mrcfile.new(str(tmp_path / "flower.mrc")) as mrc:
+		mrc.set_data(flower().astype(np.float32))
+	out = run_script("ot_rot-ps.py", ["flower.mrc", 20, "--noplot"], tmp_path)
+	assert "Strongest symmetries: 7-fold" in out
+	corr = np.loadtxt(str(tmp_path / "corr_flower.txt"))
+	assert corr.shape == (360, 2)
+	assert len(np.loadtxt(str(tmp_path / "ps_flower.txt"))) == 360
+	assert "--step must be" in run_script("ot_rot-ps.py", ["flower.mrc", 20, "--noplot", "--step", 10], tmp_path)
+	# Harmonics above max_sym (14-fold here) are not reported
+	out = run_script("ot_rot-ps.py", ["flower.mrc", 10, "--noplot"], tmp_path)
+	line = [line for line in out.splitlines() if line.startswith("Strongest symmetries")][0]
+	assert line.startswith("Strongest symmetries: 7-fold")
+	assert all(int(fold.split("-")[0]) <= 10 for fold in line.split(": ")[1].split(", "))
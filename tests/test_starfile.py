@@ -0,0 +1,82 @@
+import os
+import numpy as np
+import pytest
+
+import ot_starfile
+
+STAR_31 = """
+# version 30001
+
+data_optics
+
+loop_
+_rlnOpticsGroup #1
+_rlnOpticsGroupName #2
+_rlnImagePixelSize #3
+1 opticsGroup1 2.0
+2 opticsGroup2 4.0
+
+# version 30001
+
+data_particles
+
+loop_
+_rlnCoordinateX #1
+_rlnCoordinateY #2
+_rlnOriginXAngst #3
+_rlnOpticsGroup #4
+_rlnMicrographName #5
+10.5 20.0 4.0 1 tomo1.mrc
+30.0 40.0 -8.0 2 tomo2.mrc
+# a comment line
+50.0 60.0 0.0 1 tomo1.mrc
+"""
+
+
+@pytest.fixture
+def star(tmp_path):
+	name = str(tmp_path / "run_data.star")
+	with open(name, "w") as f:
+		f.write(STAR_31)
+	return name
+
+
+def test_blocks(star):
+	blocks = ot_starfile.read_star_blocks(star, cache=False)
+	assert list(blocks) == ["optics", "particles"]
+	assert blocks["particles"]["rlnCoordinateX"].tolist() == [10.5, 30.0, 50.0]
+	assert blocks["particles"]["rlnMicrographName"].tolist() == ["tomo1.mrc", "tomo2.mrc", "tomo1.mrc"]
+	assert blocks["optics"]["rlnOpticsGroupName"].tolist() == ["opticsGroup1", "opticsGroup2"]
+
+
+def test_particles_with_optics(star):
+	parts = ot_starfile.read_particles(star, ["rlnCoordinateY", "rlnOriginX", "rlnImagePixelSize"], cache=False)
+	assert parts.dtype.names == ("rlnCoordinateY", "rlnOriginX", "rlnImagePixelSize")
+	# Angstrom shifts divided by the pixel size of each particle's optics group
+	assert parts["rlnOriginX"].tolist() == [2.0, -2.0, 0.0]
+	assert parts["rlnImagePixelSize"].tolist() == [2.0, 4.0, 2.0]
+	with pytest.raises(KeyError):
+		ot_starfile.read_particles(star, ["rlnAngleRot"], cache=False)
+
+
+def test_cache(star):
+	first = ot_starfile.read_particles(star, ["rlnCoordinateX"])
+	assert os.path.exists(star + ".npz")
+	assert np.array_equal(ot_starfile.read_particles(star, ["rlnCoordinateX"]), first)
+	# A changed star file is parsed again
+	with open(star, "a") as f:
+		f.write("70.0 80.0 0.0 2 tomo3.mrc\n")
+	assert ot_starfile.read_particles(star, ["rlnCoordinateX"])["rlnCoordinateX"].tolist() == [10.5, 30.0, 50.0, 70.0]
+
+
+def test_broken_cache(star):
+	ot_starfile.read_particles(star, ["rlnCoordinateX"])
+	with open(star + ".npz", "r+b") as f:
+		f.truncate(50)
+	assert ot_starfile.read_particles(star, ["rlnCoordinateX"])["rlnCoordinateX"].tolist() == [10.5, 30.0, 50.0]
+	with open(star + ".npz", "wb") as f:
+		f.write(b"not a zip file")
+	assert ot_starfile.read_particles(star, ["rlnCoordinateX"])["rlnCoordinateX"].tolist() == [10.5, 30.0, 50.0]
+	# Rewritten, and no temporary files left behind
+	assert ot_starfile._load_sidecar(star) is not None
+	assert sorted(os.listdir(os.path.dirname(star))) == ["run_data.star", "run_data.star.npz"]
@@ -0,0 +1,79 @@
+import numpy as np
+
+import ot_xform
+
+
+def blob(n=24, sigma2=12.0):
+	# Smooth, off-centre blob that vanishes well inside the box
+	z, y, x = np.mgrid[:n, :n, :n]
+	return (np.exp(-((x - 10)**2 + (y - 13)**2 + (z - 12)**2)/sigma2)).astype(np.float32)
+
+
+def test_identity():
+	avg = blob()
+	out = ot_xform.resample(avg, ot_xform.spider_matrices(0, 0, 0))
+	assert out.shape == (1,) + avg.shape
+	assert np.allclose(out[0], avg, atol=1e-6)
+
+
+def test_rotation_matrices():
+	mats = ot_xform.spider_matrices([0, 30, 10], [0, 40, 170], [0, 50, -60])
+	assert np.allclose(mats[0], np.eye(3))
+	assert np.allclose(np.einsum("nij,nkj->nik", mats, mats), np.eye(3))
+	assert np.allclose(np.linalg.det(mats), 1)
+
+
+def test_quarter_turns():
+	# Four quarter turns about z map voxels onto voxels and give the average back
+	avg = blob()
+	quarter = ot_xform.spider_matrices(90, 0, 0)
+	out = avg
+	for _ in range(4):
+		out = ot_xform.resample(out, quarter)[0]
+	assert np.allclose(out, avg, atol=1e-3)
+	# A half turn about z is a flip of x and y about the rotation centre (12, 12)
+	half = ot_xform.resample(avg, ot_xform.spider_matrices(180, 0, 0))[0]
+	assert np.allclose(half[:, 1:, 1:], avg[:, :0:-1, :0:-1], atol=1e-3)
+
+
+def test_shifts_and_batches():
+	avg = blob()
+	rng = np.random.default_rng(0)
+	angles = rng.uniform(-180, 180, (5, 3))
+	mats = ot_xform.spider_matrices(angles[:, 0], angles[:, 1], angles[:, 2])
+	shifts = rng.uniform(-2, 2, (5, 3))
+	batch = ot_xform.resample(avg, mats, shifts)
+	# Each particle comes out the same whatever batch it is resampled in
+	for i in range(5):
+		assert np.array_equal(batch[i], ot_xform.resample(avg, mats[i:i+1], shifts[i:i+1])[0])
+	# A whole-voxel shift moves the data by that many voxels (x, y, z)
+	moved = ot_xform.resample(avg, ot_xform.spider_matrices(0, 0, 0), [[2, -1, 3]])[0]
+	assert np.allclose(moved[3:, :-1, 2:], avg[:-3, 1:, :-2], atol=1e-6)
+
+
+
+def test_memory_budget():
+	avg = blob()
+	rng = np.random.default_rng(1)
+	angles = rng.uniform(-180, 180, (6, 3))
+	mats = ot_xform.spider_matrices(angles[:, 0], angles[:, 1], angles[:, 2])
+	shifts = rng.uniform(-2, 2, (6, 3))
+	whole = ot_xform.resample(avg, mats, shifts)
+	# A few particles, or part of one particle's voxels, per interpolation give the same result
+	for max_bytes in (3*52*avg.size, 52*1000, 52*997):
+		assert np.array_equal(ot_xform.resample(avg, mats, shifts, max_bytes=max_bytes), whole)
+	assert ot_xform.batch_limit((256, 256, 256)) == 4
+	assert ot_xform.batch_limit((512, 512, 512)) == 1
+	assert ot_xform.batch_limit((24, 24, 24), max_bytes=4*24**3*10) == 10
+
+
+def test_binning():
+	avg = blob(sigma2=40.0)
+	mean = ot_xform.bin_mean(avg, 2)
+	assert mean.shape == (12, 12, 12)
+	assert np.isclose(mean[5, 6, 5], avg[10:12, 12:14, 10:12].mean())
+	# The mean of the volume is kept, and a smooth volume bins alike either way
+	fourier = ot_xform.bin_fourier(avg, 2)
+	assert np.isclose(fourier.mean(), avg.mean(), rtol=1e-5)
+	assert np.abs(fourier - mean).max() < 0.02*avg.max()
+	assert np.allclose(ot_xform.bin_fourier(np.full((8, 8, 8), 3.0), 4), 3.0)